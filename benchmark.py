@@ -0,0 +1,1129 @@
+#!/usr/bin/python3
+"""
+This file contains benchmarks.
+Run `./benchmark.py [<name> ...]`; all benchmarks are run by default.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from source import log
+from source import ensa
+from source import lib
+from source.db import Database, sqlite
+
+benchmarks = OrderedDict()
+
+
+def benchmark(function):
+    benchmarks[function.__name__] = function
+    return function
+
+
+def measure(function, repeat=5):
+    """
+    Returns the best wall time of `repeat` runs in milliseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = (time.perf_counter() - start) * 1000
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def populate(cnx, subjects=2000, infos_per_subject=20, times=5000,
+             locations=500, associations=10000):
+    """
+    Fills an empty database (files/schema.sql) with one synthetic ring.
+    """
+    random.seed(0)
+    now = datetime(2018, 1, 1)
+    cnx.execute("INSERT INTO Ring(ring_id, name, reference_time_id) "
+                "VALUES(1, 'BENCHMARK', 1)")
+    cnx.executemany("INSERT INTO Time(time_id, ring_id, time, modified) "
+                    "VALUES(?, 1, ?, ?)",
+                    [(t, (now - timedelta(days=t)).strftime('%Y-%m-%d %H:%M:%S'),
+                      now) for t in range(1, times + 1)])
+    cnx.executemany("INSERT INTO Location(location_id, ring_id, name, "
+                    "                     lat, lon, modified) "
+                    "VALUES(?, 1, ?, ?, ?, ?)",
+                    [(l, 'location %d' % l, random.uniform(-80, 80),
+                      random.uniform(-170, 170), now)
+                     for l in range(1, locations + 1)])
+    cnx.executemany("INSERT INTO Subject(subject_id, ring_id, codename, created) "
+                    "VALUES(?, 1, ?, ?)",
+                    [(s, 'subject%d' % s, now) for s in range(1, subjects + 1)])
+    names = ['codename', 'firstname', 'lastname', 'nickname', 'likes',
+             'dislikes', 'skill', 'trait', 'city', 'street']
+    infos = [(s * infos_per_subject + i, s, names[i % len(names)], now)
+             for s in range(1, subjects + 1)
+             for i in range(infos_per_subject)]
+    cnx.executemany("INSERT INTO Information(information_id, subject_id, "
+                    "                        type, name, modified) "
+                    "VALUES(?, ?, 0, ?, ?)", infos)
+    cnx.executemany("INSERT INTO Text(information_id, value) VALUES(?, ?)",
+                    [(i[0], 'value %d' % i[0]) for i in infos])
+    cnx.executemany("INSERT INTO Active(information_id, time_id, active) "
+                    "VALUES(?, 1, 1)", [(i[0],) for i in infos])
+    cnx.executemany("INSERT OR IGNORE INTO Composite(information_id, part_id) "
+                    "VALUES(?, ?)",
+                    [(i[0], i[0] + 1) for i in infos[::infos_per_subject]])
+    cnx.executemany("INSERT INTO Association(association_id, ring_id, "
+                    "                        modified, note) "
+                    "VALUES(?, 1, ?, ?)",
+                    [(a, now, 'association %d' % a)
+                     for a in range(1, associations + 1)])
+    cnx.executemany("INSERT OR IGNORE INTO AI(association_id, information_id) "
+                    "VALUES(?, ?)",
+                    [(a, random.choice(infos)[0])
+                     for a in range(1, associations + 1) for _ in range(2)])
+    cnx.executemany("INSERT OR IGNORE INTO AT(association_id, time_id) "
+                    "VALUES(?, ?)",
+                    [(a, random.randint(1, times))
+                     for a in range(1, associations + 1)])
+    cnx.executemany("INSERT OR IGNORE INTO AL(association_id, location_id) "
+                    "VALUES(?, ?)",
+                    [(a, random.randint(1, locations))
+                     for a in range(1, associations + 1, 3)])
+    cnx.executemany("INSERT INTO Keyword(keyword_id, keyword) VALUES(?, ?)",
+                    [(k, 'keyword%d' % k) for k in range(1, 21)])
+    cnx.executemany("INSERT OR IGNORE INTO IK(information_id, keyword_id) "
+                    "VALUES(?, ?)",
+                    [(i[0], random.randint(1, 20)) for i in infos])
+    cnx.commit()
+
+
+@contextmanager
+def sandbox():
+    """
+    Runs the enclosed code in a temporary directory with its own
+    files/ (schema and binary content), so real data is never touched.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'files', 'binary'))
+        shutil.copy('files/schema.sql', os.path.join(directory, 'files'))
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def connect_empty(directory):
+    """
+    Creates a new database from files/schema.sql without migrations.
+    """
+    cnx = sqlite.connect(os.path.join(directory, 'benchmark.db'))
+    cnx.execute("PRAGMA key='benchmark'")
+    with open('files/schema.sql', 'r') as f:
+        cnx.executescript(f.read())
+    return cnx
+
+
+"""
+Query plans and timing of typical db.py queries before/after migrations
+"""
+information_columns = ("SELECT I.information_id, I.subject_id, S.codename, "
+                       "       I.type, I.name, I.level, I.accuracy, I.valid, "
+                       "       I.modified, I.note "
+                       "FROM Subject S INNER JOIN Information I "
+                       "     ON S.subject_id = I.subject_id ")
+association_columns = ("SELECT DISTINCT A.association_id, A.ring_id, A.level, "
+                       "       A.accuracy, A.valid, A.modified, A.note ")
+index_queries = [
+    ('informations of subject',
+     information_columns +
+     "WHERE I.subject_id = 1000 ORDER BY I.name, I.information_id"),
+    ('informations of ring (no parts)',
+     information_columns +
+     "WHERE S.ring_id = 1 "
+     "      AND I.information_id NOT IN (SELECT part_id FROM Composite) "
+     "ORDER BY I.name, I.information_id"),
+    ('activity of subject informations',
+     "SELECT A.information_id, T.time, A.active "
+     "FROM Time T INNER JOIN Active A ON T.time_id = A.time_id "
+     "WHERE A.information_id IN "
+     "    (SELECT information_id FROM Information WHERE subject_id = 1000) "
+     "ORDER BY T.time"),
+    ('associations by information',
+     association_columns +
+     "FROM Association A INNER JOIN AI "
+     "     ON A.association_id = AI.association_id "
+     "WHERE information_id IN (20001, 20002, 20003) "
+     "ORDER BY A.association_id"),
+    ('associations by time',
+     association_columns +
+     "FROM Association A INNER JOIN AT "
+     "     ON A.association_id = AT.association_id "
+     "WHERE time_id IN (10, 20, 30) ORDER BY A.association_id"),
+    ('associations by location',
+     association_columns +
+     "FROM Association A INNER JOIN AL "
+     "     ON A.association_id = AL.association_id "
+     "WHERE location_id IN (10, 20, 30) ORDER BY A.association_id"),
+    ('associations of ring',
+     "SELECT association_id, note FROM Association WHERE ring_id = 1"),
+    ('times of ring',
+     "SELECT time_id, time FROM Time WHERE ring_id = 1 ORDER BY time"),
+    ('timeline by range',
+     association_columns +
+     "FROM Association A "
+     "     INNER JOIN AT ON A.association_id = AT.association_id "
+     "     INNER JOIN Time T ON T.time_id = AT.time_id "
+     "WHERE T.time BETWEEN '2010-01-01' AND '2010-02-01' ORDER BY T.time"),
+    ('locations of ring',
+     "SELECT location_id, name FROM Location WHERE ring_id = 1 ORDER BY name"),
+    ('informations for keywords (AND)',
+     "SELECT information_id FROM IK "
+     "WHERE keyword_id IN (SELECT keyword_id FROM Keyword "
+     "                     WHERE keyword IN ('keyword1', 'keyword2')) "
+     "GROUP BY information_id HAVING COUNT(keyword_id) = 2"),
+    ('composites of part',
+     "SELECT information_id FROM Composite WHERE part_id = 20001"),
+]
+
+
+@benchmark
+def indexes():
+    with tempfile.TemporaryDirectory() as directory:
+        cnx = connect_empty(directory)
+        populate(cnx)
+        for phase in ('before', 'after'):
+            if phase == 'after':
+                for statements in Database.MIGRATIONS:
+                    for statement in statements:
+                        cnx.execute(statement)
+                cnx.commit()
+            print('--- %s migrations ---' % phase)
+            for description, query in index_queries:
+                plan = [row[3] for row in
+                        cnx.execute('EXPLAIN QUERY PLAN ' + query)]
+                duration = measure(lambda: cnx.execute(query).fetchall())
+                print('%-40s %10.3f ms' % (description, duration))
+                for line in plan:
+                    print('    %s' % line)
+        cnx.close()
+
+
+
+"""
+Datetime parsing - lib.datetime_from_str() against the former strptime loop
+"""
+def legacy_datetime_from_str(string, only_date=False, only_time=False):
+    tries = [
+        ('dt', '%Y-%m-%d %H:%M:%S.%f', not only_date and not only_time),
+        ('dt', '%Y-%m-%d %H:%M:%S',    not only_date and not only_time),
+        ('dt', '%Y-%m-%d %H:%M',       not only_date and not only_time),
+        ('d',  '%Y-%m-%d',             not only_time),
+        ('d',  '%Y',                   not only_time),
+        ('t',  '%H:%M:%S',             not only_date),
+        ('t',  '%H:%M',                not only_date),
+    ]
+    for format_type, format_string, condition in tries:
+        try:
+            if not condition:
+                continue
+            result = datetime.strptime(string, format_string)
+            if format_type == 't':
+                reference = ensa.variables['reference_time']
+                result = result.replace(year=reference.year,
+                                        month=reference.month,
+                                        day=reference.day)
+            return (format_type, result)
+        except:
+            continue
+    return (None, None)
+
+
+@benchmark
+def datetime_parsing():
+    ensa.variables['reference_time'] = datetime(2018, 6, 1, 12, 0)
+    random.seed(0)
+    samples = OrderedDict()
+    samples['canonical (unique)'] = [
+        (datetime(2000, 1, 1) + timedelta(seconds=random.randint(0, 10**9))
+         ).strftime('%Y-%m-%d %H:%M:%S') for _ in range(20000)]
+    samples['canonical (repeated)'] = [
+        random.choice(samples['canonical (unique)'][:200])
+        for _ in range(20000)]
+    samples['date only'] = [x[:10] for x in samples['canonical (unique)']]
+    samples['time only'] = [x[11:16] for x in samples['canonical (unique)']]
+    samples['year only'] = [x[:4] for x in samples['canonical (unique)']]
+    """ check results first """
+    for strings in samples.values():
+        for string in strings[:2000]:
+            for flags in ((False, False), (True, False), (False, True)):
+                expected = legacy_datetime_from_str(string, *flags)
+                if expected == (None, None):
+                    continue
+                got = lib.datetime_from_str(
+                    string, *flags, also_return_type=True)
+                if got != expected:
+                    log.err('Mismatch for %s %s: %s != %s'
+                            % (string, flags, got, expected))
+                    return
+    cache_size = ensa.config['cache.datetime'].value
+    print('%-24s %12s %12s %12s' % ('', 'strptime', 'no cache', 'cache'))
+    for description, strings in samples.items():
+        legacy = measure(lambda: [legacy_datetime_from_str(x)
+                                  for x in strings], repeat=3)
+        ensa.config['cache.datetime'].value = 0
+        uncached = measure(lambda: [lib.datetime_from_str(x)
+                                    for x in strings], repeat=3)
+        ensa.config['cache.datetime'].value = cache_size
+        lib.datetime_cache.clear()
+        cached = measure(lambda: [lib.datetime_from_str(x)
+                                  for x in strings], repeat=3)
+        print('%-24s %9.1f ms %9.1f ms %9.1f ms'
+              % (description, legacy, uncached, cached))
+
+
+
+"""
+Standardization - birth/death dates of a large ring converted to Time entries
+"""
+@benchmark
+def standardize(subjects=50000):
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        now = datetime(2018, 1, 1)
+        cnx = ensa.db.cnx
+        cnx.execute("INSERT INTO Ring(ring_id, name, reference_time_id) "
+                    "VALUES(1, 'BENCHMARK', 1)")
+        cnx.execute("INSERT INTO Time(time_id, ring_id, time, modified) "
+                    "VALUES(1, 1, '2018-01-01 00:00:00', ?)", (now,))
+        cnx.executemany("INSERT INTO Subject(subject_id, ring_id, codename, "
+                        "                    created) "
+                        "VALUES(?, 1, ?, ?)",
+                        [(s, 'subject%d' % s, now)
+                         for s in range(1, subjects + 1)])
+        infos = []
+        for s in range(1, subjects + 1):
+            for i, (name, value) in enumerate([
+                    ('codename', 'subject%d' % s), ('birth_year', '1980'),
+                    ('birth_month', str(s % 12 + 1)),
+                    ('birth_day', str(s % 28 + 1))]):
+                infos.append((s * 4 + i, s, name, value))
+        cnx.executemany("INSERT INTO Information(information_id, subject_id, "
+                        "                        type, name, accuracy, "
+                        "                        modified) "
+                        "VALUES(?, ?, 0, ?, 5, ?)",
+                        [(i[0], i[1], i[2], now) for i in infos])
+        cnx.executemany("INSERT INTO Text(information_id, value) "
+                        "VALUES(?, ?)", [(i[0], i[3]) for i in infos])
+        cnx.executemany("INSERT INTO Active(information_id, time_id, active) "
+                        "VALUES(?, 1, 1)", [(i[0],) for i in infos])
+        cnx.commit()
+        ensa.current_ring = 1
+        ensa.current_subject = None
+        ensa.variables['reference_time'] = now
+        start = time.perf_counter()
+        ensa.db.standardize()
+        duration = time.perf_counter() - start
+        print('%d subjects standardized in %.2f s'
+              % (subjects, duration))
+        ensa.db.cnx.close()
+
+
+
+"""
+Associating - link inserts must not scan link tables
+"""
+def legacy_associate_information(cnx, association_id, information_id):
+    """
+    Former Database.associate_information: COUNT(*) of AI before
+    and after the insert tells whether anything was linked.
+    """
+    count_before = cnx.execute("SELECT COUNT(*) FROM AI").fetchone()[0]
+    cnx.execute("INSERT INTO AI(association_id, information_id) "
+                "SELECT ?, information_id "
+                "FROM Information "
+                "WHERE information_id IN (%d) "
+                "      AND subject_id IN "
+                "          (SELECT subject_id FROM Subject WHERE ring_id = 1)"
+                % information_id, (association_id,))
+    count_after = cnx.execute("SELECT COUNT(*) FROM AI").fetchone()[0]
+    cnx.execute("UPDATE Association SET modified = ? "
+                "WHERE association_id = ?", (datetime.now(), association_id))
+    cnx.commit()
+    return count_before != count_after
+
+
+@benchmark
+def associate(associations=500000, calls=20, batch=10000):
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        populate(ensa.db.cnx, associations=associations)
+        ensa.current_ring = 1
+        ensa.current_subject = None
+        cnx = ensa.db.cnx
+        print('%d AI, %d AT, %d AL rows'
+              % tuple(cnx.execute("SELECT COUNT(*) FROM %s" % table)
+                      .fetchone()[0] for table in ('AI', 'AT', 'AL')))
+        new_ids = iter(range(associations + 1, associations + 1000000))
+        infos = [i[0] for i in cnx.execute(
+            "SELECT information_id FROM Information")]
+
+        def new_association():
+            association_id = next(new_ids)
+            cnx.execute("INSERT INTO Association(association_id, ring_id, "
+                        "                        modified) "
+                        "VALUES(?, 1, ?)", (association_id, datetime.now()))
+            return association_id
+
+        for description, function in (
+                ('legacy (COUNT(*) probes)',
+                 lambda a: legacy_associate_information(cnx, a,
+                                                        random.choice(infos))),
+                ('associate_information',
+                 lambda a: ensa.db.associate_information(
+                     a, [random.choice(infos)])),
+                ('associate_time',
+                 lambda a: ensa.db.associate_time(
+                     a, [random.randint(1, 5000)]))):
+            association_ids = [new_association() for _ in range(calls)]
+            cnx.commit()
+            start = time.perf_counter()
+            for association_id in association_ids:
+                function(association_id)
+            print('%-28s %8.2f ms per call'
+                  % (description,
+                     (time.perf_counter() - start) * 1000 / calls))
+        association_ids = [new_association() for _ in range(batch // 10)]
+        cnx.commit()
+        pairs = [(a, i) for a in association_ids
+                 for i in random.sample(infos, 10)]
+        start = time.perf_counter()
+        linked = ensa.db.associate('information', pairs)
+        print('%-28s %8.2f ms for %d pairs (%d linked)'
+              % ('associate (batch)', (time.perf_counter() - start) * 1000,
+                 len(pairs), linked or 0))
+        ensa.db.cnx.close()
+
+
+"""
+Cleanup - composites and keywords touched by an operation only
+"""
+@benchmark
+def cleanup(subjects=20000, calls=20):
+    from source.db import Database
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        populate(ensa.db.cnx, subjects=subjects)
+        cnx = ensa.db.cnx
+        print('%d informations, %d keyword links'
+              % tuple(cnx.execute("SELECT COUNT(*) FROM %s" % table)
+                      .fetchone()[0] for table in ('Information', 'IK')))
+        ensa.current_ring = 1
+        ensa.current_subject = 1
+        ensa.variables['reference_time_id'] = 1
+        parts = [i[0] for i in cnx.execute(
+            "SELECT information_id FROM Information WHERE subject_id = 1")]
+        start = time.perf_counter()
+        for _ in range(calls):
+            ensa.db.create_information(Database.INFORMATION_COMPOSITE,
+                                       'address', parts[:2])
+        print('%-32s %8.2f ms per call'
+              % ('create composite (scoped)',
+                 (time.perf_counter() - start) * 1000 / calls))
+        start = time.perf_counter()
+        for _ in range(calls):
+            ensa.db.create_information(Database.INFORMATION_COMPOSITE,
+                                       'address', parts[:2])
+            ensa.db.information_cleanup('composites')
+        print('%-32s %8.2f ms per call'
+              % ('create composite + full sweep',
+                 (time.perf_counter() - start) * 1000 / calls))
+        start = time.perf_counter()
+        with ensa.db.transaction():
+            for _ in range(calls):
+                ensa.db.create_information(Database.INFORMATION_COMPOSITE,
+                                           'address', parts[:2])
+        print('%-32s %8.2f ms per call'
+              % ('create composite (batch)',
+                 (time.perf_counter() - start) * 1000 / calls))
+        print('%-32s %8.2f ms'
+              % ('full sweep (rmc)', measure(ensa.db.information_cleanup)))
+        ensa.db.cnx.close()
+
+
+"""
+Keywords - tagging resolves keywords from cache, one insert per call
+"""
+def legacy_add_keyword(cnx, subject_id, information_ids, keyword):
+    """
+    Former Database.add_keyword: SELECT (and INSERT on miss) of
+    the keyword, then one IK insert per keyword.
+    """
+    try:
+        keyword_id = cnx.execute("SELECT keyword_id FROM Keyword "
+                                 "WHERE keyword = ?", (keyword,)
+                                 ).fetchall()[0][0]
+    except IndexError:
+        keyword_id = cnx.execute("INSERT INTO Keyword(keyword) VALUES(?)",
+                                 (keyword,)).lastrowid
+    cnx.execute("INSERT INTO IK(information_id, keyword_id) "
+                "SELECT information_id, ? "
+                "FROM Information "
+                "WHERE subject_id = ? "
+                "      AND information_id IN (%s)"
+                % ','.join(str(i) for i in information_ids),
+                (keyword_id, subject_id))
+    cnx.commit()
+
+
+@benchmark
+def keywords(keywords=50000, calls=200, per_call=5):
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        populate(ensa.db.cnx)
+        cnx = ensa.db.cnx
+        cnx.executemany("INSERT INTO Keyword(keyword) VALUES(?)",
+                        [('tag%d' % k,) for k in range(keywords)])
+        cnx.commit()
+        ensa.current_ring = 1
+        subject_ids = iter(range(1, 2001))
+
+        def tag_sets():
+            """every call tags informations of a fresh subject"""
+            for _ in range(calls):
+                subject_id = next(subject_ids)
+                yield (subject_id,
+                       [i[0] for i in cnx.execute(
+                           "SELECT information_id FROM Information "
+                           "WHERE subject_id = ?", (subject_id,))],
+                       ['tag%d' % random.randrange(keywords * 2)
+                        for _ in range(per_call)])
+
+        def legacy(subject_id, information_ids, tags):
+            for tag in tags:
+                legacy_add_keyword(cnx, subject_id, information_ids, tag)
+
+        def per_keyword(subject_id, information_ids, tags):
+            ensa.current_subject = subject_id
+            with ensa.db.transaction():
+                for tag in tags:
+                    ensa.db.add_keyword(information_ids, tag)
+
+        def bulk(subject_id, information_ids, tags):
+            ensa.current_subject = subject_id
+            ensa.db.add_keywords(information_ids, tags)
+
+        for description, function in (
+                ('legacy (lookup + insert each)', legacy),
+                ('add_keyword (cached)', per_keyword),
+                ('add_keywords (bulk)', bulk)):
+            sets = list(tag_sets())
+            ensa.db.forget_keywords()
+            start = time.perf_counter()
+            for tag_set in sets:
+                function(*tag_set)
+            print('%-32s %8.2f ms per call (%d keywords)'
+                  % (description,
+                     (time.perf_counter() - start) * 1000 / calls, per_call))
+        ensa.db.cnx.close()
+
+
+def legacy_keyword_search(cnx, keywords, conjunction):
+    """
+    Former Database.get_informations_for_keywords_and/_or conditions
+    (IDs only).
+    """
+    keywords = ','.join('\'%s\'' % k for k in keywords)
+    if conjunction:
+        condition = ("(SELECT information_id "
+                     " FROM IK "
+                     " WHERE keyword_id IN"
+                     "     (SELECT keyword_id "
+                     "      FROM Keyword "
+                     "      WHERE keyword IN (" + keywords + ")) "
+                     " GROUP BY information_id "
+                     " HAVING COUNT(keyword_id) = %d)"
+                     % (keywords.count(',') + 1))
+    else:
+        condition = ("(SELECT IK.information_id "
+                     " FROM IK INNER JOIN Keyword K "
+                     "  ON IK.keyword_id = K.keyword_id"
+                     " WHERE K.keyword IN (" + keywords + "))")
+    return sorted(row[0] for row in cnx.execute(
+        "SELECT I.information_id "
+        "FROM Information I INNER JOIN Subject S "
+        "     ON I.subject_id = S.subject_id "
+        "WHERE S.ring_id = 1 AND I.information_id IN " + condition))
+
+
+@benchmark
+def keyword_index(subjects=25000, tags_per_information=3, queries=20):
+    from source.keywords import parse_expression
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        populate(ensa.db.cnx, subjects=subjects)
+        cnx = ensa.db.cnx
+        cnx.executemany("INSERT OR IGNORE INTO IK(information_id, keyword_id) "
+                        "VALUES(?, ?)",
+                        [(i[0], random.randint(1, 20))
+                         for i in cnx.execute(
+                             "SELECT information_id FROM Information")
+                         for _ in range(tags_per_information - 1)])
+        cnx.commit()
+        print('%d informations, %d keyword links'
+              % tuple(cnx.execute("SELECT COUNT(*) FROM %s" % table)
+                      .fetchone()[0] for table in ('Information', 'IK')))
+        ensa.current_ring = 1
+        ensa.current_subject = None
+        keyword_sets = [['keyword%d' % k
+                         for k in random.sample(range(1, 21),
+                                                random.randint(3, 6))]
+                        for _ in range(queries)]
+        start = time.perf_counter()
+        index = ensa.db.get_keyword_index()
+        for k in range(1, 21):
+            index.keyword('keyword%d' % k)
+        print('%-32s %8.2f ms' % ('build index (20 keywords)',
+                                  (time.perf_counter() - start) * 1000))
+        for conjunction, operator in ((True, 'and'), (False, 'or')):
+            expressions = [parse_expression((' %s ' % operator).join(k))
+                           for k in keyword_sets]
+            start = time.perf_counter()
+            legacy = [legacy_keyword_search(cnx, k, conjunction)
+                      for k in keyword_sets]
+            legacy_time = (time.perf_counter() - start) * 1000 / queries
+            start = time.perf_counter()
+            bitmaps = [index.evaluate(e) for e in expressions]
+            bitmap_time = (time.perf_counter() - start) * 1000 / queries
+            start = time.perf_counter()
+            found = [index.search(e) for e in expressions]
+            search_time = (time.perf_counter() - start) * 1000 / queries
+            print('%-32s %8.2f ms per query (%d results on average)'
+                  % ('legacy %s (SQL)' % operator.upper(), legacy_time,
+                     sum(len(r) for r in legacy) / queries))
+            print('%-32s %8.3f ms per query'
+                  % ('bitmap %s' % operator.upper(), bitmap_time))
+            print('%-32s %8.2f ms per query (same results: %s)'
+                  % ('bitmap %s + ID list' % operator.upper(), search_time,
+                     found == legacy))
+        expression = parse_expression(
+            'keyword1 and not (keyword2 or keyword3) and keyword4')
+        print('%-32s %8.3f ms'
+              % ('bitmap AND NOT OR', measure(lambda: index.evaluate(
+                  expression), repeat=100)))
+        ensa.current_subject = 1
+        information_ids = [i[0] for i in cnx.execute(
+            "SELECT information_id FROM Information WHERE subject_id = 1")]
+        start = time.perf_counter()
+        ensa.db.add_keywords(information_ids, ['keyword1', 'keyword2'])
+        ensa.db.delete_keywords(','.join(str(i) for i in information_ids),
+                                '\'keyword3\'')
+        print('%-32s %8.2f ms'
+              % ('tag + untag (maintained)',
+                 (time.perf_counter() - start) * 1000))
+        ensa.current_subject = None
+        print('index consistent after update: %s'
+              % all(index.search(parse_expression(k))
+                    == legacy_keyword_search(cnx, [k], True)
+                    for k in ('keyword1', 'keyword2', 'keyword3')))
+        ensa.db.cnx.close()
+
+
+"""
+Search - full-text index instead of filtering formatted output
+"""
+@benchmark
+def search(subjects=25000, calls=5):
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        start = time.perf_counter()
+        populate(ensa.db.cnx, subjects=subjects)
+        print('%-32s %8.2f s (index kept by triggers)'
+              % ('populate', time.perf_counter() - start))
+        cnx = ensa.db.cnx
+        print('%d informations, %d indexed fields'
+              % tuple(cnx.execute("SELECT COUNT(*) FROM %s" % table)
+                      .fetchone()[0] for table in ('Information', 'Search')))
+        start = time.perf_counter()
+        for statement in Database.MIGRATIONS[2]:
+            if not statement.startswith('CREATE'):
+                cnx.execute(statement)
+        cnx.commit()
+        print('%-32s %8.2f s'
+              % ('rebuild index (migration)', time.perf_counter() - start))
+        ensa.current_ring = 1
+        ensa.current_subject = None
+        ensa.variables['reference_time'] = datetime(2018, 1, 1)
+        for query in ('"value 123456"', 'value 12345*'):
+            pattern = query.strip('"*')
+            start = time.perf_counter()
+            for _ in range(calls):
+                """former way: `ig~<pattern>`, filtering every entry"""
+                legacy = [info for info in ensa.db.get_informations()
+                          if pattern in ' '.join(str(x) for x in info)]
+            legacy_time = (time.perf_counter() - start) * 1000 / calls
+            start = time.perf_counter()
+            for _ in range(calls):
+                hits = ensa.db.search(query)
+            print('%-32s %8.2f ms -> %6.2f ms (%d entries / %d hits)'
+                  % ('find %s' % query, legacy_time,
+                     (time.perf_counter() - start) * 1000 / calls,
+                     len(legacy), len(hits)))
+        ensa.db.cnx.close()
+
+
+"""
+Maps - tiles are served by a local stand-in for the tile server
+"""
+tile_downloads = []
+
+
+async def stand_in_fetch_tiles(tiles, num_workers):
+    import PIL.Image
+    from io import BytesIO
+    for tile in tiles:
+        tile_downloads.append(tile.url)
+        data = BytesIO()
+        PIL.Image.new('RGB', (256, 256),
+                      (len(tile_downloads) * 37 % 256, 128, 64)).save(
+            data, format='PNG')
+        yield tile._replace(img=data.getvalue(), error=None)
+
+
+@contextmanager
+def map_sandbox():
+    """
+    sandbox() with stand-in tile server and default map options
+    """
+    from source import map as ensa_map
+    network_fetch_tiles = ensa_map.fetch_tiles
+    ensa_map.fetch_tiles = stand_in_fetch_tiles
+    options = {key: ensa.config[key].value
+               for key in ensa.config.keys() if key.startswith('map.')}
+    try:
+        with sandbox() as directory:
+            ensa.config['map.url'].value = ''
+            ensa.config['map.source'].value = ''
+            ensa.config['map.offline'].value = False
+            ensa.config['map.cache'].value = 'files/tiles'
+            ensa.config['map.image_cache'].value = 'files/maps'
+            yield directory
+    finally:
+        ensa_map.fetch_tiles = network_fetch_tiles
+        ensa_map.mbtiles_connections.clear()
+        for key, value in options.items():
+            ensa.config[key].value = value
+
+
+@benchmark
+def map_tiles():
+    import sqlite3
+    import geotiler
+    from source import map as ensa_map
+
+    def render():
+        tile_downloads.clear()
+        mm = geotiler.Map(center=(14.42, 50.08), size=(1024, 768), zoom=15,
+                          provider=ensa.config['map.provider'].value)
+        start = time.perf_counter()
+        image = ensa_map.render_map(mm)
+        return (image.tobytes(), len(tile_downloads),
+                (time.perf_counter() - start) * 1000)
+
+    with map_sandbox():
+        reference, count, duration = render()
+        print('%-30s %4d download(s) %9.1f ms'
+              % ('empty cache', count, duration))
+        image, count, duration = render()
+        print('%-30s %4d download(s) %9.1f ms %s'
+              % ('warm cache', count, duration,
+                 'same' if image == reference else 'DIFFERENT'))
+
+        """the cache becomes a local tile directory and an MBTiles file"""
+        provider = ensa.config['map.provider'].value
+        shutil.copytree(os.path.join('files/tiles', provider), 'xyz')
+        cnx = sqlite3.connect('tiles.mbtiles')
+        cnx.execute("CREATE TABLE tiles (zoom_level INTEGER, "
+                    "tile_column INTEGER, tile_row INTEGER, "
+                    "tile_data BLOB)")
+        for root, _, filenames in os.walk('xyz'):
+            for filename in filenames:
+                zoom, x = (int(part) for part in
+                           os.path.relpath(root, 'xyz').split(os.sep))
+                y = int(filename.partition('.')[0])
+                with open(os.path.join(root, filename), 'rb') as f:
+                    cnx.execute("INSERT INTO tiles VALUES(?, ?, ?, ?)",
+                                (zoom, x, (1 << zoom) - 1 - y, f.read()))
+        cnx.commit()
+        cnx.close()
+        ensa.config['map.cache'].value = ''
+        ensa.config['map.offline'].value = True
+        for source in ('xyz', 'tiles.mbtiles'):
+            ensa.config['map.source'].value = source
+            image, count, duration = render()
+            print('%-30s %4d download(s) %9.1f ms %s'
+                  % ('offline, source %s' % source, count, duration,
+                     'same' if image == reference else 'DIFFERENT'))
+
+
+@benchmark
+def map_images(maps=20):
+    from source import map as ensa_map
+    random.seed(0)
+    point_sets = [[(50 + random.uniform(-0.05, 0.05),
+                    14.4 + random.uniform(-0.05, 0.05)) for _ in range(3)]
+                  for _ in range(maps)]
+    labels = ['a', 'b', 'c']
+    with map_sandbox():
+        start = time.perf_counter()
+        reference = ensa_map.get_map_png(point_sets[0], labels)
+        print('%-30s %9.1f ms'
+              % ('rendered', (time.perf_counter() - start) * 1000))
+        start = time.perf_counter()
+        cached = ensa_map.get_map_png(point_sets[0][::-1], labels[::-1])
+        print('%-30s %9.1f ms %s'
+              % ('cached (points reordered)',
+                 (time.perf_counter() - start) * 1000,
+                 'same' if cached == reference else 'DIFFERENT'))
+        """eviction keeps the cache within map.image_cache_size"""
+        ensa.config['map.image_cache_size'].value = 1
+        for points in point_sets:
+            ensa_map.get_map_png(points, labels)
+        sizes = [os.path.getsize(os.path.join('files/maps', f))
+                 for f in os.listdir('files/maps')]
+        print('%d maps rendered, %d cached (%.2f MB, limit %d MB)'
+              % (maps, len(sizes), sum(sizes) / 1024 / 1024,
+                 ensa.config['map.image_cache_size'].value))
+
+
+
+
+"""
+Relationship graph - graphviz runs only for changed networks
+"""
+@benchmark
+def relationship_graph(people=40):
+    import graphviz
+    from source import graph
+    random.seed(0)
+    codenames = ['person%d' % i for i in range(people)]
+    relationships = [((random.choice(codenames), random.choice(codenames)),
+                      (random.choice(list(graph.opposites)),
+                       random.randint(1, 10), random.randint(1, 10),
+                       random.random() > 0.2))
+                     for _ in range(people * 2)]
+    acquaintances = set(sum([k for k, _ in relationships], ())) - {'person0'}
+    runs = []
+    graphviz_pipe = graphviz.Graph.pipe
+
+    def pipe(self, *args, **kwargs):
+        runs.append(self.source)
+        if shutil.which(self.engine):
+            return graphviz_pipe(self, *args, **kwargs)
+        return b'stand-in PNG of %d bytes of DOT' % len(self.source)
+
+    graphviz.Graph.pipe = pipe
+    option = ensa.config['graph.image_cache'].value
+    try:
+        with sandbox():
+            ensa.config['graph.image_cache'].value = 'files/graphs'
+            print('graphviz %s' % ('found' if shutil.which('sfdp')
+                                   else 'not found, stand-in is used'))
+            results = []
+            for description, order in (('rendered', 1),
+                                       ('cached', 1),
+                                       ('cached (other order)', -1)):
+                start = time.perf_counter()
+                results.append(graph.get_relationship_graph(
+                    'person0', list(acquaintances)[::order],
+                    relationships[::order]).getvalue())
+                print('%-24s %9.1f ms %d graphviz run(s)'
+                      % (description, (time.perf_counter() - start) * 1000,
+                         len(runs)))
+            print('images %s'
+                  % ('same' if len(set(results)) == 1 else 'DIFFERENT'))
+    finally:
+        graphviz.Graph.pipe = graphviz_pipe
+        ensa.config['graph.image_cache'].value = option
+
+
+"""
+Relationship network - ring-wide queries over integer adjacency arrays
+"""
+@benchmark
+def network(relationships=100000, subjects=20000):
+    from io import StringIO
+    from source.network import Network, get_network
+    random.seed(0)
+    with sandbox():
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.db.connect('benchmark')
+        now = datetime(2018, 1, 1)
+        cnx = ensa.db.cnx
+        cnx.execute("INSERT INTO Ring(ring_id, name, reference_time_id) "
+                    "VALUES(1, 'BENCHMARK', 1)")
+        cnx.execute("INSERT INTO Time(time_id, ring_id, time, modified) "
+                    "VALUES(1, 1, '2018-01-01 00:00:00', ?)", (now,))
+        cnx.executemany("INSERT INTO Subject(subject_id, ring_id, codename, "
+                        "                    created) "
+                        "VALUES(?, 1, ?, ?)",
+                        [(s, 'subject%d' % s, now)
+                         for s in range(1, subjects + 1)])
+        cnx.executemany("INSERT INTO Information(information_id, subject_id, "
+                        "                        type, name, modified) "
+                        "VALUES(?, ?, 0, 'codename', ?)",
+                        [(s, s, now) for s in range(1, subjects + 1)])
+        cnx.executemany("INSERT INTO Text(information_id, value) "
+                        "VALUES(?, ?)",
+                        [(s, 'subject%d' % s)
+                         for s in range(1, subjects + 1)])
+        pairs = []
+        while len(pairs) < relationships:
+            a, b = random.sample(range(1, subjects + 1), 2)
+            pairs.append((a, b, random.choice(['friend', 'parent', 'enemy',
+                                               'colleague', 'spouse'])))
+        cnx.executemany("INSERT INTO Association(association_id, ring_id, "
+                        "                        level, accuracy, valid, "
+                        "                        modified, note) "
+                        "VALUES(?, 1, ?, ?, ?, ?, ?)",
+                        [(r, random.randint(0, 10), random.randint(0, 10),
+                          int(random.random() > 0.1), now,
+                          'subject%d-subject%d %s' % pair)
+                         for r, pair in enumerate(pairs, 1)])
+        cnx.executemany("INSERT INTO AI(association_id, information_id) "
+                        "VALUES(?, ?)",
+                        [(r, s) for r, pair in enumerate(pairs, 1)
+                         for s in pair[:2]])
+        cnx.commit()
+        ensa.current_ring = 1
+        ensa.current_subject = None
+        ensa.variables['reference_time'] = now
+
+        start = time.perf_counter()
+        n = get_network()
+        print('%-24s %9.1f ms (%d subjects, %d relationships)'
+              % ('load', (time.perf_counter() - start) * 1000,
+                 len(n.nodes), len(n.source)))
+        rows = ensa.db.get_relationship_rows()
+        codenames = [s[1] for s in ensa.db.get_subjects()]
+        print('%-24s %9.1f ms'
+              % ('build (no query)',
+                 measure(lambda: Network(codenames, rows), repeat=3)))
+        print('%-24s %9.1f ms'
+              % ('reuse', measure(get_network)))
+        sample = random.sample(n.nodes, 100)
+        print('%-24s %9.3f ms'
+              % ('degree (each)',
+                 measure(lambda: [n.degree(c) for c in sample]) / 100))
+        path_pairs = list(zip(sample[::2], sample[1::2]))
+        lengths = [len(n.shortest_path(a, b) or []) for a, b in path_pairs]
+        print('%-24s %9.3f ms (average length %.1f)'
+              % ('shortest path (each)',
+                 measure(lambda: [n.shortest_path(a, b)
+                                  for a, b in path_pairs]) / len(path_pairs),
+                 sum(lengths) / len(lengths)))
+        components = n.components()
+        print('%-24s %9.1f ms (%d components, largest %d)'
+              % ('components', measure(n.components, repeat=3),
+                 len(components), len(components[0])))
+        for name in ('export_graphml', 'export_dot'):
+            f = StringIO()
+            getattr(n, name)(f)
+            print('%-24s %9.1f ms (%.1f MB)'
+                  % (name, measure(lambda: getattr(n, name)(StringIO()),
+                                   repeat=3),
+                     len(f.getvalue()) / 2**20))
+        ensa.db.cnx.close()
+
+
+@benchmark
+def map_memory(renders=1000, legacy_renders=50):
+    """
+    Memory of repeated map renders; legacy is a new pyplot figure
+    per render that is never closed (former get_map behaviour).
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from io import BytesIO
+    from source import map as ensa_map
+    points = [(50.08, 14.42), (50.1, 14.5), (50.0, 14.3)]
+    labels = ['a', 'b', 'c']
+
+    def legacy():
+        fig = plt.figure(figsize=(20, 15), frameon=False)
+        ensa_map.get_map(points, labels, fig=fig)
+        fig.savefig(BytesIO(), format='png', bbox_inches='tight',
+                    pad_inches=0)
+
+    def current():
+        ensa_map.get_map_png(points, labels)
+
+    with map_sandbox():
+        ensa.config['map.image_cache'].value = ''
+        current()  # tiles are cached, fonts loaded etc.
+        for name, function, count in (('get_map_png', current, renders),
+                                      ('legacy', legacy, legacy_renders)):
+            base = lib.get_rss()
+            start = time.perf_counter()
+            for i in range(1, count + 1):
+                function()
+                if i % max(1, count // 5) == 0:
+                    print('%-12s %5d renders %8.1f MB RSS (%+.1f MB) %8.1f s'
+                          % (name, i, lib.get_rss(), lib.get_rss() - base,
+                             time.perf_counter() - start))
+            print('%-12s %d open pyplot figure(s)'
+                  % (name, len(plt.get_fignums())))
+        plt.close('all')
+
+
+"""
+Person report memory - large galleries with streaming build and thumbnails
+"""
+def report_peak_rss(function, connection):
+    """
+    Runs function in a forked process and sends its peak RSS (MB),
+    RSS at start and duration through the connection.
+    """
+    def vm(key):
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1]) / 1024
+    start_rss = vm('VmRSS:')
+    start = time.perf_counter()
+    try:
+        function()
+        error = None
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    connection.send((vm('VmHWM:'), start_rss,
+                     time.perf_counter() - start, error))
+    connection.close()
+
+
+@benchmark
+def report_memory(images=40, memory_limit=128):
+    """
+    Peak RSS of one person report with a gallery of large photos;
+    legacy is all flowables built into a list and original images
+    embedded (former person_report behaviour).
+    """
+    import multiprocessing
+    import PIL.Image
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate
+    from source import pdf
+    options = {key: ensa.config[key].value
+               for key in ('report.image_dpi', 'report.memory_limit',
+                           'report.thumbnail_cache')}
+    source_directory = os.path.abspath('source')
+    with sandbox():
+        os.symlink(source_directory, 'source')
+        ensa.config['db.file'].value = 'files/ensa.db'
+        ensa.config['report.thumbnail_cache'].value = 'files/thumbnails'
+        ensa.db.connect('benchmark')
+        now = datetime(2018, 1, 1)
+        cnx = ensa.db.cnx
+        cnx.execute("INSERT INTO Ring(ring_id, name, reference_time_id) "
+                    "VALUES(1, 'BENCHMARK', 1)")
+        cnx.execute("INSERT INTO Time(time_id, ring_id, time, modified) "
+                    "VALUES(1, 1, '2018-01-01 00:00:00', ?)", (now,))
+        cnx.execute("INSERT INTO Subject(subject_id, ring_id, codename, "
+                    "                    created) "
+                    "VALUES(1, 1, 'person', ?)", (now,))
+        infos = [(1, 'codename', 'person')] + [
+            (i, 'photo', 'photo %d' % i) for i in range(2, images + 2)]
+        cnx.executemany("INSERT INTO Information(information_id, subject_id, "
+                        "                        type, name, modified) "
+                        "VALUES(?, 1, 0, ?, ?)",
+                        [(i[0], i[1], now) for i in infos])
+        cnx.executemany("INSERT INTO Text(information_id, value) "
+                        "VALUES(?, ?)", [(i[0], i[2]) for i in infos])
+        cnx.execute("INSERT INTO Keyword(keyword_id, keyword) "
+                    "VALUES(1, 'image')")
+        cnx.executemany("INSERT INTO IK(information_id, keyword_id) "
+                        "VALUES(?, 1)", [(i[0],) for i in infos[1:]])
+        cnx.commit()
+        start = time.perf_counter()
+        size = (3000, 2000)
+        gradient = PIL.Image.linear_gradient('L').resize(size)
+        radial = PIL.Image.radial_gradient('L').resize(size)
+        for i in range(2, images + 2):
+            photo = PIL.Image.merge('RGB', (PIL.Image.effect_noise(size, 30),
+                                            gradient.rotate(i * 37), radial))
+            with open('files/binary/%d' % i, 'wb') as f:
+                if i % 10:
+                    photo.save(f, format='JPEG', quality=90)
+                else:
+                    photo.save(f, format='PNG', compress_level=1)
+        print('%d photos %dx%d (%.1f MB) created in %.1f s'
+              % (images, size[0], size[1],
+                 sum(os.path.getsize('files/binary/%d' % i)
+                     for i in range(2, images + 2)) / 2**20,
+                 time.perf_counter() - start))
+        ensa.current_ring = 1
+        ensa.current_subject = None
+        ensa.variables['reference_time'] = now
+        dossier = pdf.Dossier()
+
+        def legacy():
+            pdf.register_fonts()
+            doc = SimpleDocTemplate('legacy.pdf', pagesize=A4)
+            doc.build(list(pdf.person_report_flowables(
+                dossier, 'person', pdf.ReportImages())))
+
+        def streaming(filename):
+            return lambda: pdf.render_person_report(dossier, 'person',
+                                                    filename)
+
+        context = multiprocessing.get_context('fork')
+        for description, function, dpi, limit, filename in (
+                ('legacy', legacy, 0, 0, 'legacy.pdf'),
+                ('streaming, originals', streaming('originals.pdf'),
+                 0, 0, 'originals.pdf'),
+                ('thumbnails', streaming('thumbnails.pdf'),
+                 150, 0, 'thumbnails.pdf'),
+                ('thumbnails (cached)', streaming('cached.pdf'),
+                 150, 0, 'cached.pdf'),
+                ('originals, %d MB limit' % memory_limit,
+                 streaming('limited.pdf'), 0, memory_limit,
+                 'limited.pdf')):
+            ensa.config['report.image_dpi'].value = dpi
+            ensa.config['report.memory_limit'].value = limit
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=report_peak_rss,
+                                      args=(function, sender))
+            process.start()
+            peak, start_rss, duration, error = receiver.recv()
+            process.join()
+            print('%-26s peak %7.1f MB RSS (%+7.1f MB) %6.1f s  %s'
+                  % (description, peak, peak - start_rss, duration,
+                     error or 'PDF %.1f MB'
+                     % (os.path.getsize(filename) / 2**20)))
+        ensa.db.cnx.close()
+    for key, value in options.items():
+        ensa.config[key].value = value
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(benchmarks.keys())
+    for name in names:
+        if name not in benchmarks:
+            log.err('Unknown benchmark \'%s\' (available: %s).'
+                    % (name, ', '.join(benchmarks.keys())))
+            continue
+        log.info('Running \'%s\' benchmark...' % name)
+        benchmarks[name]()
+        print()
@@ -3,12 +3,19 @@
 Ensa is collaborative tool for human information management.
 """
 from getpass import getpass
+import argparse
 import readline
 from source import log
 from source import lib
 from source import ensa
 from source import commands
 
+parser = argparse.ArgumentParser(description='Ensa - human information '
+                                             'management.')
+parser.add_argument('--import', dest='import_file', metavar='FILE',
+                    help='run commands from FILE non-interactively '
+                         'in a single transaction')
+args = parser.parse_args()
 
 lib.reload_config()
 db_password = (ensa.config['db.password'].value or 
@@ -18,6 +25,10 @@ if not ensa.db or not ensa.db.connect(db_password):
     log.err('Cannot connect to DB!')
     lib.exit_program(None, None)
 
+if args.import_file:
+    success = commands.import_commands(args.import_file)
+    lib.exit_program(None if success else 1, None)
+
 rings = ensa.db.get_rings()
 if rings:
     log.info(
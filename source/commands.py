@@ -7,6 +7,7 @@ import os
 import pdb
 import sys
 import re
+import time
 import traceback
 import tempfile
 import subprocess
@@ -16,9 +17,10 @@ from source import log
 from source.docs import doc
 from source.pdf import *
 from source.map import *
+from source.network import get_network
 # from source.protocols import protocols
 from source.lib import *
-from source.db import Database
+from source.db import Database, transactional
 from datetime import datetime
 import dateutil.parser
 
@@ -160,14 +162,16 @@ def run_command(fullcommand):
             args = tuple(filter(None, args))
             log.debug_command('  Command: \'%s\'' % (command))
             log.debug_command('  Args:    %s' % (str(args)))
-            # run command
-            lines = ensa.commands[command].run(*args)
+            # run command (as a single transaction)
+            ensa.db.forget_external_changes()
+            with ensa.db.transaction():
+                lines = ensa.commands[command].run(*args)
 
         except Exception as e:
             traceback.print_exc()
             log.err('Cannot execute command \''+command+'\': '+str(e)+'.')
             log.debug_error()
-            return
+            return False
 
     # Lines can be:
     #     a list of strings:
@@ -283,12 +287,63 @@ def parse_sequence(sequence):
 
 def wizard(questions):
     for q in questions:
-        log.question('%s ' % (q), new_line=False)
-        line = input()
+        if ensa.input_source is None:
+            log.question('%s ' % (q), new_line=False)
+            line = input()
+        else:
+            line = next(ensa.input_source, '')
         ensa.history.append(line)
         yield line
 
 
+def import_commands(filename):
+    """
+    Runs commands from a file without interaction. Wizard answers
+    are taken from the following lines of the file, the whole import
+    is a single transaction. The import stops at the first failed
+    command and nothing is stored then. Returns True on success.
+    """
+    log.show_prompt = False
+    log.disable_colors()
+    start = time.time()
+    changes = ensa.db.cnx.total_changes
+    command_count = 0
+    failed = None
+    try:
+        with open(filename, 'r') as f:
+            ensa.input_source = (line.rstrip('\n') for line in f)
+            with ensa.db.transaction():
+                for line in ensa.input_source:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    if lib.quitstring(line):
+                        break
+                    command_count += 1
+                    if (run_command(line) is False
+                            or ensa.db.transaction_failed):
+                        failed = line
+                        raise RuntimeError('command failed')
+    except OSError as e:
+        log.err('Cannot read \'%s\': %s.' % (filename, e))
+        return False
+    except Exception as e:
+        if failed is None:
+            log.err('Import failed: %s.' % e)
+        else:
+            log.err('Command %d (\'%s\') failed, nothing is imported.'
+                    % (command_count, failed))
+        return False
+    finally:
+        ensa.input_source = None
+    duration = time.time() - start
+    changes = ensa.db.cnx.total_changes - changes
+    log.info('Imported %d commands in %.2f s, %d rows changed (%.0f rows/s).'
+             % (command_count, duration, changes,
+                changes / duration if duration else 0))
+    return True
+
+
 """
 Format functions
 """
@@ -1188,8 +1243,7 @@ def iak_function(*args):
     if not keywords:
         log.err('A keyword must be specified.')
         return []
-    for keyword in keywords:
-        ensa.db.add_keyword(information_ids, keyword)
+    ensa.db.add_keywords(information_ids, keywords)
     # ensa.variables['last'] = information_id
     return []
 
@@ -1293,11 +1347,10 @@ add_command(Command(
 
 
 def igbk_all_function(*args):
-    keywords = ','.join(['\'%s\'' % x for x in args])
-    if not keywords:
+    if not args:
         log.err('Keyword must be specified.')
         return []
-    infos = ensa.db.get_informations_for_keywords_and(keywords)
+    infos = ensa.db.get_informations_for_keywords_and(args)
     if not infos:
         return []
     if len(infos) == 1:
@@ -1313,11 +1366,10 @@ add_command(Command('igbk= <keyword>',
 
 
 def igbk_or_function(*args):
-    keywords = ','.join(['\'%s\'' % x for x in args])
-    if not keywords:
+    if not args:
         log.err('Keyword must be specified.')
         return []
-    infos = ensa.db.get_informations_for_keywords_or(keywords)
+    infos = ensa.db.get_informations_for_keywords_or(args)
     if not infos:
         return []
     if len(infos) == 1:
@@ -1332,6 +1384,25 @@ add_command(Command('igbk <keyword>',
                     'get information having any of keywords', 'igbk', igbk_or_function))
 
 
+def igbke_function(*args):
+    if not args:
+        log.err('Keyword expression must be specified.')
+        return []
+    infos = ensa.db.get_informations_for_keyword_expression(' '.join(args))
+    if not infos:
+        return []
+    if len(infos) == 1:
+        ensa.variables['last'] = infos[0][0]
+    info_lens = get_format_len_information(infos)
+    result = [format_information(
+        *info, *info_lens, use_codename=(ensa.current_subject is None)) for info in infos]
+    return result
+
+
+add_command(Command('igbke <expression>',
+                    'get information matching keyword expression', 'igbke', igbke_function))
+
+
 add_command(Command('im', 'modify information', 'im', lambda *args: []))
 
 
@@ -1707,6 +1778,7 @@ add_command(Command('la', 'add new location for current ring',
                     'la', lambda *_: ['TODO']))
 
 
+@transactional
 def law_function(*_):
     if not ensa.current_ring:
         log.err('First select a ring with `rs <name>`.')
@@ -1995,6 +2067,148 @@ add_command(Command('lmvw <location_ids>',
                     'use wizard to modify location validity', 'lmvw', lmvw_function))
 
 
+"""
+NETWORK COMMANDS
+"""
+
+
+def n_function(*_):
+    network = get_network()
+    if not network:
+        return []
+    components = network.components()
+    result = ['Subjects:          %d' % len(network.nodes),
+              'Relationships:     %d' % len(network.source),
+              'Components:        %d (largest has %d subjects)'
+              % (len(components), len(components[0]) if components else 0),
+              'Most relationships:']
+    degrees = sorted(((network.offsets[n + 1] - network.offsets[n], codename)
+                      for n, codename in enumerate(network.nodes)),
+                     key=lambda x: (-x[0], x[1]))
+    result += ['    %-20s %d' % (codename, degree)
+               for degree, codename in degrees[:10] if degree]
+    return result
+
+
+add_command(Command('n', 'show relationship network summary of the ring',
+                    'n', n_function))
+
+
+def nc_function(*_):
+    network = get_network()
+    if not network:
+        return []
+    return ['%5d: %s' % (len(component), ', '.join(component))
+            for component in network.components()]
+
+
+add_command(Command('nc', 'list connected groups of subjects', 'nc',
+                    nc_function))
+
+
+def nd_function(*args):
+    try:
+        codename = args[0]
+    except:
+        log.err('Codename must be specified.')
+        return []
+    network = get_network()
+    if not network:
+        return []
+    degree = network.degree(codename)
+    if degree is None:
+        return []
+    return (['%s has %d relationship(s):' % (codename, degree)]
+            + ['    %-20s %s (#%d)' % (acquaintance, relationship,
+                                       network.association_ids[edge_id])
+               for acquaintance, relationship, edge_id
+               in sorted(network.get_relationships(codename))])
+
+
+add_command(Command('nd <codename>', 'show relationships of a subject',
+                    'nd', nd_function))
+
+
+def ne_function(*args):
+    try:
+        filename = args[0]
+    except:
+        log.err('Filename must be specified.')
+        return []
+    exporters = {'.graphml': 'export_graphml',
+                 '.xml': 'export_graphml',
+                 '.dot': 'export_dot',
+                 '.gv': 'export_dot'}
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in exporters:
+        log.err('Unsupported format, use %s.' % '|'.join(exporters.keys()))
+        return []
+    network = get_network()
+    if not network:
+        return []
+    try:
+        with open(filename, 'w') as f:
+            getattr(network, exporters[extension])(f)
+    except OSError as e:
+        log.err('Cannot export network: %s' % e)
+        return []
+    log.info('%d subjects and %d relationships exported to %s.'
+             % (len(network.nodes), len(network.source), filename))
+    return []
+
+
+add_command(Command('ne <filename>',
+                    'export relationship network (GraphML or DOT)', 'ne',
+                    ne_function))
+
+
+def np_function(*args):
+    try:
+        start, end = args[:2]
+    except:
+        log.err('Two codenames must be specified.')
+        return []
+    network = get_network()
+    if not network:
+        return []
+    path = network.shortest_path(start, end)
+    if path is None:
+        if start in network.node_ids and end in network.node_ids:
+            log.info('%s and %s are not connected.' % (start, end))
+        return []
+    return ['%s-%s %s' % (a, b, relationship) for a, relationship, b in path]
+
+
+add_command(Command('np <codename> <codename>',
+                    'show how two subjects are connected', 'np', np_function))
+
+
+"""
+SEARCH COMMANDS
+"""
+
+
+def find_function(*args):
+    if not args:
+        log.err('Search query must be specified.')
+        return []
+    hits = ensa.db.search(' '.join(args), ensa.config['search.limit'].value,
+                          (log.COLOR_YELLOW, log.COLOR_NONE))
+    if not hits:
+        return []
+    prefixes = {'subject': '#S', 'information': '#I', 'association': '#A',
+                'time': '#T', 'location': '#L'}
+    id_len = max(len(str(hit[2])) for hit in hits)
+    label_len = max(len(hit[3]) for hit in hits)
+    return ['%s%-*d  %-*s  %s' % (prefixes[entity], id_len, entity_id,
+                                  label_len, label, snippet)
+            for entity, _, entity_id, label, snippet in hits]
+
+
+add_command(Command('find <query>',
+                    'full-text search in current ring', 'find', find_function))
+
+
 """
 OPTIONS COMMANDS
 """
@@ -2190,7 +2404,17 @@ def rms_function(*_):
     return []
 
 
+def rmc_function(*_):
+    start = time.time()
+    composites, keywords = ensa.db.information_cleanup()
+    log.info('%d empty composite(s) and %d unused keyword(s) deleted in %.3f s.'
+             % (composites, keywords, time.time() - start))
+    return []
+
+
 add_command(Command('rm', 'ring modification', 'rm', lambda *_: []))
+add_command(Command('rmc', 'delete empty composites and unused keywords (all rings)',
+                    'rmc', rmc_function))
 add_command(Command('rms', 'standardize ring data', 'rms', rms_function))
 
 '''
@@ -2259,6 +2483,7 @@ add_command(Command('sa <codename>',
                     'add new subject in the current ring', 'sa', sa_function))
 
 
+@transactional
 def sawo_function(*_):
     i = {}
     (codename, logo_name, i['name'], i['identifier'], i['business'], i['website'], i['account']) = wizard([
@@ -2405,6 +2630,7 @@ def sawo_function(*_):
     ensa.current_subject = codename_id
 
 
+@transactional
 def sawp_function(*_):
     # general info
     i = {}
@@ -2704,7 +2930,7 @@ add_command(Command('sd <codename>',
 
 
 def sr_function(*_):
-    ensa.db.standardize()
+    ensa.db.standardize_dirty()
     if not ensa.current_subject:
         log.err('A subject must be selected.')
         return []
@@ -2740,6 +2966,30 @@ add_command(Command('sr <codename>',
                     'generate report of current subject', 'sr', sr_function))
 
 
+def srb_function(*args):
+    if not ensa.db.ring_ok():
+        return []
+    ensa.db.standardize_dirty()
+    """workers are forked, nothing may be pending in the database"""
+    ensa.db.commit()
+    start = time.time()
+    results = person_reports(list(args) or None)
+    if not results:
+        log.info('No person to report.')
+        return []
+    failed = [codename for codename, (_, error) in results.items() if error]
+    log.info('%d of %d report(s) created in %.2f s.'
+             % (len(results) - len(failed), len(results), time.time() - start))
+    if failed:
+        log.err('Failed: %s' % ', '.join(failed))
+    return []
+
+
+add_command(Command('srb [<codename> ...]',
+                    'generate person reports in parallel (all persons if not specified)',
+                    'srb', srb_function))
+
+
 def ss_function(*args):
     if not args:
         ensa.current_subject = None
@@ -2781,6 +3031,7 @@ def t_function(*_):
 add_command(Command('t', 'list time entries for current ring', 't', t_function))
 
 
+@transactional
 def taw_function(*_):
     if not ensa.current_ring:
         log.err('First select a ring with `rs <name>`.')
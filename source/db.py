@@ -1,13 +1,37 @@
 #!/usr/bin/env python3
 import time
 from datetime import datetime
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
 import os
 import pdb
+import re
+from bisect import bisect_right
+import traceback
 #import sqlite3 as sqlite
 from pysqlcipher3 import dbapi2 as sqlite
 from source import log
 from source import ensa
 from source import lib
+from source.keywords import KeywordIndex, parse_expression
+
+
+"""
+Metadata of a modifying statement returned by Database.query().
+"""
+Modification = namedtuple('Modification', ['lastrowid', 'rowcount'])
+
+
+def transactional(function):
+    """
+    Runs the decorated function in a single DB transaction.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with ensa.db.transaction():
+            return function(*args, **kwargs)
+    return wrapper
 
 
 class Database():
@@ -16,9 +40,315 @@ class Database():
     INFORMATION_BINARY = 1
     INFORMATION_COMPOSITE = 2
 
+    """
+    Link table inserts of Database.associate() with parameters
+    (association_id, target, ring_id); the target must be in the ring.
+    """
+    ASSOCIATION_LINKS = {
+        'association': (("INSERT OR IGNORE INTO AA(association_id_1, "
+                         "                         association_id_2) "
+                         "SELECT ?1, association_id "
+                         "FROM Association "
+                         "WHERE association_id = ?2 AND ring_id = ?3"),
+                        'Association'),
+        'information': (("INSERT OR IGNORE INTO AI(association_id, "
+                         "                         information_id) "
+                         "SELECT ?1, I.information_id "
+                         "FROM Information I INNER JOIN Subject S "
+                         "     ON I.subject_id = S.subject_id "
+                         "WHERE I.information_id = ?2 AND S.ring_id = ?3"),
+                        'Information'),
+        'location': (("INSERT OR IGNORE INTO AL(association_id, location_id) "
+                      "SELECT ?1, location_id "
+                      "FROM Location "
+                      "WHERE location_id = ?2 AND ring_id = ?3"),
+                     'Location'),
+        'subject': (("INSERT OR IGNORE INTO AI(association_id, "
+                     "                         information_id) "
+                     "SELECT ?1, I.information_id "
+                     "FROM Subject S INNER JOIN Information I "
+                     "     ON S.subject_id = I.subject_id "
+                     "WHERE I.name = 'codename' "
+                     "      AND S.codename = ?2 AND S.ring_id = ?3"),
+                    'Subject'),
+        'time': (("INSERT OR IGNORE INTO AT(association_id, time_id) "
+                  "SELECT ?1, time_id "
+                  "FROM Time "
+                  "WHERE time_id = ?2 AND ring_id = ?3"),
+                 'Time'),
+    }
+
+    """
+    Schema migrations applied on top of files/schema.sql. Database
+    version (PRAGMA user_version) is the number of applied migrations.
+    Every statement must be safe to run repeatedly; ALTER TABLE ...
+    ADD COLUMN is skipped if the column exists (see apply_migration()).
+    """
+    MIGRATIONS = [
+        # 1 - secondary indexes for filtered and joined columns
+        # (Subject.ring_id is covered by UNIQUE(ring_id, codename))
+        [
+            ("CREATE INDEX IF NOT EXISTS Information_subject_name "
+             "ON Information(subject_id, name)"),
+            ("CREATE INDEX IF NOT EXISTS Time_ring_time "
+             "ON Time(ring_id, time)"),
+            ("CREATE INDEX IF NOT EXISTS Time_time "
+             "ON Time(time)"),
+            ("CREATE INDEX IF NOT EXISTS Location_ring_name "
+             "ON Location(ring_id, name)"),
+            ("CREATE INDEX IF NOT EXISTS Association_ring "
+             "ON Association(ring_id)"),
+            ("CREATE INDEX IF NOT EXISTS AI_information "
+             "ON AI(information_id, association_id)"),
+            ("CREATE INDEX IF NOT EXISTS AT_time "
+             "ON AT(time_id, association_id)"),
+            ("CREATE INDEX IF NOT EXISTS AL_location "
+             "ON AL(location_id, association_id)"),
+            ("CREATE INDEX IF NOT EXISTS AA_association_2 "
+             "ON AA(association_id_2, association_id_1)"),
+            ("CREATE INDEX IF NOT EXISTS Composite_part "
+             "ON Composite(part_id, information_id)"),
+            ("CREATE INDEX IF NOT EXISTS Active_time "
+             "ON Active(time_id, information_id)"),
+            ("CREATE INDEX IF NOT EXISTS IK_keyword "
+             "ON IK(keyword_id, information_id)"),
+        ],
+        # 2 - canonical Time.time ('YYYY-MM-DD HH:MM:SS'), so string
+        #     comparison matches chronological order
+        [
+            ("UPDATE Time SET time = substr(time, 1, 10) || ' ' "
+             "                       || substr(time, 12, 8) "
+             "WHERE time GLOB '????-??-??[ T]??:??:??*'"),
+            ("UPDATE Time SET time = substr(time, 1, 10) || ' ' "
+             "                       || substr(time, 12, 5) || ':00' "
+             "WHERE time GLOB '????-??-??[ T]??:??'"),
+            ("UPDATE Time SET time = time || ' 00:00:00' "
+             "WHERE time GLOB '????-??-??'"),
+        ],
+        # 3 - full-text index of searchable fields, kept in sync by
+        #     triggers; rowid is <entity ID> * 8 + <field> (see
+        #     SEARCH_FIELDS), so a row is updated without a scan
+        [
+            ("CREATE VIRTUAL TABLE IF NOT EXISTS Search "
+             "USING fts5(text, ring_id UNINDEXED)"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_subject_insert "
+             "AFTER INSERT ON Subject BEGIN "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    VALUES(NEW.subject_id * 8, NEW.codename, NEW.ring_id); "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_subject_update "
+             "AFTER UPDATE OF codename, ring_id ON Subject BEGIN "
+             "    DELETE FROM Search WHERE rowid = OLD.subject_id * 8; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    VALUES(NEW.subject_id * 8, NEW.codename, NEW.ring_id); "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_subject_delete "
+             "AFTER DELETE ON Subject BEGIN "
+             "    DELETE FROM Search WHERE rowid = OLD.subject_id * 8; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_text_insert "
+             "AFTER INSERT ON Text BEGIN "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.information_id * 8 + 1, NEW.value, S.ring_id "
+             "    FROM Information I INNER JOIN Subject S "
+             "         ON I.subject_id = S.subject_id "
+             "    WHERE I.information_id = NEW.information_id; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_text_update "
+             "AFTER UPDATE OF value ON Text BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid = OLD.information_id * 8 + 1; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.information_id * 8 + 1, NEW.value, S.ring_id "
+             "    FROM Information I INNER JOIN Subject S "
+             "         ON I.subject_id = S.subject_id "
+             "    WHERE I.information_id = NEW.information_id; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_text_delete "
+             "AFTER DELETE ON Text BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid = OLD.information_id * 8 + 1; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_information_insert "
+             "AFTER INSERT ON Information BEGIN "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.information_id * 8 + 2, NEW.note, ring_id "
+             "    FROM Subject "
+             "    WHERE subject_id = NEW.subject_id AND NEW.note <> ''; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_information_update "
+             "AFTER UPDATE OF note, subject_id ON Information BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid = OLD.information_id * 8 + 2; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.information_id * 8 + 2, NEW.note, ring_id "
+             "    FROM Subject "
+             "    WHERE subject_id = NEW.subject_id AND NEW.note <> ''; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_information_delete "
+             "AFTER DELETE ON Information BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid = OLD.information_id * 8 + 2; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_association_insert "
+             "AFTER INSERT ON Association WHEN NEW.note <> '' BEGIN "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    VALUES(NEW.association_id * 8 + 3, NEW.note, NEW.ring_id); "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_association_update "
+             "AFTER UPDATE OF note ON Association BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid = OLD.association_id * 8 + 3; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.association_id * 8 + 3, NEW.note, NEW.ring_id "
+             "    WHERE NEW.note <> ''; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_association_delete "
+             "AFTER DELETE ON Association BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid = OLD.association_id * 8 + 3; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_time_insert "
+             "AFTER INSERT ON Time WHEN NEW.note <> '' BEGIN "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    VALUES(NEW.time_id * 8 + 4, NEW.note, NEW.ring_id); "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_time_update "
+             "AFTER UPDATE OF note ON Time BEGIN "
+             "    DELETE FROM Search WHERE rowid = OLD.time_id * 8 + 4; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.time_id * 8 + 4, NEW.note, NEW.ring_id "
+             "    WHERE NEW.note <> ''; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_time_delete "
+             "AFTER DELETE ON Time BEGIN "
+             "    DELETE FROM Search WHERE rowid = OLD.time_id * 8 + 4; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_location_insert "
+             "AFTER INSERT ON Location BEGIN "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.location_id * 8 + 5, NEW.name, NEW.ring_id "
+             "    WHERE NEW.name <> ''; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.location_id * 8 + 6, NEW.note, NEW.ring_id "
+             "    WHERE NEW.note <> ''; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_location_update "
+             "AFTER UPDATE OF name, note ON Location BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid IN (OLD.location_id * 8 + 5, "
+             "                    OLD.location_id * 8 + 6); "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.location_id * 8 + 5, NEW.name, NEW.ring_id "
+             "    WHERE NEW.name <> ''; "
+             "    INSERT INTO Search(rowid, text, ring_id) "
+             "    SELECT NEW.location_id * 8 + 6, NEW.note, NEW.ring_id "
+             "    WHERE NEW.note <> ''; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Search_location_delete "
+             "AFTER DELETE ON Location BEGIN "
+             "    DELETE FROM Search "
+             "    WHERE rowid IN (OLD.location_id * 8 + 5, "
+             "                    OLD.location_id * 8 + 6); "
+             "END"),
+            "DELETE FROM Search",
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT subject_id * 8, codename, ring_id FROM Subject"),
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT T.information_id * 8 + 1, T.value, S.ring_id "
+             "FROM Text T INNER JOIN Information I "
+             "     ON T.information_id = I.information_id "
+             "    INNER JOIN Subject S ON I.subject_id = S.subject_id"),
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT I.information_id * 8 + 2, I.note, S.ring_id "
+             "FROM Information I INNER JOIN Subject S "
+             "     ON I.subject_id = S.subject_id "
+             "WHERE I.note <> ''"),
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT association_id * 8 + 3, note, ring_id "
+             "FROM Association WHERE note <> ''"),
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT time_id * 8 + 4, note, ring_id "
+             "FROM Time WHERE note <> ''"),
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT location_id * 8 + 5, name, ring_id "
+             "FROM Location WHERE name <> ''"),
+            ("INSERT INTO Search(rowid, text, ring_id) "
+             "SELECT location_id * 8 + 6, note, ring_id "
+             "FROM Location WHERE note <> ''"),
+        ],
+        # 4 - subjects whose date parts (*_year, *_month, *_day) changed
+        #     since the last standardization; set by triggers, so changes
+        #     made by any session are seen, cleared by standardize()
+        [
+            ("ALTER TABLE Subject "
+             "ADD COLUMN dirty INTEGER NOT NULL DEFAULT 0"),
+            ("UPDATE Subject SET dirty = 1 "
+             "WHERE subject_id IN (SELECT subject_id FROM Information "
+             "                     WHERE name GLOB '*_year' "
+             "                           OR name GLOB '*_month' "
+             "                           OR name GLOB '*_day')"),
+            ("CREATE TRIGGER IF NOT EXISTS Subject_dirty_insert "
+             "AFTER INSERT ON Information "
+             "WHEN NEW.name GLOB '*_year' OR NEW.name GLOB '*_month' "
+             "     OR NEW.name GLOB '*_day' BEGIN "
+             "    UPDATE Subject SET dirty = 1 "
+             "    WHERE subject_id = NEW.subject_id; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Subject_dirty_update "
+             "AFTER UPDATE OF name, subject_id ON Information "
+             "WHEN NEW.name GLOB '*_year' OR NEW.name GLOB '*_month' "
+             "     OR NEW.name GLOB '*_day' BEGIN "
+             "    UPDATE Subject SET dirty = 1 "
+             "    WHERE subject_id = NEW.subject_id; "
+             "END"),
+            ("CREATE TRIGGER IF NOT EXISTS Subject_dirty_value "
+             "AFTER UPDATE OF value ON Text BEGIN "
+             "    UPDATE Subject SET dirty = 1 "
+             "    WHERE subject_id IN ( "
+             "        SELECT subject_id FROM Information "
+             "        WHERE information_id = NEW.information_id "
+             "              AND (name GLOB '*_year' OR name GLOB '*_month' "
+             "                   OR name GLOB '*_day')); "
+             "END"),
+        ],
+    ]
+
+    """
+    Migration creating the full-text index (Search); it needs FTS5,
+    without it the migration is skipped and done once FTS5 is there.
+    """
+    SEARCH_MIGRATION = 3
+
+    """
+    Entity type and field of Search rows by (rowid % 8).
+    """
+    SEARCH_FIELDS = [
+        ('subject', 'codename'),
+        ('information', 'value'),
+        ('information', 'note'),
+        ('association', 'note'),
+        ('time', 'note'),
+        ('location', 'name'),
+        ('location', 'note'),
+    ]
+
     def __init__(self):
         self.cnx = None
         self.cur = None
+        self.transaction_depth = 0
+        self.transaction_failed = False
+        self.rollbacks = 0
+        self.data_version = None
+        self.activity = {}
+        self.rings = None
+        self.subjects = None
+        self.keyword_ids = None
+        self.keyword_names = None
+        self.keyword_index = None
+        self.search_available = False
+        self.cleanup_composites = set()
+        self.cleanup_keywords = set()
 
     def connect(self, password):
         #lib.reload_config()
@@ -34,6 +364,12 @@ class Database():
 
         try:
             self.cnx = sqlite.connect(ensa.config['db.file'].value)
+            self.data_version = None
+            self.forget_activity()
+            self.forget_identities()
+            self.forget_keywords()
+            self.cleanup_composites.clear()
+            self.cleanup_keywords.clear()
             self.cur = self.cnx.cursor()
             self.query("PRAGMA key='%s'" % password)
             self.query("PRAGMA foreign_keys=ON")
@@ -42,27 +378,253 @@ class Database():
                 with open('files/schema.sql', 'r') as f:
                     for q in f.read().split(';'):
                         self.query(q)
-            return True
+            return self.migrate()
         except Exception as e:
             traceback.print_exc()
             #print(str(e))
             return False
 
+    def get_version(self):
+        try:
+            return self.query("PRAGMA user_version")[0][0]
+        except:
+            log.debug_error()
+            return None
+
+    def migrate(self):
+        """
+        Brings the database schema to the latest version.
+        """
+        version = self.get_version()
+        if version is None:
+            log.err('Cannot determine database version.')
+            return False
+        fts5 = self.fts5_available()
+        for new_version in range(version + 1, len(Database.MIGRATIONS) + 1):
+            log.info('Migrating database to version %d...' % new_version)
+            statements = Database.MIGRATIONS[new_version - 1]
+            if new_version == Database.SEARCH_MIGRATION and not fts5:
+                statements = []
+            if not self.apply_migration(new_version, statements):
+                return False
+        self.search_available = bool(self.query(
+            "SELECT name FROM sqlite_master WHERE name = 'Search'"))
+        if not self.search_available and fts5:
+            """skipped before, SQLite supports FTS5 now"""
+            log.info('Creating full-text index...')
+            if not self.apply_migration(
+                    None, Database.MIGRATIONS[Database.SEARCH_MIGRATION - 1]):
+                return False
+            self.search_available = True
+        if not self.search_available:
+            log.warn('SQLite is built without FTS5, '
+                     'full-text search (`find`) is disabled.')
+        return True
+
+    def apply_migration(self, version, statements):
+        """
+        Runs migration statements and sets database version (if given)
+        in one transaction. Nothing is set if any statement fails.
+        """
+        try:
+            with self.transaction():
+                for statement in statements:
+                    if self.column_added(statement):
+                        continue
+                    log.debug_query(statement)
+                    self.cur.execute(statement)
+                if version is not None:
+                    self.cur.execute("PRAGMA user_version = %d" % version)
+        except sqlite.Error as e:
+            log.err('Database migration failed: %s.' % e)
+            return False
+        return True
+
+    def column_added(self, statement):
+        """
+        Tells whether statement adds a column that already exists.
+        """
+        match = re.match(r'ALTER TABLE (\w+) ADD COLUMN (\w+)', statement,
+                         re.IGNORECASE)
+        if not match:
+            return False
+        table, column = match.groups()
+        return any(row[1] == column for row in self.query(
+            "PRAGMA table_info(%s)" % table))
+
+    def fts5_available(self):
+        try:
+            self.cur.execute("CREATE VIRTUAL TABLE temp.FTS5_probe "
+                             "USING fts5(text)")
+            self.cur.execute("DROP TABLE temp.FTS5_probe")
+            return True
+        except sqlite.Error:
+            return False
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs enclosed statements in a single transaction. Nested scopes
+        are merged, commit happens when the outermost scope ends.
+        Everything is rolled back if an exception leaves the scope or
+        any statement in it failed (DatabaseError is raised then).
+        Scheduled cleanup (see schedule_cleanup()) runs before commit.
+        """
+        if not self.transaction_depth:
+            """
+            BEGIN is explicit and the driver must not commit on its own
+            (it does before CREATE/ALTER), so schema changes roll back too
+            """
+            self.cnx.isolation_level = None
+            self.cur.execute("BEGIN")
+            self.transaction_failed = False
+        self.transaction_depth += 1
+        try:
+            yield self
+            if self.transaction_depth == 1:
+                if not self.transaction_failed:
+                    self.run_scheduled_cleanup()
+                if self.transaction_failed:
+                    raise sqlite.DatabaseError(
+                        'statement failed, changes are rolled back')
+        except:
+            self.transaction_depth -= 1
+            if not self.transaction_depth:
+                self.cnx.rollback()
+                self.cnx.isolation_level = ''
+                self.rollbacks += 1
+                self.forget_activity()
+                self.forget_identities()
+                self.forget_keywords()
+                self.cleanup_composites.clear()
+                self.cleanup_keywords.clear()
+            raise
+        self.transaction_depth -= 1
+        if not self.transaction_depth:
+            try:
+                self.cnx.commit()
+            finally:
+                self.cnx.isolation_level = ''
+
+    def commit(self):
+        """
+        Commits changes of the open transaction early and continues
+        in a new one (e.g. before worker processes are forked, so they
+        do not inherit an open transaction). Failed transaction is not
+        committed, DatabaseError is raised instead.
+        """
+        if not self.transaction_depth:
+            return
+        if self.transaction_failed:
+            raise sqlite.DatabaseError(
+                'statement failed, changes are rolled back')
+        self.run_scheduled_cleanup()
+        self.cnx.commit()
+        self.cur.execute("BEGIN")
+
+    def change_marker(self):
+        """
+        Returns value that differs whenever data may have changed since
+        the last call: by this connection (total_changes, rollbacks) or
+        by commits of any other connection (PRAGMA data_version).
+        """
+        version = self.query("PRAGMA data_version")
+        return (version[0][0] if version else None,
+                self.rollbacks, self.cnx.total_changes)
+
+    def forget_external_changes(self):
+        """
+        Drops all cached data (activity, rings and subjects, keywords
+        and keyword index) if another connection committed changes
+        since the last call (PRAGMA data_version). It is one cheap
+        query, run once per command.
+        """
+        if not self.cnx or self.transaction_depth:
+            return
+        version = self.query("PRAGMA data_version")
+        if version and version[0][0] != self.data_version:
+            self.forget_activity()
+            self.forget_identities()
+            self.forget_keywords()
+            self.data_version = version[0][0]
+
+    def query_failed(self, error):
+        """
+        Reports failed statement; the enclosing transaction (if any)
+        is rolled back when its scope ends.
+        """
+        log.err('Database query failed: %s.' % error)
+        if self.transaction_depth:
+            self.transaction_failed = True
+
     def query(self, command, parameters=None):
-        # TODO lock (because of last insert id)
+        """
+        Runs a statement. Rows are returned for SELECT and PRAGMA,
+        Modification (lastrowid, rowcount) for anything else.
+        """
         log.debug_query(command)
+        failed = False
         try:
             #self.cur.execute(command, parameters or tuple())
             self.cur.execute(command, parameters or tuple())
-            self.cnx.commit()
         except Exception as e:  # mysql.connector.errors.OperationalError:
-            print(str(e))
+            self.query_failed(e)
+            failed = True
         #    self.connect()
         #    self.cur.execute(command, parameters or tuple())
 
-        if command.upper().startswith('SELECT '):
-            return self.cur.fetchall()
-        return []
+        if command.upper().startswith(('SELECT ', 'PRAGMA ')):
+            return [] if failed else self.cur.fetchall()
+        if failed:
+            return Modification(None, 0)
+        """ outside of transaction scope every change is committed """
+        if not self.transaction_depth:
+            self.cnx.commit()
+        return Modification(self.cur.lastrowid, self.cur.rowcount)
+
+    def query_many(self, command, parameters):
+        """
+        Runs a modifying statement once for every item of `parameters`
+        (executemany). Modification with total rowcount is returned.
+        """
+        log.debug_query(command)
+        try:
+            self.cur.executemany(command, parameters)
+        except Exception as e:
+            self.query_failed(e)
+            return Modification(None, 0)
+        """ outside of transaction scope every change is committed """
+        if not self.transaction_depth:
+            self.cnx.commit()
+        return Modification(None, self.cur.rowcount)
+
+    def load_identities(self):
+        """
+        Caches IDs, names and codenames of all rings and subjects,
+        so frequent lookups (prompt, reports) do not hit the database.
+        """
+        if self.rings is None:
+            self.rings = {}
+            self.ring_ids = {}
+            for ring_id, name, reference_time_id in self.query(
+                    "SELECT ring_id, name, reference_time_id FROM Ring"):
+                self.rings[ring_id] = (name, reference_time_id)
+                self.ring_ids[name] = ring_id
+        if self.subjects is None:
+            self.subjects = {}
+            self.subject_ids = {}
+            for subject_id, ring_id, codename in self.query(
+                    "SELECT subject_id, ring_id, codename FROM Subject"):
+                self.subjects[subject_id] = (ring_id, codename)
+                self.subject_ids[(ring_id, codename)] = subject_id
+
+    def forget_identities(self):
+        """
+        Drops cached rings and subjects, must be called whenever
+        they are created, deleted or renamed.
+        """
+        self.rings = None
+        self.subjects = None
 
     def ring_ok(self):
         if not ensa.current_ring:
@@ -97,35 +659,35 @@ class Database():
                         "VALUES(:n, :note)"),
                        {'n': name,
                         'note': note})
+            self.forget_identities()
             return name
         except:
             log.debug_error()
             return ''
 
     def select_ring(self, name):
-        result = self.query(("SELECT ring_id, reference_time_id "
-                             "FROM Ring "
-                             "WHERE name = :n"),
-                            {'n': name})
-        if result:
-            return result[0]
+        self.load_identities()
+        ring_id = self.ring_ids.get(name)
+        if ring_id is not None:
+            return (ring_id, self.rings[ring_id][1])
         log.err('There is no such ring.')
         return None
 
     def get_ring_name(self, ring_id):
-        result = self.query(("SELECT name "
-                             "FROM Ring "
-                             "WHERE ring_id = :r"),
-                            {'r': ring_id})
-        if result:
-            return result[0][0]
-        log.err('There is no such ring.')
-        return None
+        self.load_identities()
+        try:
+            return self.rings[int(ring_id)][0]
+        except:
+            log.err('There is no such ring.')
+            return None
 
     def delete_ring(self, ring_id):
         self.query(("DELETE FROM Ring "
                     "WHERE ring_id = :r"),
                    {'r': ring_id})
+        self.forget_activity()
+        self.forget_identities()
+        self.keyword_index = None
 
     def set_ring_reference_time_id(self, reference_time_id):
         if not self.ring_ok():
@@ -135,8 +697,26 @@ class Database():
                     "WHERE ring_id = :r"),
                    {'rtid': reference_time_id,
                     'r': ensa.current_ring})
+        self.forget_identities()
 
-    def standardize(self):
+    def standardize_dirty(self):
+        """
+        Standardizes subjects of the current ring whose date parts
+        changed since the last run (Subject.dirty), nothing is done
+        if the ring is clean.
+        """
+        if not ensa.current_ring:
+            log.err('Choose a ring first.')
+            return
+        dirty = [row[0] for row in self.query(
+            ("SELECT subject_id FROM Subject "
+             "WHERE ring_id = :r AND dirty = 1"),
+            {'r': ensa.current_ring})]
+        if dirty:
+            self.standardize(subject_ids=dirty)
+
+    @transactional
+    def standardize(self, subject_ids=None):
         if not ensa.current_ring:
             log.err('Choose a ring first.')
             return
@@ -149,72 +729,138 @@ class Database():
         # sawp and sawo should control that, otherwise we cannot guess
         # the name properly...
         """ convert birth_* and others to Time entry """
-        informations = self.get_informations()
         events = ['birth', 'death']  # TODO more
-
-        for subject_id in set([i[1] for i in informations]):
+        """ index date parts by (subject, name), first one wins """
+        names = ["'%s_%s'" % (event, part) for event in events
+                 for part in ('year', 'month', 'day')]
+        if subject_ids is None and ensa.current_subject:
+            subject_ids = [ensa.current_subject]
+        if subject_ids is None:
+            self.query("UPDATE Subject SET dirty = 0 WHERE ring_id = ?",
+                       (ensa.current_ring,))
+            chunks = [[]]
+        else:
+            subject_ids = sorted(set(int(x) for x in subject_ids))
+            self.query_many(("UPDATE Subject SET dirty = 0 "
+                             "WHERE ring_id = ? AND subject_id = ?"),
+                            [(ensa.current_ring, x) for x in subject_ids])
+            chunks = [subject_ids[i:i + 500]
+                      for i in range(0, len(subject_ids), 500)]
+        informations = {}
+        for chunk in chunks:
+            condition = "WHERE S.ring_id = ? "
+            if chunk:
+                condition += ("      AND I.subject_id IN (%s) "
+                              % ','.join('?' * len(chunk)))
+            for info in self.query((
+                    "SELECT I.information_id, I.subject_id, I.name, "
+                    "       I.accuracy, I.valid, T.value "
+                    "FROM Subject S "
+                    "     INNER JOIN Information I "
+                    "         ON S.subject_id = I.subject_id "
+                    "     LEFT JOIN Text T "
+                    "         ON I.information_id = T.information_id " +
+                    condition +
+                    "      AND I.name IN (" + ','.join(names) + ") "
+                    "ORDER BY I.information_id"),
+                    [ensa.current_ring] + chunk):
+                informations.setdefault((info[1], info[2]), info)
+        existing_notes = set(row[0] for row in self.query(
+            ("SELECT note FROM Association WHERE ring_id = :r"),
+            {'r': ensa.current_ring}))
+
+        conversions = []
+        for subject_id in sorted(set(key[0] for key in informations)):
             codename = self.get_subject_codename(subject_id)
             for event in events:
-                # find id and value of y, m, d for an event
-                try:
-                    y = [i for i in informations if i[1] ==
-                         subject_id and i[4] == '%s_year' % event][0]
-                except:
-                    y = None
-                try:
-                    m = [i for i in informations if i[1] == subject_id and i[4]
-                         == '%s_month' % event][0]
-                except:
-                    m = None
+                # find y, m, d entries for an event
+                y, m, d = (informations.get((subject_id, '%s_%s' % (event, part)))
+                           for part in ('year', 'month', 'day'))
+                as_note = '%s\'s %s' % (codename.title(), event)
+                if not (y and m and d) or as_note in existing_notes:
+                    continue
                 try:
-                    d = [i for i in informations if i[1] ==
-                         subject_id and i[4] == '%s_day' % event][0]
+                    date = datetime(int(y[5]), int(m[5]), int(d[5]))
                 except:
-                    d = None
+                    log.debug_error()
+                    log.err('Cannot convert %s to time entry.' % as_note)
+                    continue
+                existing_notes.add(as_note)
+                conversions.append((subject_id, as_note, date,
+                                    min(x[3] for x in (y, m, d)),
+                                    all(x[4] for x in (y, m, d)),
+                                    (y[0], m[0], d[0])))
+        if not conversions:
+            return
 
-                as_note = '%s\'s %s' % (codename.title(), event)
-                """create if possible"""
-                if y and m and d and not [x for x in self.get_associations()
-                                          if x[6] == as_note]:
-                    accuracy = min(x[6] for x in (y, m, d))
-                    valid = all(x[7] for x in (y, m, d))
-                    time_id = self.create_time(
-                        '%04d-%02d-%02d' % (int(y[11]),
-                                            int(m[11]), int(d[11])),
-                        '00:00', accuracy=accuracy, valid=valid, note=as_note)
-                    as_id = self.create_association(
-                        accuracy=accuracy, valid=valid, note=as_note)
-                    self.associate_subject(as_id, codename)
-                    self.associate_time(as_id, time_id)
-                    """delete information entries"""
-                    if ensa.current_subject != subject_id:
-                        ensa.current_subject = subject_id
-                    self.delete_information(y[0])
-                    self.delete_information(m[0])
-                    self.delete_information(d[0])
+        """
+        create time and association entries, IDs are assigned by
+        the database (no guessing, concurrent sessions may insert too);
+        anything short rolls the whole standardization back
+        """
+        now = datetime.now()
+        associations = []
+        deleted = []
+        for subject_id, note, date, accuracy, valid, ids in conversions:
+            time_id = self.query(
+                ("INSERT INTO Time(time, accuracy, valid, ring_id, "
+                 "                 modified, note) "
+                 "VALUES(:d, :a, :v, :r, :m, :n)"),
+                {'d': lib.datetime_to_str(date), 'a': accuracy, 'v': valid,
+                 'r': ensa.current_ring, 'm': now, 'n': note}).lastrowid
+            association_id = self.query(
+                ("INSERT INTO Association(ring_id, accuracy, valid, "
+                 "                        modified, note) "
+                 "VALUES(:r, :a, :v, :m, :n)"),
+                {'r': ensa.current_ring, 'a': accuracy, 'v': valid,
+                 'm': now, 'n': note}).lastrowid
+            if not time_id or not association_id:
+                log.err('Cannot create time entry for %s, '
+                        'nothing is converted.' % note)
+                raise sqlite.DatabaseError('standardization failed')
+            associations.append({'as': association_id, 't': time_id,
+                                 's': subject_id})
+            deleted += [{'i': information_id} for information_id in ids]
+        self.query_many(("INSERT INTO AI(association_id, information_id) "
+                         "SELECT :as, information_id "
+                         "FROM Information "
+                         "WHERE subject_id = :s AND name = 'codename'"),
+                        associations)
+        if self.query_many(("INSERT INTO AT(association_id, time_id) "
+                            "VALUES(:as, :t)"),
+                           associations).rowcount != len(associations):
+            log.err('Cannot link time entries, nothing is converted.')
+            raise sqlite.DatabaseError('standardization failed')
+        """ delete converted information entries """
+        self.query_many(("DELETE FROM Information "
+                         "WHERE information_id = :i"), deleted)
+        self.forget_activity()
+        for information_id in (x['i'] for x in deleted):
+            if os.path.isfile('files/binary/%d' % information_id):
+                os.remove('files/binary/%d' % information_id)
+        log.info('%d event(s) converted to time entries.' % len(conversions))
 
 
 ###########################################
 # Subject methods
 ###########################################
 
+    @transactional
     def create_subject(self, codename, note=None):
         if not self.ring_ok():
             return None
         try:
-            self.query(("INSERT INTO Subject(ring_id, codename, created, note) "
-                        "VALUES(:r, :c, :d, :n)"),
-                       {'r': ensa.current_ring,
-                        'c': codename,
-                        'd': datetime.now(),
-                        'n': note})
-            #subject_id = self.query("SELECT LAST_INSERT_ID()")[0][0]
-            subject_id = self.query(("SELECT subject_id "
-                                     "FROM Subject "
-                                     "ORDER BY subject_id DESC LIMIT 1"))[0][0]
+            subject_id = self.query(
+                ("INSERT INTO Subject(ring_id, codename, created, note) "
+                 "VALUES(:r, :c, :d, :n)"),
+                {'r': ensa.current_ring,
+                 'c': codename,
+                 'd': datetime.now(),
+                 'n': note}).lastrowid
             if not subject_id:
                 log.err('Cannot retrieve the new subject ID.')
                 return None
+            self.forget_identities()
             ensa.current_subject = subject_id
             self.create_information(Database.INFORMATION_TEXT,
                                     'codename',
@@ -246,28 +892,23 @@ class Database():
     def select_subject(self, codename):
         if not self.ring_ok():
             return None
-        result = self.query(("SELECT subject_id "
-                             "FROM Subject "
-                             "WHERE codename = :c "
-                             "      AND ring_id = :r"),
-                            {'c': codename,
-                             'r': ensa.current_ring})
-        if result:
-            return result[0][0]
+        self.load_identities()
+        subject_id = self.subject_ids.get((ensa.current_ring, codename))
+        if subject_id is not None:
+            return subject_id
         log.err('There is no such subject in this ring.')
         return None
 
     def get_subject_codename(self, subject_id):
         if not self.ring_ok():
             return None
-        result = self.query(("SELECT codename "
-                             "FROM Subject "
-                             "WHERE subject_id = :s "
-                             "      AND ring_id = :r"),
-                            {'s': subject_id,
-                             'r': ensa.current_ring})
-        if result:
-            return result[0][0]
+        self.load_identities()
+        try:
+            ring_id, codename = self.subjects[int(subject_id)]
+        except:
+            ring_id = codename = None
+        if ring_id == ensa.current_ring:
+            return codename
         log.err('There is no such subject in this ring.')
         return None
 
@@ -279,23 +920,95 @@ class Database():
                     "      AND ring_id = :r"),
                    {'s': subject_id,
                     'r': ensa.current_ring})
+        self.forget_activity()
+        self.forget_identities()
 ###########################################
 # Information methods
 ###########################################
 
     def information_cleanup(self, *args):
+        """
+        Full sweep (all rings) of composites without parts and keywords
+        without informations. Returns numbers of deleted composites
+        and keywords.
+        """
+        composites = keywords = 0
         if not args or 'composites' in args:
-            self.query(("DELETE FROM Information "
-                        "WHERE type = :t "
-                        "      AND information_id NOT IN "
-                        "          (SELECT information_id "
-                        "           FROM Composite)"),
-                       {'t': Database.INFORMATION_COMPOSITE, })
+            composites = self.query(("DELETE FROM Information "
+                                     "WHERE type = :t "
+                                     "      AND information_id NOT IN "
+                                     "          (SELECT information_id "
+                                     "           FROM Composite)"),
+                                    {'t': Database.INFORMATION_COMPOSITE, }
+                                    ).rowcount
+            if composites:
+                self.forget_activity()
         if not args or 'keywords' in args:
-            self.query(("DELETE FROM Keyword "
-                        "WHERE keyword_id NOT IN "
-                        "      (SELECT keyword_id FROM IK)"))
+            keywords = self.query(("DELETE FROM Keyword "
+                                   "WHERE keyword_id NOT IN "
+                                   "      (SELECT keyword_id FROM IK)")
+                                  ).rowcount
+            if keywords:
+                self.forget_keywords()
+        return composites, keywords
+
+    def schedule_cleanup(self, composite_ids=(), keyword_ids=()):
+        """
+        Remembers composites and keywords that may have lost their
+        parts or informations. They are checked when the outermost
+        transaction ends, so a batch is cleaned up just once.
+        """
+        self.cleanup_composites.update(composite_ids)
+        self.cleanup_keywords.update(keyword_ids)
+        if not self.transaction_depth:
+            self.run_scheduled_cleanup()
 
+    def run_scheduled_cleanup(self):
+        """
+        Deletes scheduled composites without parts and keywords
+        without informations.
+        """
+        composite_ids = sorted(self.cleanup_composites)
+        keyword_ids = sorted(self.cleanup_keywords)
+        self.cleanup_composites.clear()
+        self.cleanup_keywords.clear()
+        deleted = 0
+        for i in range(0, len(composite_ids), 500):
+            chunk = composite_ids[i:i + 500]
+            deleted += self.query(("DELETE FROM Information "
+                                   "WHERE type = ? "
+                                   "      AND information_id IN (%s) "
+                                   "      AND NOT EXISTS "
+                                   "          (SELECT 1 "
+                                   "           FROM Composite C "
+                                   "           WHERE C.information_id = "
+                                   "                 Information.information_id)"
+                                   % ','.join('?' * len(chunk))),
+                                  [Database.INFORMATION_COMPOSITE] + chunk
+                                  ).rowcount
+        if deleted:
+            self.forget_activity()
+        for i in range(0, len(keyword_ids), 500):
+            chunk = keyword_ids[i:i + 500]
+            unused = [row[0] for row in self.query(
+                ("SELECT keyword_id "
+                 "FROM Keyword "
+                 "WHERE keyword_id IN (%s) "
+                 "      AND NOT EXISTS "
+                 "          (SELECT 1 "
+                 "           FROM IK "
+                 "           WHERE IK.keyword_id = Keyword.keyword_id)"
+                 % ','.join('?' * len(chunk))), chunk)]
+            if not unused:
+                continue
+            self.query(("DELETE FROM Keyword WHERE keyword_id IN (%s)"
+                        % ','.join('?' * len(unused))), unused)
+            if self.keyword_ids is not None:
+                for keyword_id in unused:
+                    self.keyword_ids.pop(
+                        self.keyword_names.pop(keyword_id, None), None)
+
+    @transactional
     def create_information(self,
                            info_type,
                            name,
@@ -308,22 +1021,26 @@ class Database():
         if not self.subject_ok():
             return None
         try:
-            self.query(("INSERT INTO Information(subject_id, type, name, "
-                        "            accuracy, level, valid, modified, note) "
-                        "VALUES(:s, :t, :n, :a, :l, :v, :m, :note)"),
-                       {'s': ensa.current_subject,
-                        't': info_type,
-                        'n': name,
-                        'a': accuracy,
-                        'l': level,
-                        'v': valid,
-                        'm': datetime.now(),
-                        'note': note})
-            #information_id = self.query("SELECT LAST_INSERT_ID()")[0][0]
-            information_id = self.query(("SELECT information_id "
-                                         "FROM Information "
-                                         "ORDER BY information_id DESC LIMIT 1"
-                                         ))[0][0]
+            information_id = self.query(
+                ("INSERT INTO Information(subject_id, type, name, "
+                 "            accuracy, level, valid, modified, note) "
+                 "VALUES(:s, :t, :n, :a, :l, :v, :m, :note)"),
+                {'s': ensa.current_subject,
+                 't': info_type,
+                 'n': name,
+                 'a': accuracy,
+                 'l': level,
+                 'v': valid,
+                 'm': datetime.now(),
+                 'note': note}).lastrowid
+            if not information_id:
+                log.err('Cannot retrieve the new information ID.')
+                return None
+            if (self.keyword_index
+                    and self.keyword_index.ring_id == ensa.current_ring
+                    and not self.keyword_index.add_information(
+                        information_id, ensa.current_subject)):
+                self.keyword_index = None
 
             if info_type == Database.INFORMATION_TEXT:
                 self.query(("INSERT INTO Text(information_id, value) "
@@ -341,7 +1058,7 @@ class Database():
                             "      AND subject_id = :s"),
                            {'i': information_id,
                             's': ensa.current_subject})
-                self.information_cleanup('composites')
+                self.schedule_cleanup(composite_ids=[information_id])
 
             """ set active/inactive """
             self.add_active(information_id, 
@@ -362,16 +1079,17 @@ class Database():
                   'files/binary/%d' % information_id)
         """add extension as keyword"""
         extension = filename.rpartition('.')[2].lower()
-        ensa.db.add_keyword(information_id,
-                            'extension:%s' % extension)
+        keywords = ['extension:%s' % extension]
         """try to guess file type"""
         if extension in ('jpg', 'png', 'bmp', 'gif'):
-            ensa.db.add_keyword(information_id, 'image')
+            keywords.append('image')
         if extension in ('doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx',
                          'pps', 'ppsx', 'pdf', 'odt', 'txt'):
-            ensa.db.add_keyword(information_id, 'document')
+            keywords.append('document')
         # TODO more
+        ensa.db.add_keywords(information_id, keywords)
 
+    @transactional
     def delete_information(self, information_id):
         # test if can delete
         try:
@@ -385,89 +1103,113 @@ class Database():
             log.debug_error()
             log.err('That information does not belong to current subject.')
             return
+        """composites and keywords of the information may become empty"""
+        composite_ids = [row[0] for row in self.query(
+            "SELECT information_id FROM Composite WHERE part_id = :i",
+            {'i': information_id})]
+        keyword_ids = [row[0] for row in self.query(
+            "SELECT keyword_id FROM IK WHERE information_id = :i",
+            {'i': information_id})]
         self.query(("DELETE FROM Information "
                     "WHERE information_id = :i"),
                    {'i': information_id})
+        self.forget_activity()
+        self.schedule_cleanup(composite_ids, keyword_ids)
         if os.path.isfile('files/binary/%s' % information_id):
             os.remove('files/binary/%d' % information_id)
         log.info('Information deleted.')
 
-    def get_informations(self, info_type=None, no_composite_parts=False, force_no_current_subject=False):
-        # if not self.subject_ok():
-        #    return []
+    def get_information_data(self, scope, scope_args=None):
+        """
+        Loads values and composite parts for all information entries
+        selected by `scope` (FROM and WHERE part of a query, Information
+        table must be aliased as I).
+        Constant number of queries is used regardless of entry count.
+        Returns (values, parts) dictionaries keyed by information_id.
+        """
+        subquery = "(SELECT I.information_id " + scope + ")"
+        values = dict(self.query(("SELECT information_id, value "
+                                  "FROM Text "
+                                  "WHERE information_id IN " + subquery),
+                                 scope_args))
+        parts = {}
+        for information_id, part_id in self.query((
+                "SELECT information_id, part_id "
+                "FROM Composite "
+                "WHERE information_id IN " + subquery + " "
+                "ORDER BY information_id, part_id"), scope_args):
+            parts.setdefault(information_id, []).append(part_id)
+        return values, parts
+
+    def load_activity(self, information_ids, scope=None, scope_args=None):
+        """
+        Makes sure activity timelines of given information entries
+        are cached. If nothing is cached yet, `scope` (as in
+        get_information_data()) is used instead of the list of IDs.
+        Timelines do not depend on reference time, so they stay
+        valid when it changes.
+        """
+        missing = [i for i in information_ids if i not in self.activity]
+        if not missing:
+            return
+        if scope and len(missing) == len(information_ids):
+            condition = "(SELECT I.information_id " + scope + ")"
+        else:
+            condition = "(" + ','.join(str(x) for x in missing) + ")"
+            scope_args = None
+        timelines = {i: [] for i in missing}
+        for information_id, time, active in self.query((
+                "SELECT A.information_id, T.time, A.active "
+                "FROM Time T INNER JOIN Active A "
+                "     ON T.time_id = A.time_id "
+                "WHERE A.information_id IN " + condition + " "
+                "ORDER BY T.time"), scope_args):
+            timelines.setdefault(information_id, []).append(
+                (lib.datetime_from_str(time), bool(active)))
+        for information_id, timeline in timelines.items():
+            timeline.sort(key=lambda x: x[0])
+            self.activity[information_id] = ([x[0] for x in timeline],
+                                              [x[1] for x in timeline])
+
+    def forget_activity(self, information_ids=None):
+        """
+        Drops cached activity timelines (all of them by default).
+        """
+        if information_ids is None:
+            self.activity.clear()
+            return
+        for information_id in information_ids:
+            self.activity.pop(information_id, None)
+
+    def is_active(self, information_id):
+        """
+        Decides whether information is active at reference time
+        using its cached timeline (see load_activity()).
+        """
+        times, actives = self.activity.get(information_id, ([], []))
+        index = bisect_right(times, ensa.variables['reference_time'])
+        return actives[index - 1] if index else False
+
+    def complete_informations(self, infos_nodata, scope, scope_args=None,
+                              info_type=None):
+        """
+        Adds activity and value to information rows selected by `scope`.
+        """
         if info_type is None:
             info_type = Database.INFORMATION_ALL
-        result = []
-        if ensa.current_subject and not force_no_current_subject:
-            if no_composite_parts:
-                """ by subject, no components """
-                infos_nodata = self.query((
-                    "SELECT I.information_id, I.subject_id, S.codename, "
-                    "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                    "       I.modified, I.note "
-                    "FROM Subject S INNER JOIN Information I "
-                    "     ON S.subject_id = I.subject_id "
-                    "WHERE I.subject_id = :s "
-                    "      AND I.information_id NOT IN "
-                    "          (SELECT part_id FROM Composite) "
-                    "ORDER BY I.name"), {'s': ensa.current_subject})
-            else:
-                """ by subject, all """
-                infos_nodata = self.query((
-                    "SELECT I.information_id, I.subject_id, S.codename, "
-                    "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                    "       I.modified, I.note "
-                    "FROM Subject S INNER JOIN Information I "
-                    "     ON S.subject_id = I.subject_id "
-                    "WHERE I.subject_id = :s "
-                    "ORDER BY I.name"), {'s': ensa.current_subject})
-        else:
-            if no_composite_parts:
-                """ all in ring, no components """
-                infos_nodata = self.query((
-                    "SELECT I.information_id, I.subject_id, S.codename, "
-                    "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                    "       I.modified, I.note "
-                    "FROM Subject S INNER JOIN Information I "
-                    "     ON S.subject_id = I.subject_id "
-                    "WHERE S.ring_id = :r "
-                    "      AND I.information_id NOT IN "
-                    "          (SELECT part_id FROM Composite) "
-                    "ORDER BY I.name"), {'r': ensa.current_ring})
-            else:
-                """ all in ring, all """
-                infos_nodata = self.query((
-                    "SELECT I.information_id, I.subject_id, S.codename, "
-                    "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                    "       I.modified, I.note "
-                    "FROM Subject S INNER JOIN Information I "
-                    "     ON S.subject_id = I.subject_id "
-                    "WHERE S.ring_id = :r "
-                    "ORDER BY I.name"), {'r': ensa.current_ring})
+        """ get values and active/inactive in bulk """
+        values, parts = self.get_information_data(scope, scope_args)
+        self.load_activity([info[0] for info in infos_nodata],
+                           scope, scope_args)
 
         infos = []
         for info in infos_nodata:
-            """ get active/inactive """
-            active_times = self.query(("SELECT T.time, A.active "
-                                       "FROM Time T INNER JOIN Active A"
-                                       "     ON T.time_id = A.time_id "
-                                       "WHERE A.information_id = :i "
-                                       "ORDER BY T.time"),
-                                      {'i': info[0]})
-            is_active = False
-            for time, active in active_times:
-                if lib.datetime_from_str(time) <= ensa.variables['reference_time']:
-                    is_active = bool(active)
-                else:
-                    break
+            is_active = self.is_active(info[0])
 
             """ get value """
             if info[3] in [Database.INFORMATION_ALL,
                            Database.INFORMATION_TEXT]:
-                value = self.query(("SELECT value "
-                                    "FROM Text "
-                                    "WHERE information_id = :i"),
-                                   {'i': info[0]})[0][0]
+                value = values.get(info[0])
                 '''
                 elif info[3] in [Database.INFORMATION_ALL, 
                                  Database.INFORMATION_BINARY]:
@@ -475,10 +1217,7 @@ class Database():
                 '''
             elif info[3] in [Database.INFORMATION_ALL,
                              Database.INFORMATION_COMPOSITE]:
-                value = [row[0] for row in self.query((
-                    "SELECT part_id "
-                    "FROM Composite "
-                    "WHERE information_id = :i"), {'i': info[0]})]
+                value = parts.get(info[0], [])
             else:
                 value = 'ERROR'
 
@@ -487,9 +1226,35 @@ class Database():
                     or info_type == info[3]):
                 to_add = [is_active, value]
             infos.append(tuple(list(info) + to_add))
+        return infos
+
+    def get_informations(self, info_type=None, no_composite_parts=False, force_no_current_subject=False):
+        # if not self.subject_ok():
+        #    return []
+        if ensa.current_subject and not force_no_current_subject:
+            """ by subject """
+            condition = "WHERE I.subject_id = :s "
+            args = {'s': ensa.current_subject}
+        else:
+            """ all in ring """
+            condition = "WHERE S.ring_id = :r "
+            args = {'r': ensa.current_ring}
+        if no_composite_parts:
+            """ no components """
+            condition += ("      AND I.information_id NOT IN "
+                          "          (SELECT part_id FROM Composite) ")
+        scope = ("FROM Subject S INNER JOIN Information I "
+                 "     ON S.subject_id = I.subject_id " + condition)
+        infos_nodata = self.query((
+            "SELECT I.information_id, I.subject_id, S.codename, "
+            "       I.type, I.name, I.level, I.accuracy, I.valid, "
+            "       I.modified, I.note " + scope +
+            "ORDER BY I.name, I.information_id"), args)
+        if not infos_nodata:
+            return []
         #for info in infos:
         #    print(info)
-        return infos
+        return self.complete_informations(infos_nodata, scope, args, info_type)
 
     def get_information(self, information_id):
         try:
@@ -527,6 +1292,7 @@ class Database():
             value = 'ERROR'
         return tuple(list(info)+[value])
 
+    @transactional
     def update_information(self, **kwargs):
         if not self.subject_ok():
             return
@@ -612,6 +1378,7 @@ class Database():
                    {'i': information_id,
                     't': time_id,
                     'a': active})
+        self.forget_activity([information_id])
 
     def set_active(self, information_ids, time_id, active):
         if type(information_ids) == int:
@@ -624,6 +1391,7 @@ class Database():
                     "      AND time_id = :t "),
                    {'t': time_id,
                     'a': active})
+        self.forget_activity()
 ###########################################
 # Location methods
 ###########################################
@@ -639,20 +1407,18 @@ class Database():
         if not self.ring_ok():
             return None
         try:
-            self.query(("INSERT INTO Location(name, lat, lon, accuracy, valid, "
-                        "                     ring_id, modified, note) "
-                        "VALUES(:n, :lat, :lon, :a, :v, :r, :m, :note)"),
-                       {'n': name,
-                        'lat': lat,
-                        'lon': lon,
-                        'a': accuracy,
-                        'v': valid,
-                        'r': ensa.current_ring,
-                        'm': datetime.now(),
-                        'note': note})
-            location_id = self.query("SELECT location_id "
-                                     "FROM Location "
-                                     "ORDER BY location_id DESC LIMIT 1")[0][0]
+            location_id = self.query(
+                ("INSERT INTO Location(name, lat, lon, accuracy, valid, "
+                 "                     ring_id, modified, note) "
+                 "VALUES(:n, :lat, :lon, :a, :v, :r, :m, :note)"),
+                {'n': name,
+                 'lat': lat,
+                 'lon': lon,
+                 'a': accuracy,
+                 'v': valid,
+                 'r': ensa.current_ring,
+                 'm': datetime.now(),
+                 'note': note}).lastrowid
             return location_id
         except:
             log.debug_error()
@@ -783,47 +1549,76 @@ class Database():
         dt = lib.datetime_from_str('%s %s' % (d, t))
         # TODO find if not exists
         try:
-            self.query(("INSERT INTO Time(time, accuracy, valid, ring_id, "
-                        "                 modified, note) "
-                        "VALUES(:d, :a, :v, :r, :m, :n)"),
-                       {'d': dt,
-                        'a': accuracy,
-                        'v': valid,
-                        'r': ensa.current_ring,
-                        'm': datetime.now(),
-                        'n': note})
-            time_id = self.query("SELECT time_id "
-                                 "FROM Time "
-                                 "ORDER BY time_id DESC LIMIT 1")[0][0]
+            time_id = self.query(
+                ("INSERT INTO Time(time, accuracy, valid, ring_id, "
+                 "                 modified, note) "
+                 "VALUES(:d, :a, :v, :r, :m, :n)"),
+                {'d': lib.datetime_to_str(dt) if dt else None,
+                 'a': accuracy,
+                 'v': valid,
+                 'r': ensa.current_ring,
+                 'm': datetime.now(),
+                 'n': note}).lastrowid
             return time_id
         except:
             log.debug_error()
             return None
 
+    def get_time_condition(self, interval=None):
+        """
+        Returns WHERE part and arguments selecting time entries
+        of current ring, optionally limited to (start, end) interval.
+        Time.time is stored canonically, so the range is compared
+        as strings and can use the Time_ring_time index.
+        """
+        condition = "WHERE ring_id = :r "
+        args = {'r': ensa.current_ring}
+        if interval:
+            start, end = interval
+            condition += "      AND time BETWEEN :start AND :end "
+            args.update({'start': lib.datetime_to_str(start),
+                         'end': lib.datetime_to_str(end)})
+        return condition, args
+
     def get_times(self, interval=None, sort='time'):
         if not self.ring_ok():
             return []
-        result = self.query(("SELECT time_id, "
-                             #"       DATE_FORMAT(time, '%Y-%m-%d %H:%i:%s'), "
-                             "       time, "
-                             "       accuracy, valid, modified, note "
-                             #"       accuracy, valid, note "
-                             "FROM Time "
-                             "WHERE ring_id = :r "
-                             "ORDER BY time"), # TODO use sort here when it works
-                            {'r': ensa.current_ring,
-                             's': sort})
-        #print(result)
-        if interval:
-            start, end = interval
-            if type(start) == str:
-                start = lib.datetime_from_str(start)
-            if type(end) == str:
-                end = lib.datetime_from_str(end)
-            result = [x for x in result 
-                      if lib.datetime_from_str(x[1]) >= start 
-                      and lib.datetime_from_str(x[1]) <= end]
-        return result
+        condition, args = self.get_time_condition(interval)
+        return self.query(("SELECT time_id, "
+                           #"       DATE_FORMAT(time, '%Y-%m-%d %H:%i:%s'), "
+                           "       time, "
+                           "       accuracy, valid, modified, note "
+                           #"       accuracy, valid, note "
+                           "FROM Time " + condition +
+                           "ORDER BY time, time_id"), # TODO use sort here when it works
+                          args)
+
+    def iter_times(self, interval=None, page_size=1000):
+        """
+        Yields the same rows as get_times(), reading them
+        in pages of `page_size` entries.
+        """
+        if not self.ring_ok():
+            return
+        condition, args = self.get_time_condition(interval)
+        args['n'] = page_size
+        last = None
+        while True:
+            if last:
+                args.update({'last_time': last[1], 'last_id': last[0]})
+            page = self.query(("SELECT time_id, time, "
+                               "       accuracy, valid, modified, note "
+                               "FROM Time " + condition +
+                               ("      AND (time > :last_time "
+                                "           OR (time = :last_time "
+                                "               AND time_id > :last_id)) "
+                                if last else "") +
+                               "ORDER BY time, time_id "
+                               "LIMIT :n"), args)
+            yield from page
+            if len(page) < page_size:
+                return
+            last = page[-1]
 
     def delete_times(self, time_ids):
         if not self.ring_ok():
@@ -835,6 +1630,7 @@ class Database():
         self.query(("DELETE FROM Time "
                     "WHERE time_id IN ("+time_ids+") "
                     "      AND ring_id = :r"), {'r': ensa.current_ring})
+        self.forget_activity()
 
     def get_time(self, time_id, force_no_current_ring=False):
         #if not self.ring_ok():
@@ -879,6 +1675,7 @@ class Database():
                         "    valid = :v, note = :note "
                         "WHERE time_id = :t "
                         "      AND ring_id = :r"), args)
+            self.forget_activity()
         except:
             log.debug_error()
             log.err("Time update failed.")
@@ -926,239 +1723,117 @@ class Database():
         if not self.ring_ok():
             return None
         try:
-            self.query(("INSERT INTO Association(ring_id, level, accuracy, "
-                        "                        valid, modified, note) "
-                        "VALUES(:r, :l, :a, :v, :m, :n)"),
-                       {'r': ensa.current_ring,
-                        'l': level,
-                        'a': accuracy,
-                        'v': valid,
-                        'm': datetime.now(),
-                        'n': note})
-            association_id = self.query("SELECT association_id "
-                                        "FROM Association "
-                                        "ORDER BY association_id DESC "
-                                        "LIMIT 1")[0][0]
+            association_id = self.query(
+                ("INSERT INTO Association(ring_id, level, accuracy, "
+                 "                        valid, modified, note) "
+                 "VALUES(:r, :l, :a, :v, :m, :n)"),
+                {'r': ensa.current_ring,
+                 'l': level,
+                 'a': accuracy,
+                 'v': valid,
+                 'm': datetime.now(),
+                 'n': note}).lastrowid
             return association_id
         except:
             log.debug_error()
             return None
 
-    def associate_association(self, association_id, association_ids):
+    @transactional
+    def associate(self, kind, pairs):
+        """
+        Links targets of given kind ('association', 'information',
+        'location', 'subject' (codename) or 'time') to associations.
+        Pairs of (association_id, target) are inserted by one prepared
+        statement per association, targets outside the current ring and
+        existing links are skipped. Database errors are left to the
+        transaction so it is rolled back.
+        Returns number of new links or None if nothing was linked.
+        """
         if not self.ring_ok():
             return None
-        if type(association_ids) == int:
-            association_ids = str(association_ids)
-        if type(association_ids) in (filter, tuple, list):
-            association_ids = ','.join(str(x) for x in association_ids)
+        insert, target_name = Database.ASSOCIATION_LINKS[kind]
         try:
-            ring_id = self.query(("SELECT DISTINCT ring_id "
-                                  "FROM Association "
-                                  "WHERE association_id = :a "
-                                  "      OR association_id IN "
-                                  "          ("+association_ids+")"),
-                                 {'a': association_id})
-            if len(ring_id) != 1:
-                raise AttributeError
-            ring_id = ring_id[0][0]
-            if ring_id != ensa.current_ring:
-                raise AttributeError
-        except:
-            log.err('All associations must belong to current ring.')
+            pairs = [(int(a), t if kind == 'subject' else int(t))
+                     for a, t in pairs]
+        except (TypeError, ValueError):
+            log.err('Invalid ID.')
             return None
-        try:
-            count_before = self.query("SELECT COUNT(*) FROM AA")[0][0]
-            self.query(("INSERT INTO AA(association_id_1, association_id_2) "
-                        "SELECT :a, association_id "
-                        "FROM Association "
-                        "WHERE association_id IN (" + association_ids + ") "
-                        "      AND ring_id = :r"),
-                       {'a': association_id,
-                        'r': ensa.current_ring})
-            count_after = self.query("SELECT COUNT(*) FROM AA")[0][0]
-            if count_before == count_after:
-                log.err('Association must belong to current ring.')
-                return None
-            self.query(("UPDATE Association "
-                        "SET modified = :m "
-                        "WHERE association_id = :a"),
-                       {'m': datetime.now(),
-                        'a': association_id})
-            return tuple([(association_id, a)
-                          for a in association_ids.split(',')])
-        except:
-            log.debug_error()
-            log.err('Failed to associate association.')
+        if not pairs:
             return None
-
-    def associate_information(self, association_id, information_ids):
-        if not self.ring_ok():
-            return None
-        if type(information_ids) == int:
-            information_ids = str(information_ids)
-        if type(information_ids) in (filter, tuple, list):
-            information_ids = ','.join(str(x) for x in information_ids)
-        try:
-            ring_id = self.query(("SELECT ring_id "
-                                  "FROM Association "
-                                  "WHERE association_id = :a"),
-                                 {'a': association_id})[0][0]
-            if ring_id != ensa.current_ring:
-                raise AttributeError
-        except:
+        targets = {}
+        for a, t in pairs:
+            targets.setdefault(a, []).append(t)
+        association_ids = sorted(targets)
+        found = 0
+        for i in range(0, len(association_ids), 500):
+            chunk = association_ids[i:i + 500]
+            found += self.query(("SELECT COUNT(*) "
+                                 "FROM Association "
+                                 "WHERE ring_id = ? "
+                                 "      AND association_id IN (%s)"
+                                 % ','.join('?' * len(chunk))),
+                                [ensa.current_ring] + chunk)[0][0]
+        if found != len(association_ids):
             log.err('Current ring has no such asssociation.')
             return None
-        try:
-            count_before = self.query("SELECT COUNT(*) FROM AI")[0][0]
-            self.query(("INSERT INTO AI(association_id, information_id) "
-                        "SELECT :a, information_id "
-                        "FROM Information "
-                        "WHERE information_id IN (" + information_ids + ") "
-                        "      AND subject_id IN "
-                        "          (SELECT subject_id "
-                        "           FROM Subject "
-                        "         WHERE ring_id = :r)"),
-                       {'a': association_id,
-                        'r': ensa.current_ring})
-            count_after = self.query("SELECT COUNT(*) FROM AI")[0][0]
-            if count_before == count_after:
-                log.err('Information must belong to current ring.')
-                return None
-            self.query(("UPDATE Association "
-                        "SET modified = :m "
-                        "WHERE association_id = :a"),
-                       {'m': datetime.now(),
-                        'a': association_id})
-            return tuple([(association_id, i) for i in information_ids])
-        except:
-            log.err('Failed to associate information.')
+        """total rowcount of each association tells if it got new links"""
+        log.debug_query(insert)
+        linked = 0
+        modified = []
+        for a in association_ids:
+            self.cur.executemany(insert, [(a, t, ensa.current_ring)
+                                          for t in targets[a]])
+            if self.cur.rowcount > 0:
+                linked += self.cur.rowcount
+                modified.append((datetime.now(), a))
+        if not linked:
+            log.err('%s must belong to current ring.' % target_name)
             return None
+        if linked < len(pairs):
+            log.warn('%d of %d link(s) skipped (not in current ring '
+                     'or already present).'
+                     % (len(pairs) - linked, len(pairs)))
+        self.query_many(("UPDATE Association "
+                         "SET modified = ? "
+                         "WHERE association_id = ?"),
+                        modified)
+        return linked
+
+    def split_targets(self, targets):
+        """
+        Targets can be given as single value, comma-separated string
+        or any iterable.
+        """
+        if type(targets) == str:
+            return [t.strip() for t in targets.split(',') if t.strip()]
+        if type(targets) == int:
+            return [targets]
+        return list(targets)
+
+    def associate_association(self, association_id, association_ids):
+        return self.associate('association',
+                              [(association_id, a) for a
+                               in self.split_targets(association_ids)])
+
+    def associate_information(self, association_id, information_ids):
+        return self.associate('information',
+                              [(association_id, i) for i
+                               in self.split_targets(information_ids)])
 
     def associate_location(self, association_id, location_ids):
-        if not self.ring_ok():
-            return None
-        if type(location_ids) == int:
-            location_ids = str(location_ids)
-        if type(location_ids) in (filter, tuple, list):
-            location_ids = ','.join(str(x) for x in location_ids)
-        try:
-            ring_id = self.query(("SELECT ring_id "
-                                  "FROM Association "
-                                  "WHERE association_id = :a"),
-                                 {'a': association_id})[0][0]
-            if ring_id != ensa.current_ring:
-                raise AttributeError
-        except:
-            log.err('Current ring has no such asssociation.')
-            return None
-        try:
-            count_before = self.query("SELECT COUNT(*) FROM AL")[0][0]
-            self.query(("INSERT INTO AL(association_id, location_id) "
-                        "SELECT :a, location_id "
-                        "FROM Location "
-                        "WHERE location_id IN (" + location_ids + ") "
-                        "      AND ring_id = :r"),
-                       {'a': association_id,
-                        'r': ensa.current_ring})
-            count_after = self.query("SELECT COUNT(*) FROM AL")[0][0]
-            if count_before == count_after:
-                log.err('Location must belong to current ring.')
-                return None
-            self.query(("UPDATE Association "
-                        "SET modified = :m "
-                        "WHERE association_id = :a"),
-                       {'m': datetime.now(),
-                        'a': association_id})
-            return tuple([(association_id, l) for l in location_ids])
-        except:
-            log.debug_error()
-            log.err('Failed to associate location.')
-            return None
+        return self.associate('location',
+                              [(association_id, l) for l
+                               in self.split_targets(location_ids)])
 
     def associate_subject(self, association_id, codenames):
-        if not self.ring_ok():
-            return None
-        if type(codenames) in (filter, tuple, list):
-            codenames = "','".join(codenames)
-        try:
-            ring_id = self.query(("SELECT ring_id "
-                                  "FROM Association "
-                                  "WHERE association_id = :a"),
-                                 {'a': association_id})[0][0]
-            if ring_id != ensa.current_ring:
-                raise AttributeError
-        except:
-            log.err('Current ring has no such asssociation.')
-            return None
-        try:
-            count_before = self.query("SELECT COUNT(*) FROM AI")[0][0]
-            # pdb.set_trace()
-            self.query(("INSERT INTO AI(association_id, information_id) "
-                        "SELECT :a, I.information_id "
-                        "FROM Subject S INNER JOIN Information I "
-                        "     ON S.subject_id = I.subject_id "
-                        "WHERE I.name = 'codename' "
-                        "      AND S.codename IN ('" + codenames + "') "
-                        "      AND S.ring_id = :r"),
-                       {'a': association_id, 'r': ensa.current_ring})
-            count_after = self.query("SELECT COUNT(*) FROM AI")[0][0]
-            if count_before == count_after:
-                log.err('Subject must belong to current ring.')
-                return None
-            self.query(("UPDATE Association "
-                        "SET modified = :m "
-                        "WHERE association_id = :a"),
-                       {'m': datetime.now(),
-                        'a': association_id})
-            return tuple([(association_id, codename)
-                          for codename in codenames.split(',')])
-        except:
-            log.debug_error()
-            log.err('Failed to associate subject.')
-            return None
+        return self.associate('subject',
+                              [(association_id, c) for c
+                               in self.split_targets(codenames)])
 
     def associate_time(self, association_id, time_ids):
-        #import pdb
-        # pdb.set_trace()
-        if not self.ring_ok():
-            return None
-        if type(time_ids) == int:
-            time_ids = str(time_ids)
-        if type(time_ids) in (filter, tuple, list):
-            time_ids = ','.join(str(x) for x in time_ids)
-        try:
-            ring_id = self.query(("SELECT ring_id "
-                                  "FROM Association "
-                                  "WHERE association_id = :a"),
-                                 {'a': association_id})[0][0]
-            if ring_id != ensa.current_ring:
-                raise AttributeError
-        except:
-            log.err('Current ring has no such asssociation.')
-            return None
-        try:
-            count_before = self.query("SELECT COUNT(*) FROM AT")[0][0]
-            self.query(("INSERT INTO AT(association_id, time_id) "
-                        "SELECT :a, time_id "
-                        "FROM Time "
-                        "WHERE time_id IN (" + time_ids + ") "
-                        "      AND ring_id = :r"),
-                       {'a': association_id,
-                        'r': ensa.current_ring})
-            count_after = self.query("SELECT COUNT(*) FROM AT")[0][0]
-            if count_before == count_after:
-                log.err('Time must belong to current ring.')
-                return None
-            self.query(("UPDATE Association "
-                        "SET modified = :m "
-                        "WHERE association_id = :a"),
-                       {'m': datetime.now(),
-                        'a': association_id})
-            return tuple([(association_id, t) for t in time_ids])
-        except:
-            log.debug_error()
-            log.err('Failed to associate time.')
-            return None
+        return self.associate('time',
+                              [(association_id, t) for t
+                               in self.split_targets(time_ids)])
 
     def get_associations(self):
         if not self.ring_ok():
@@ -1173,86 +1848,91 @@ class Database():
     def get_associations_by_X(self, query, query_args=None):
         if not self.ring_ok():
             return []
-        # get associations
-        associations = self.query(query, query_args)
-
-        result = []
-        for assoc in associations:
-            # in current ring?
-            if assoc[1] != ensa.current_ring:
-                continue
-            # TODO is ring check needed for ITL entries?
-            # get info entries (+ subject)
-            infos_nodata = self.query(
-                ("SELECT I.information_id, I.subject_id, S.codename, "
-                 "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                 "       I.modified, I.note "
-                 "FROM Subject S INNER JOIN Information I "
-                 "     ON S.subject_id = I.subject_id "
-                 "WHERE information_id IN "
-                 "    (SELECT information_id "
-                 "     FROM AI "
-                 "     WHERE association_id = :a) "
-                 "ORDER BY information_id"), {'a': assoc[0]})
-            infos = []
-            for info in infos_nodata:
-                """ get active/inactive """
-                active_times = self.query(("SELECT T.time, A.active "
-                                           "FROM Time T INNER JOIN Active A"
-                                           "     ON T.time_id = A.time_id "
-                                           "WHERE A.information_id = :i "
-                                           "ORDER BY T.time"),
-                                          {'i': info[0]})
-                is_active = False
-                for time, active in active_times:
-                    if lib.datetime_from_str(time) <= ensa.variables['reference_time']:
-                        is_active = bool(active)
-                    else:
-                        break
-                """ get data """
-                if info[3] == Database.INFORMATION_TEXT:
-                    value = self.query(("SELECT value "
-                                        "FROM Text "
-                                        "WHERE information_id = :i"),
-                                       {'i': info[0]})[0][0]
-                elif info[3] == Database.INFORMATION_BINARY:
-                    value = '[binary]'
-                elif info[3] == Database.INFORMATION_COMPOSITE:
-                    value = [row[0] for row in self.query((
-                        "SELECT part_id "
-                        "FROM Composite "
-                        "WHERE information_id = :i"), {'i': info[0]})]
-                else:
-                    value = 'ERROR'
-                infos.append(tuple(list(info)+[is_active, value]))
-            # get time entries
-            times = self.query(("SELECT Time.time_id, "
-                                #"       DATE_FORMAT(time, '%Y-%m-%d %H:%i:%s'),"
-                                "       time, accuracy, valid, modified, note "
-                                "FROM Time INNER JOIN AT "
-                                "     ON Time.time_id = AT.time_id "
-                                "WHERE AT.association_id = :a"),
-                               {'a': assoc[0]}) or []
-            # get location entries
-            locations = self.query(("SELECT L.location_id, name, "
-                                    "       lat, lon, accuracy, valid, "
-                                    "       modified, note "
-                                    "FROM Location L INNER JOIN AL "
-                                    "     ON L.location_id = AL.location_id "
-                                    "WHERE AL.association_id = :a"),
-                                   {'a': assoc[0]}) or []
-            # get associated associations
-            associations = self.query(("SELECT association_id, ring_id, level, "
-                                       "       accuracy, valid, modified, note "
-                                       "FROM Association "
-                                       "WHERE association_id IN"
-                                       "      (SELECT association_id_2 "
-                                       "       FROM AA "
-                                       "       WHERE association_id_1 = :a)"),
-                                      {'a': assoc[0]}) or []
-
-            result.append((assoc, infos, times, locations, associations))
-        return result
+        # get associations in current ring
+        # TODO is ring check needed for ITL entries?
+        associations = [assoc for assoc in self.query(query, query_args)
+                        if assoc[1] == ensa.current_ring]
+        if not associations:
+            return []
+        """
+        load all linked entries at once, constant number of queries
+        is used regardless of association count
+        """
+        association_ids = ','.join(str(assoc[0]) for assoc in associations)
+        # get info entries (+ subject)
+        scope = ("FROM AI INNER JOIN Information I "
+                 "     ON AI.information_id = I.information_id "
+                 "WHERE AI.association_id IN (" + association_ids + ") ")
+        infos_nodata = self.query(
+            ("SELECT AI.association_id, I.information_id, I.subject_id, "
+             "       S.codename, I.type, I.name, I.level, I.accuracy, "
+             "       I.valid, I.modified, I.note "
+             "FROM AI "
+             "     INNER JOIN Information I "
+             "         ON AI.information_id = I.information_id "
+             "     INNER JOIN Subject S "
+             "         ON S.subject_id = I.subject_id "
+             "WHERE AI.association_id IN (" + association_ids + ") "
+             "ORDER BY AI.association_id, I.information_id"))
+        values, parts = self.get_information_data(scope)
+        self.load_activity(list(set(info[1] for info in infos_nodata)), scope)
+        infos = {}
+        for info in infos_nodata:
+            """ get active/inactive """
+            is_active = self.is_active(info[1])
+            """ get data """
+            if info[4] == Database.INFORMATION_TEXT:
+                value = values.get(info[1])
+            elif info[4] == Database.INFORMATION_BINARY:
+                value = '[binary]'
+            elif info[4] == Database.INFORMATION_COMPOSITE:
+                value = parts.get(info[1], [])
+            else:
+                value = 'ERROR'
+            infos.setdefault(info[0], []).append(
+                tuple(list(info[1:])+[is_active, value]))
+        # get time entries
+        times = {}
+        for row in self.query(("SELECT AT.association_id, Time.time_id, "
+                               #"       DATE_FORMAT(time, '%Y-%m-%d %H:%i:%s'),"
+                               "       time, accuracy, valid, modified, note "
+                               "FROM Time INNER JOIN AT "
+                               "     ON Time.time_id = AT.time_id "
+                               "WHERE AT.association_id IN "
+                               "      (" + association_ids + ") "
+                               "ORDER BY AT.association_id, Time.time_id")):
+            times.setdefault(row[0], []).append(row[1:])
+        # get location entries
+        locations = {}
+        for row in self.query(("SELECT AL.association_id, L.location_id, "
+                               "       name, lat, lon, accuracy, valid, "
+                               "       modified, note "
+                               "FROM Location L INNER JOIN AL "
+                               "     ON L.location_id = AL.location_id "
+                               "WHERE AL.association_id IN "
+                               "      (" + association_ids + ") "
+                               "ORDER BY AL.association_id, L.location_id")):
+            locations.setdefault(row[0], []).append(row[1:])
+        # get associated associations
+        linked = {}
+        for row in self.query(("SELECT AA.association_id_1, "
+                               "       A.association_id, A.ring_id, A.level, "
+                               "       A.accuracy, A.valid, A.modified, "
+                               "       A.note "
+                               "FROM Association A INNER JOIN AA "
+                               "     ON A.association_id = AA.association_id_2 "
+                               "WHERE AA.association_id_1 IN "
+                               "      (" + association_ids + ") "
+                               "ORDER BY AA.association_id_1, "
+                               "         A.association_id")):
+            linked.setdefault(row[0], []).append(row[1:])
+
+        return [(assoc,
+                 infos.get(assoc[0], []),
+                 times.get(assoc[0], []),
+                 locations.get(assoc[0], []),
+                 linked.get(assoc[0], []))
+                for assoc in associations]
 
     def get_associations_by_ids(self, association_ids):
         if type(association_ids) == int:
@@ -1262,14 +1942,46 @@ class Database():
         query = ("SELECT DISTINCT association_id, ring_id, level, accuracy, "
                  "       valid, modified, note "
                  "FROM Association "
-                 "WHERE association_id IN("+association_ids+")")
+                 "WHERE association_id IN("+association_ids+") "
+                 "ORDER BY association_id")
         return self.get_associations_by_X(query)
 
+    def get_associations_by_ring(self):
+        query = ("SELECT association_id, ring_id, level, accuracy, "
+                 "       valid, modified, note "
+                 "FROM Association "
+                 "WHERE ring_id = :r "
+                 "ORDER BY association_id")
+        return self.get_associations_by_X(query, {'r': ensa.current_ring})
+
+    def get_relationship_rows(self):
+        """
+        Returns (association_id, level, accuracy, valid, note, codename)
+        for each codename linked to an association in the current ring,
+        ordered by association (see source/network.py).
+        """
+        if not self.ring_ok():
+            return []
+        return self.query(("SELECT A.association_id, A.level, A.accuracy, "
+                           "       A.valid, A.note, S.codename "
+                           "FROM Association A "
+                           "     INNER JOIN AI "
+                           "         ON A.association_id = AI.association_id "
+                           "     INNER JOIN Information I "
+                           "         ON AI.information_id = I.information_id "
+                           "     INNER JOIN Subject S "
+                           "         ON I.subject_id = S.subject_id "
+                           "WHERE A.ring_id = :r "
+                           "      AND I.name = 'codename' "
+                           "ORDER BY A.association_id"),
+                          {'r': ensa.current_ring})
+
     def get_associations_by_note(self, string):
         query = ("SELECT DISTINCT association_id, ring_id, level, accuracy, "
                  "       valid, modified, note "
                  "FROM Association "
-                 "WHERE note LIKE '%"+string+"%'")
+                 "WHERE note LIKE '%"+string+"%' "
+                 "ORDER BY association_id")
         return self.get_associations_by_X(query)
 
     def get_associations_by_location(self, location_ids):
@@ -1281,7 +1993,8 @@ class Database():
                  "       valid, modified, note "
                  "FROM Association A INNER JOIN AL "
                  "     ON A.association_id = AL.association_id "
-                 "WHERE location_id IN("+location_ids+")")
+                 "WHERE location_id IN("+location_ids+") "
+                 "ORDER BY A.association_id")
         return self.get_associations_by_X(query)
 
     def get_associations_by_time(self, time_ids):
@@ -1293,7 +2006,8 @@ class Database():
                  "       valid, modified, note "
                  "FROM Association A INNER JOIN AT "
                  "     ON A.association_id = AT.association_id "
-                 "WHERE time_id IN("+time_ids+")")
+                 "WHERE time_id IN("+time_ids+") "
+                 "ORDER BY A.association_id")
         return self.get_associations_by_X(query)
 
     def get_associations_by_information(self, information_ids):
@@ -1305,7 +2019,8 @@ class Database():
                  "       valid, modified, note "
                  "FROM Association A INNER JOIN AI "
                  "     ON A.association_id = AI.association_id "
-                 "WHERE information_id IN("+information_ids+")")
+                 "WHERE information_id IN("+information_ids+") "
+                 "ORDER BY A.association_id")
         return self.get_associations_by_X(query)
 
     def get_associations_by_subject(self, codenames):
@@ -1320,7 +2035,8 @@ class Database():
                  "         ON AI.information_id = I.information_id "
                  "     INNER JOIN Subject S "
                  "         ON I.subject_id = S.subject_id "
-                 "WHERE S.codename IN('"+codenames+"')")
+                 "WHERE S.codename IN('"+codenames+"') "
+                 "ORDER BY A.association_id")
         return self.get_associations_by_X(query)
 
     def get_timeline_by_location(self, location_ids):
@@ -1399,6 +2115,7 @@ class Database():
                     "      AND ring_id = :r"),
                    {'r': ensa.current_ring})
 
+    @transactional
     def dissociate_associations(self, association_id, association_ids):
         if type(association_ids) == int:
             association_ids = str(association_ids)
@@ -1423,6 +2140,7 @@ class Database():
                     'a': association_id,
                     'r': ensa.current_ring})
 
+    @transactional
     def dissociate_informations(self, association_id, information_ids):
         if type(information_ids) == int:
             information_ids = str(information_ids)
@@ -1447,6 +2165,7 @@ class Database():
                     'a': association_id,
                     'r': ensa.current_ring})
 
+    @transactional
     def dissociate_locations(self, association_id, location_ids):
         if type(location_ids) == int:
             location_ids = str(location_ids)
@@ -1471,6 +2190,7 @@ class Database():
                     'a': association_id,
                     'r': ensa.current_ring})
 
+    @transactional
     def dissociate_times(self, association_id, time_ids):
         if type(time_ids) == int:
             time_ids = str(time_ids)
@@ -1582,44 +2302,149 @@ class Database():
 ###########################################
 # Keyword methods
 ###########################################
+    def load_keywords(self):
+        """
+        Caches keyword <-> ID mapping, so tagging does not look
+        keywords up in the database.
+        """
+        if self.keyword_ids is None:
+            self.keyword_ids = {}
+            self.keyword_names = {}
+            for keyword_id, keyword in self.query(
+                    "SELECT keyword_id, keyword FROM Keyword"):
+                self.keyword_ids[keyword] = keyword_id
+                self.keyword_names[keyword_id] = keyword
+        return self.keyword_ids
+
+    def forget_keywords(self):
+        """
+        Drops cached keywords and keyword index, must be called
+        whenever keywords are deleted outside of add_keywords() and
+        cleanup.
+        """
+        self.keyword_ids = None
+        self.keyword_names = None
+        self.keyword_index = None
+
+    def get_keyword_index(self):
+        """
+        Returns keyword index of the current ring, it is built
+        on demand (keyword bitmaps are loaded on first use).
+        """
+        if not self.ring_ok():
+            return None
+        if (self.keyword_index is None
+                or self.keyword_index.ring_id != ensa.current_ring):
+            self.keyword_index = KeywordIndex(
+                ensa.current_ring,
+                self.query(("SELECT I.information_id, I.subject_id "
+                            "FROM Information I INNER JOIN Subject S "
+                            "     ON I.subject_id = S.subject_id "
+                            "WHERE S.ring_id = :r "
+                            "ORDER BY I.information_id"),
+                           {'r': ensa.current_ring}))
+        return self.keyword_index
+
+    def get_keyword_information_ids(self, ring_id, keyword):
+        keyword_id = self.load_keywords().get(keyword)
+        if keyword_id is None:
+            return []
+        return [row[0] for row in self.query(
+            ("SELECT IK.information_id "
+             "FROM IK INNER JOIN Information I "
+             "     ON IK.information_id = I.information_id "
+             "    INNER JOIN Subject S "
+             "     ON I.subject_id = S.subject_id "
+             "WHERE IK.keyword_id = :k AND S.ring_id = :r"),
+            {'k': keyword_id, 'r': ring_id})]
+
+    def get_keyword_ids(self, keywords):
+        """
+        Returns IDs of given keywords, missing ones are created.
+        """
+        cached = self.load_keywords()
+        missing = sorted(set(k for k in keywords if k not in cached))
+        if missing:
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                self.query_many(("INSERT OR IGNORE INTO Keyword(keyword) "
+                                 "VALUES(?)"),
+                                [(k,) for k in chunk])
+                for keyword_id, keyword in self.query(
+                        ("SELECT keyword_id, keyword "
+                         "FROM Keyword "
+                         "WHERE keyword IN (%s)"
+                         % ','.join('?' * len(chunk))), chunk):
+                    self.keyword_ids[keyword] = keyword_id
+                    self.keyword_names[keyword_id] = keyword
+        return [self.keyword_ids[k] for k in keywords]
+
     def get_keyword_id(self, keyword):
+        return self.get_keyword_ids([keyword])[0]
+
+    @transactional
+    def add_keywords(self, information_ids, keywords):
+        """
+        Tags all given informations of the current subject with all
+        given keywords, one statement per 500 informations. Existing
+        tags are kept.
+        Returns number of new tags, database error is raised so the
+        transaction is rolled back. Keywords that end up tagging
+        nothing are deleted when the transaction ends.
+        """
+        if not self.subject_ok():
+            return 0
         try:
-            keyword_id = self.query(("SELECT keyword_id "
-                                     "FROM Keyword "
-                                     "WHERE keyword = :k"),
-                                    {'k': keyword})[0][0]
-        except:
-            self.query(("INSERT INTO Keyword(keyword) "
-                        "VALUES(:k)"), {'k': keyword})
-            keyword_id = self.query(("SELECT keyword_id "
-                                     "FROM Keyword "
-                                     "ORDER BY keyword_id DESC LIMIT 1"))[0][0]
-        return keyword_id
+            information_ids = [int(i) for i
+                               in self.split_targets(information_ids)]
+        except (TypeError, ValueError):
+            log.err('Invalid information ID.')
+            return 0
+        keyword_ids = sorted(set(self.get_keyword_ids(keywords)))
+        if not information_ids or not keyword_ids:
+            return 0
+        count = 0
+        try:
+            for i in range(0, len(information_ids), 500):
+                chunk = information_ids[i:i + 500]
+                statement = ("INSERT OR IGNORE INTO IK(information_id, "
+                             "                         keyword_id) "
+                             "SELECT information_id, ? "
+                             "FROM Information "
+                             "WHERE subject_id = ? "
+                             "      AND information_id IN (%s)"
+                             % ','.join('?' * len(chunk)))
+                log.debug_query(statement)
+                self.cur.executemany(
+                    statement, [[keyword_id, ensa.current_subject] + chunk
+                                for keyword_id in keyword_ids])
+                count += self.cur.rowcount
+        except sqlite.Error as e:
+            """index may not match anymore, whole transaction is rolled back"""
+            log.err('Cannot add keywords: %s.' % e)
+            self.keyword_index = None
+            raise
+        """created keywords may not be used (e.g. invalid IDs)"""
+        self.schedule_cleanup(keyword_ids=keyword_ids)
+        if (self.keyword_index
+                and self.keyword_index.ring_id == ensa.current_ring):
+            self.keyword_index.tag(information_ids, keywords,
+                                   ensa.current_subject)
+        return count
 
     def add_keyword(self, information_ids, keyword):
-        if not self.subject_ok():
-            return
-        if type(information_ids) == int:
-            information_ids = str(information_ids)
-        elif type(information_ids) in (filter, tuple, list):
-            information_ids = ','.join(str(x) for x in information_ids)
-        keyword_id = self.get_keyword_id(keyword)
-        self.query(("INSERT INTO IK(information_id, keyword_id) "
-                    "SELECT information_id, :k "
-                    "FROM Information "
-                    "WHERE subject_id = :s "
-                    "      AND information_id IN ("+information_ids+")"),
-                   {'k': keyword_id,
-                    's': ensa.current_subject})
+        return self.add_keywords(information_ids, [keyword])
 
+    @transactional
     def delete_keywords(self, information_ids, keywords):
         if not self.subject_ok():
             return
         if keywords:
-            keyword_ids = ','.join([str(x[0]) for x in self.query(
+            deleted_ids = [x[0] for x in self.query(
                 "SELECT keyword_id "
                 "FROM Keyword "
-                "WHERE keyword IN ("+keywords+")")])
+                "WHERE keyword IN ("+keywords+")")]
+            keyword_ids = ','.join(str(x) for x in deleted_ids)
             self.query(("DELETE FROM IK "
                         "WHERE keyword_id IN ("+keyword_ids+") "
                         "      AND information_id IN "
@@ -1630,6 +2455,10 @@ class Database():
                         "                 AND subject_id = :s)"),
                        {'s': ensa.current_subject})
         else:  # delete all keywords
+            deleted_ids = [x[0] for x in self.query(
+                "SELECT DISTINCT keyword_id "
+                "FROM IK "
+                "WHERE information_id IN ("+information_ids+")")]
             self.query(("DELETE FROM IK "
                         "WHERE information_id IN "
                         "      (SELECT information_id "
@@ -1637,7 +2466,15 @@ class Database():
                         "       WHERE information_id IN("+information_ids+")"
                         "       AND subject_id = :s)"),
                        {'s': ensa.current_subject})
-        self.information_cleanup('keywords')
+        if (self.keyword_index
+                and self.keyword_index.ring_id == ensa.current_ring):
+            self.load_keywords()
+            self.keyword_index.untag(
+                [int(i) for i in self.split_targets(information_ids)],
+                [self.keyword_names[k] for k in deleted_ids
+                 if k in self.keyword_names] if keywords else None,
+                ensa.current_subject)
+        self.schedule_cleanup(keyword_ids=deleted_ids)
 
     def get_keywords(self):
         if not self.ring_ok():
@@ -1667,7 +2504,7 @@ class Database():
         return result
 
     def get_keywords_for_informations(self, information_ids, force_no_current_subject=False):
-        if not self.subject_ok():
+        if not force_no_current_subject and not self.subject_ok():
             return []
         if type(information_ids) == int:
             information_ids = str(information_ids)
@@ -1696,155 +2533,131 @@ class Database():
         return result
 
     def get_informations_for_keywords_or(self, keywords):
-        if not self.ring_ok():
+        expression = ('keyword', keywords[0])
+        for keyword in keywords[1:]:
+            expression = ('or', expression, ('keyword', keyword))
+        return self.get_informations_for_keyword_expression(expression)
+
+    def get_informations_for_keywords_and(self, keywords):
+        expression = ('keyword', keywords[0])
+        for keyword in keywords[1:]:
+            expression = ('and', expression, ('keyword', keyword))
+        return self.get_informations_for_keyword_expression(expression)
+
+    def get_informations_for_keyword_expression(self, expression):
+        """
+        Returns information entries of current subject (or ring)
+        matching keyword expression, e.g. 'image and not (secret or
+        draft)'. Parsed expression (see keywords.parse_expression())
+        can be given as well. Keyword bitmaps of the ring are used,
+        so only matching entries are loaded from the database.
+        """
+        index = self.get_keyword_index()
+        if index is None:
             return []
-        if ensa.current_subject:
-            infos_nodata = self.query(("SELECT I.information_id, I.subject_id, "
-                                       "       S.codename, I.type, I.name, "
-                                       "       I.level, I.accuracy, I.valid, "
-                                       "       I.modified, I.note "
-                                       "FROM Information I INNER JOIN Subject S"
-                                       "     ON I.subject_id = S.subject_id "
-                                       "WHERE I.subject_id = :s "
-                                       "      AND I.information_id IN "
-                                       "      (SELECT IK.information_id "
-                                       "       FROM IK INNER JOIN Keyword K "
-                                       "        ON IK.keyword_id = K.keyword_id"
-                                       "       WHERE K.keyword IN "
-                                       "           ("+keywords+"))"),
-                                      {'s': ensa.current_subject})
-        else:
-            infos_nodata = self.query(("SELECT I.information_id, I.subject_id, "
-                                       "       S.codename, I.type, I.name, "
-                                       "       I.level, I.accuracy, I.valid, "
-                                       "       I.modified, I.note "
-                                       "FROM Information I INNER JOIN Subject S"
-                                       "     ON I.subject_id = S.subject_id "
-                                       "WHERE S.ring_id = :r "
-                                       "      AND I.information_id IN "
-                                       "      (SELECT IK.information_id "
-                                       "       FROM IK INNER JOIN Keyword K "
-                                       "        ON IK.keyword_id = K.keyword_id"
-                                       "        WHERE K.keyword IN "
-                                       "            ("+keywords+"))"),
-                                      {'r': ensa.current_ring})
+        if type(expression) == str:
+            try:
+                expression = parse_expression(expression)
+            except ValueError as e:
+                log.err('Invalid keyword expression: %s.' % e)
+                return []
+        information_ids = index.search(expression, ensa.current_subject)
         infos = []
-        for info in infos_nodata:
-            """ get active/inactive """
-            active_times = self.query(("SELECT T.time, A.active "
-                                       "FROM Time T INNER JOIN Active A"
-                                       "     ON T.time_id = A.time_id "
-                                       "WHERE A.information_id = :i "
-                                       "ORDER BY T.time"),
-                                      {'i': info[0]})
-            is_active = False
-            for time, active in active_times:
-                if lib.datetime_from_str(time) <= ensa.variables['reference_time']:
-                    is_active = bool(active)
-                else:
-                    break
-            """ get data """
-            if info[3] in [Database.INFORMATION_ALL,
-                           Database.INFORMATION_TEXT]:
-                value = self.query(("SELECT value "
-                                    "FROM Text "
-                                    "WHERE information_id = :i"),
-                                   {'i': info[0]})[0][0]
-                '''
-                elif info[3] in [Database.INFORMATION_ALL, 
-                                 Database.INFORMATION_BINARY]:
-                    value = '[binary]'
-                '''
-            elif info[3] in [Database.INFORMATION_ALL,
-                             Database.INFORMATION_COMPOSITE]:
-                value = [row[0] for row in self.query((
-                    "SELECT part_id "
-                    "FROM Composite "
-                    "WHERE information_id = :i"), {'i': info[0]})]
-            else:
-                value = 'ERROR'
-            infos.append(tuple(list(info)+[value]))
+        for i in range(0, len(information_ids), 10000):
+            infos += self.get_informations_for_keywords(
+                ("      AND I.information_id IN (%s) "
+                 % ','.join(str(x) for x in information_ids[i:i + 10000])),
+                {})
         return infos
 
-    def get_informations_for_keywords_and(self, keywords):
-        if not self.ring_ok():
-            return []
+    def get_informations_for_keywords(self, condition, args):
+        """
+        Returns information entries of current subject (or ring)
+        matching keyword `condition`.
+        """
         if ensa.current_subject:
-            infos_nodata = self.query(
-                ("SELECT I.information_id, I.subject_id, S.codename, "
-                 "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                 "       I.modified, I.note "
-                 "FROM Information I INNER JOIN Subject S "
-                 "     ON I.subject_id = S.subject_id "
-                 "WHERE I.subject_id = :s "
-                 "      AND I.information_id IN"
-                 "      (SELECT information_id "
-                 "       FROM IK "
-                 "       WHERE keyword_id IN"
-                 "           (SELECT keyword_id "
-                 "            FROM Keyword "
-                 "            WHERE keyword IN ("+keywords+")) "
-                 "       GROUP BY information_id "
-                 "       HAVING COUNT(keyword_id) = :c)"),
-                {'s': ensa.current_subject,
-                 'c': keywords.count(',')+1})
+            condition = "WHERE I.subject_id = :s " + condition
+            args['s'] = ensa.current_subject
         else:
-            infos_nodata = self.query(
-                ("SELECT I.information_id, I.subject_id, S.codename, "
-                 "       I.type, I.name, I.level, I.accuracy, I.valid, "
-                 "       I.modified, I.note "
-                 "FROM Information I INNER JOIN Subject S "
-                 "     ON I.subject_id = S.subject_id "
-                 "WHERE S.ring_id = :r "
-                 "      AND I.information_id IN"
-                 "      (SELECT information_id "
-                 "       FROM IK "
-                 "       WHERE keyword_id IN"
-                 "          (SELECT keyword_id "
-                 "           FROM Keyword "
-                 "           WHERE keyword IN ("+keywords+")) "
-                 "       GROUP BY information_id "
-                 "       HAVING COUNT(keyword_id) = :c)"),
-                {'r': ensa.current_ring,
-                 'c': keywords.count(',')+1})
+            condition = "WHERE S.ring_id = :r " + condition
+            args['r'] = ensa.current_ring
+        scope = ("FROM Information I INNER JOIN Subject S "
+                 "     ON I.subject_id = S.subject_id " + condition)
+        infos_nodata = self.query(("SELECT I.information_id, I.subject_id, "
+                                   "       S.codename, I.type, I.name, "
+                                   "       I.level, I.accuracy, I.valid, "
+                                   "       I.modified, I.note " + scope),
+                                  args)
+        if not infos_nodata:
+            return []
+        return self.complete_informations(infos_nodata, scope, args)
 
-        infos = []
-        for info in infos_nodata:
-            """ get active/inactive """
-            active_times = self.query(("SELECT T.time, A.active "
-                                       "FROM Time T INNER JOIN Active A"
-                                       "     ON T.time_id = A.time_id "
-                                       "WHERE A.information_id = :i "
-                                       "ORDER BY T.time"),
-                                      {'i': info[0]})
-            is_active = False
-            for time, active in active_times:
-                if lib.datetime_from_str(time) <= ensa.variables['reference_time']:
-                    is_active = bool(active)
-                else:
-                    break
-            """ get data """
-            if info[3] in [Database.INFORMATION_ALL,
-                           Database.INFORMATION_TEXT]:
-                value = self.query(("SELECT value "
-                                    "FROM Text "
-                                    "WHERE information_id = :i"),
-                                   {'i': info[0]})[0][0]
-                '''
-                elif info[3] in [Database.INFORMATION_ALL, 
-                                 Database.INFORMATION_BINARY]:
-                    value = '[binary]'
-                '''
-            elif info[3] in [Database.INFORMATION_ALL,
-                             Database.INFORMATION_COMPOSITE]:
-                value = [row[0] for row in self.query((
-                    "SELECT part_id "
-                    "FROM Composite "
-                    "WHERE information_id = :i"), {'i': info[0]})]
-            else:
-                value = 'ERROR'
-            infos.append(tuple(list(info)+[value]))
-        return infos
+###########################################
+# Search methods
+###########################################
+
+    def search(self, text, limit=50, highlight=('[', ']')):
+        """
+        Full-text search (FTS5 query syntax) in the current ring.
+        Returns (entity, field, entity_id, label, snippet) tuples,
+        the most relevant first. Label names the hit (subject codename,
+        association ID, location name...) and the matched field.
+        """
+        if not self.ring_ok():
+            return []
+        if not self.search_available:
+            log.err('Full-text search is not available, '
+                    'SQLite is built without FTS5.')
+            return []
+        command = ("SELECT rowid, snippet(Search, 0, ?, ?, '...', 12) "
+                   "FROM Search "
+                   "WHERE Search MATCH ? AND ring_id = ? "
+                   "ORDER BY rank "
+                   "LIMIT ?")
+        log.debug_query(command)
+        try:
+            hits = self.cur.execute(command, (highlight[0], highlight[1],
+                                              text, ensa.current_ring,
+                                              limit)).fetchall()
+        except sqlite.OperationalError as e:
+            log.err('Invalid search query: %s.' % e)
+            return []
+        """ describe hits by a constant number of queries """
+        ids = {}
+        for rowid, _ in hits:
+            ids.setdefault(Database.SEARCH_FIELDS[rowid % 8][0],
+                           set()).add(rowid // 8)
+        labels = {'association': {association_id: '#A%d' % association_id
+                                  for association_id
+                                  in ids.get('association', ())}}
+        for entity, command in (
+                ('subject', ("SELECT subject_id, '<' || codename || '>' "
+                             "FROM Subject "
+                             "WHERE subject_id IN (%s)")),
+                ('information', ("SELECT I.information_id, "
+                                 "       '<' || S.codename || '> ' || I.name "
+                                 "FROM Information I INNER JOIN Subject S "
+                                 "     ON I.subject_id = S.subject_id "
+                                 "WHERE I.information_id IN (%s)")),
+                ('time', "SELECT time_id, time FROM Time "
+                         "WHERE time_id IN (%s)"),
+                ('location', "SELECT location_id, name FROM Location "
+                             "WHERE location_id IN (%s)")):
+            if entity in ids:
+                labels[entity] = dict(self.query(
+                    command % ','.join('?' * len(ids[entity])),
+                    sorted(ids[entity])))
+        result = []
+        for rowid, snippet in hits:
+            entity, field = Database.SEARCH_FIELDS[rowid % 8]
+            entity_id = rowid // 8
+            """label is what was hit and in which field"""
+            label = labels.get(entity, {}).get(entity_id)
+            label = ('%s (%s)' % (label, field) if label is not None
+                     else '(%s)' % field)
+            result.append((entity, field, entity_id, label,
+                           ' '.join(snippet.split())))
+        return result
 
 
 # # #
@@ -72,6 +72,41 @@ config['interaction.max_accuracy'] = Option(10, int)
 # maximum level # TODO needed? # TODO check when modified
 config['interaction.max_level'] = Option(10, int)
 
+""" Caches """
+# number of parsed datetime strings to remember (0 disables the cache)
+config['cache.datetime'] = Option(4096, int)
+
+""" Maps """
+config['map.provider'] = Option('osm', str)  # geotiler tile provider
+config['map.url'] = Option('', str)  # custom tile URL (e.g. local tile server)
+config['map.cache'] = Option('files/tiles', str)  # tile cache directory ('' disables)
+# local tiles: directory with <zoom>/<x>/<y>.<ext> files or .mbtiles file
+config['map.source'] = Option('', str)
+config['map.offline'] = Option(False, bool)  # never download tiles
+# rendered map images cache directory ('' disables) and its size limit in MB
+config['map.image_cache'] = Option('files/maps', str)
+config['map.image_cache_size'] = Option(64, int)
+
+""" Graphs """
+# rendered relationship graphs cache directory ('' disables) and its size limit in MB
+config['graph.image_cache'] = Option('files/graphs', str)
+config['graph.image_cache_size'] = Option(64, int)
+
+""" Search """
+# maximum number of `find` results
+config['search.limit'] = Option(50, int)
+
+""" Reports """
+# number of processes rendering batch reports (0 means CPU count)
+config['report.workers'] = Option(0, int)
+# resolution of report images (0 embeds original images)
+config['report.image_dpi'] = Option(150, int)
+# downscaled report images cache directory ('' disables) and its size limit in MB
+config['report.thumbnail_cache'] = Option('files/thumbnails', str)
+config['report.thumbnail_cache_size'] = Option(256, int)
+# memory one report may take in MB, further images are left out (0 means no limit)
+config['report.memory_limit'] = Option(256, int)
+
 """
 Dictionary of all available commands (filled in source/commands.py)
 """
@@ -97,3 +132,8 @@ db = None
 Command history
 """
 history = []
+
+"""
+Iterator of wizard answers (used by `ensa.py --import`), stdin if None
+"""
+input_source = None
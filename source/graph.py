@@ -3,12 +3,18 @@
 This script generates graphs for relationship visualization.
 """
 import os
+import time
+import shutil
+import hashlib
 import graphviz as gv
 # import networkx as nx
 # import matplotlib.pyplot as plt
 # from collections import OrderedDict
 import tempfile
 from io import BytesIO
+from source import log
+from source import ensa
+from source.lib import read_cache_file, write_cache_file, evict_cache_files
 
 
 def get_relationship_color(relationship):
@@ -57,6 +63,47 @@ opposites = {
 }
 
 
+"""
+Directories left by former get_relationship_graph() versions are
+<tmp>/tmpXXXXXXXX/network[.png]; only old ones are removed (a fresh
+one may belong to a graph being rendered right now).
+"""
+STALE_DIRECTORY_PREFIX = 'tmp'
+STALE_DIRECTORY_FILES = {'network', 'network.png'}
+STALE_DIRECTORY_AGE = 24 * 3600  # seconds
+stale_directories_removed = False
+
+
+def remove_stale_directories():
+    """
+    Removes graph directories of this user from the system temp
+    directory, once per run. Anything else there is left alone.
+    """
+    global stale_directories_removed
+    if stale_directories_removed:
+        return
+    stale_directories_removed = True
+    threshold = time.time() - STALE_DIRECTORY_AGE
+    try:
+        entries = list(os.scandir(tempfile.gettempdir()))
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.name.startswith(STALE_DIRECTORY_PREFIX):
+            continue
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_uid != os.getuid() or stat.st_mtime > threshold:
+                continue
+            names = set(os.listdir(entry.path))
+        except OSError:
+            continue
+        if names and names <= STALE_DIRECTORY_FILES:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
 def get_relationship_graph(codename, acquaintances, relationships):
     """
     codename:      main codename we are interested in
@@ -64,19 +111,22 @@ def get_relationship_graph(codename, acquaintances, relationships):
     relationships: list of
                     ((codename:str, codename:str):
                      (relationship:str, level:int, accuracy:int, valid:bool))
+
+    Returns PNG of the network as BytesIO. Nodes and edges are added
+    in canonical order, so the DOT source identifies the network; its
+    hash addresses the image in graph.image_cache and graphviz is not
+    run again for an unchanged network.
     """
-    path = os.path.join(tempfile.mkdtemp(), 'network')
-    g = gv.Graph(filename=path, format='png',
-                 engine='circo')
-    g = gv.Graph(filename=path, format='png',
-                 engine='sfdp')
+    remove_stale_directories()
+    g = gv.Graph(format='png', engine='sfdp')
     # g.node(codename)
     node_fontsize = '10'
     edge_fontsize = '8'
     g.node(codename, fontsize=node_fontsize, fontname='Helvetica')
-    for node in acquaintances:
+    for node in sorted(acquaintances):
         g.node(node, fontsize=node_fontsize, fontname='Helvetica')
-    for (a, b), (relationship, level, accuracy, valid) in relationships:
+    for (a, b), (relationship, level, accuracy, valid) in sorted(
+            relationships, key=repr):
         """swap relationship if necessary"""
         if codename == a:
             relationship = opposites.get(relationship) or relationship
@@ -90,10 +140,20 @@ def get_relationship_graph(codename, acquaintances, relationships):
                fontname='Helvetica',
                style='solid' if valid else 'dotted')
     # g.view()
-    g.render()
-    with open(path + '.png', 'rb') as f:
-        network_str = BytesIO(f.read())
-    return network_str
+    directory = ensa.config['graph.image_cache'].value
+    path = None
+    if directory:
+        path = os.path.join(directory, '%s.png'
+                            % hashlib.sha256(g.source.encode()).hexdigest())
+        data = read_cache_file(path)
+        if data is not None:
+            return BytesIO(data)
+    data = g.pipe()
+    if path:
+        write_cache_file(path, data)
+        evict_cache_files(directory,
+                          ensa.config['graph.image_cache_size'].value)
+    return BytesIO(data)
 
 
 '''
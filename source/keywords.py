@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+"""
+This module answers keyword queries of a ring from memory.
+
+Every information of the ring has a position (informations sorted by
+ID, new ones are appended). A keyword is a bitmap of positions kept in
+a Python int, so AND/OR/NOT of keywords are single big-integer
+operations and a bitmap never takes more than (informations / 8) bytes.
+Bitmaps are loaded from the database on first use and then maintained
+by Database.add_keywords() and Database.delete_keywords().
+"""
+from array import array
+from bisect import bisect_left
+import re
+from source import ensa
+
+
+def bitmap_from_positions(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def positions_from_bitmap(bitmap):
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        if not byte:
+            continue
+        for j in range(8):
+            if byte >> j & 1:
+                yield (i << 3) | j
+
+
+def parse_expression(text):
+    """
+    Parses keyword expression, e.g. 'image and not (secret or draft)'.
+
+    NOT binds tighter than AND, AND tighter than OR. Operators can be
+    written as 'and'/'&', 'or'/'|', 'not'/'!'; keywords next to each
+    other are joined by AND.
+
+    Returns nested tuples: ('keyword', k), ('not', x), ('and', x, y),
+    ('or', x, y). Raises ValueError for invalid expressions.
+    """
+    operators = {'and': '&', '&': '&', 'or': '|', '|': '|',
+                 'not': '!', '!': '!', '(': '(', ')': ')'}
+    tokens = [(operators.get(token.lower()), token)
+              for token in re.findall(r'[()&|!]|[^\s()&|!]+', text)]
+    position = 0
+
+    def peek():
+        return tokens[position][0] if position < len(tokens) else None
+
+    def parse_or():
+        nonlocal position
+        result = parse_and()
+        while peek() == '|':
+            position += 1
+            result = ('or', result, parse_and())
+        return result
+
+    def parse_and():
+        nonlocal position
+        result = parse_not()
+        while position < len(tokens) and peek() in ('&', '!', '(', None):
+            if peek() == '&':
+                position += 1
+            result = ('and', result, parse_not())
+        return result
+
+    def parse_not():
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError('Unexpected end of expression')
+        operator, token = tokens[position]
+        position += 1
+        if operator == '!':
+            return ('not', parse_not())
+        if operator == '(':
+            result = parse_or()
+            if peek() != ')':
+                raise ValueError('Missing \')\'')
+            position += 1
+            return result
+        if operator is not None:
+            raise ValueError('Unexpected \'%s\'' % token)
+        return ('keyword', token)
+
+    result = parse_or()
+    if position < len(tokens):
+        raise ValueError('Unexpected \'%s\'' % tokens[position][1])
+    return result
+
+
+class KeywordIndex():
+    """
+    Keyword bitmaps of a ring.
+
+    information_ids: sorted IDs; index is the position
+    subject_ids:     owner of the information at the same position
+    keywords:        keyword -> bitmap (loaded keywords only)
+    subjects:        subject ID -> bitmap (used subjects only)
+    """
+
+    def __init__(self, ring_id, rows):
+        """
+        rows: (information_id, subject_id) of all informations in
+              the ring, sorted by information_id
+        """
+        self.ring_id = ring_id
+        self.information_ids = array('q')
+        self.subject_ids = array('q')
+        for information_id, subject_id in rows:
+            self.information_ids.append(information_id)
+            self.subject_ids.append(subject_id)
+        self.all = (1 << len(self.information_ids)) - 1
+        self.keywords = {}
+        self.subjects = {}
+
+    def position(self, information_id):
+        position = bisect_left(self.information_ids, information_id)
+        if (position < len(self.information_ids)
+                and self.information_ids[position] == information_id):
+            return position
+        return None
+
+    def mask(self, information_ids, subject_id=None):
+        """
+        Returns bitmap of given informations (of given subject only).
+        """
+        positions = []
+        for information_id in information_ids:
+            position = self.position(information_id)
+            if position is None:
+                continue
+            if (subject_id is not None
+                    and self.subject_ids[position] != subject_id):
+                continue
+            positions.append(position)
+        return bitmap_from_positions(positions, len(self.information_ids))
+
+    def keyword(self, keyword):
+        if keyword not in self.keywords:
+            self.keywords[keyword] = self.mask(
+                ensa.db.get_keyword_information_ids(self.ring_id, keyword))
+        return self.keywords[keyword]
+
+    def subject(self, subject_id):
+        if subject_id not in self.subjects:
+            self.subjects[subject_id] = bitmap_from_positions(
+                (position for position, owner in enumerate(self.subject_ids)
+                 if owner == subject_id), len(self.information_ids))
+        return self.subjects[subject_id]
+
+    def add_information(self, information_id, subject_id):
+        """
+        Registers new information. Returns False if it cannot be done
+        (ID lower than known ones) and the index must be rebuilt.
+        """
+        position = self.position(information_id)
+        if position is None:
+            if (self.information_ids
+                    and information_id < self.information_ids[-1]):
+                return False
+            position = len(self.information_ids)
+            self.information_ids.append(information_id)
+            self.subject_ids.append(subject_id)
+            self.all |= 1 << position
+        else:
+            """ID of a deleted information is reused, forget its tags"""
+            bit = ~(1 << position)
+            for keyword in self.keywords:
+                self.keywords[keyword] &= bit
+            for owner in self.subjects:
+                self.subjects[owner] &= bit
+            self.subject_ids[position] = subject_id
+        if subject_id in self.subjects:
+            self.subjects[subject_id] |= 1 << position
+        return True
+
+    def tag(self, information_ids, keywords, subject_id):
+        loaded = [keyword for keyword in keywords if keyword in self.keywords]
+        if not loaded:
+            return
+        mask = self.mask(information_ids, subject_id)
+        for keyword in loaded:
+            self.keywords[keyword] |= mask
+
+    def untag(self, information_ids, keywords, subject_id):
+        """
+        Removes keywords (all if None) from given informations.
+        """
+        if keywords is None:
+            keywords = list(self.keywords)
+        loaded = [keyword for keyword in keywords if keyword in self.keywords]
+        if not loaded:
+            return
+        mask = ~self.mask(information_ids, subject_id)
+        for keyword in loaded:
+            self.keywords[keyword] &= mask
+
+    def evaluate(self, expression):
+        """
+        Returns bitmap matching parsed keyword expression.
+        """
+        operator = expression[0]
+        if operator == 'keyword':
+            return self.keyword(expression[1])
+        if operator == 'not':
+            return self.all & ~self.evaluate(expression[1])
+        if operator == 'and':
+            return self.evaluate(expression[1]) & self.evaluate(expression[2])
+        if operator == 'or':
+            return self.evaluate(expression[1]) | self.evaluate(expression[2])
+        raise ValueError('Unknown operator \'%s\'' % operator)
+
+    def search(self, expression, subject_id=None):
+        """
+        Returns sorted IDs of informations matching parsed keyword
+        expression, only informations of the subject if given.
+        """
+        bitmap = self.evaluate(expression)
+        if subject_id is not None:
+            bitmap &= self.subject(subject_id)
+        return [self.information_ids[position]
+                for position in positions_from_bitmap(bitmap)]
@@ -3,14 +3,21 @@
 General-purpose stuff is defined here.
 """
 import os
+import re
 import sys
 import signal
 import io
 import time
 import pdb
+import tempfile
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 #from source import db
 from source import log
 from datetime import datetime
+from collections import OrderedDict
 import traceback
 '''
 mypdb = pdb.Pdb(stdin=open('/tmp/fifo_stdin', 'r'),
@@ -123,44 +130,183 @@ def get_prompt_key():
     else:
         return '  ) '
 
+"""
+Formats accepted by datetime_from_str(). A string can match at most
+one of them, so the order they are tried in does not affect the result.
+"""
+datetime_formats = [
+    ('dt', '%Y-%m-%d %H:%M:%S.%f'),
+    ('dt', '%Y-%m-%d %H:%M:%S'),
+    ('dt', '%Y-%m-%d %H:%M'),
+    ('d',  '%Y-%m-%d'),
+    ('d',  '%Y'),
+    ('t',  '%H:%M:%S'),
+    ('t',  '%H:%M'),
+]
+""" try order for each last successful format """
+datetime_format_orders = [
+    [i] + [j for j in range(len(datetime_formats)) if j != i]
+    for i in range(len(datetime_formats))]
+""" canonical DB formats, parsed by datetime.fromisoformat() """
+datetime_iso = re.compile(
+    r'\d{4}-\d{2}-\d{2}( \d{2}:\d{2}(:\d{2}(\.\d{6})?)?)?$')
+""" last successful format index for each call site """
+datetime_format_memo = {}
+""" LRU cache of parsed strings, see `cache.datetime` option """
+datetime_cache = OrderedDict()
+
+
+"""
+Caches of rendered images (maps, graphs) - files addressed by content hash
+"""
+def read_cache_file(path):
+    """
+    Returns content of the cached file (or None) and marks it
+    as recently used.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except OSError:
+        return None
+
+
+def write_cache_file(path, data):
+    """
+    Writes the file through a temporary file, so concurrent
+    renderers never read a partial one.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.err('Cannot write cache file %s: %s' % (path, e))
+
+
+def evict_cache_files(directory, size):
+    """
+    Removes least recently used files until the directory
+    fits into size (MB).
+    """
+    limit = size * 1024 * 1024
+    try:
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                   for e in os.scandir(directory) if e.is_file()]
+    except OSError:
+        return
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def get_rss():
+    """
+    Returns current resident set size of this process in MB.
+    Without /proc (e.g. macOS), peak resident set size (ru_maxrss)
+    is returned instead; it never decreases, so memory freed since
+    is still counted. ru_maxrss is in bytes on macOS and in KB
+    elsewhere. 0 is returned if neither is available.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def datetime_format_allowed(format_type, only_date, only_time):
+    if format_type == 'dt':
+        return not only_date and not only_time
+    if format_type == 'd':
+        return not only_time
+    return not only_date
+
+
+def parse_datetime(string, only_date, only_time, site=None):
+    """
+    Returns (type, datetime) for the format matching `string`,
+    (None, None) if there is no such format. Time-only results
+    are not completed with reference date.
+    """
+    if type(string) == str and datetime_iso.match(string):
+        format_type = 'dt' if len(string) > 10 else 'd'
+        if datetime_format_allowed(format_type, only_date, only_time):
+            try:
+                return (format_type, datetime.fromisoformat(string))
+            except ValueError:
+                pass
+    last = datetime_format_memo.get(site)
+    for index in (range(len(datetime_formats)) if last is None
+                  else datetime_format_orders[last]):
+        format_type, format_string = datetime_formats[index]
+        if not datetime_format_allowed(format_type, only_date, only_time):
+            continue
+        try:
+            result = datetime.strptime(string, format_string)
+        except:
+            #traceback.print_exc()
+            continue
+        datetime_format_memo[site] = index
+        return (format_type, result)
+    return (None, None)
+
+
 def datetime_from_str(string, 
                       only_date=False, 
                       only_time=False, 
                       also_return_type=False):
     if type(string) == datetime:
         string = datetime_to_str(string)
-    tries = [
-        ('dt', '%Y-%m-%d %H:%M:%S.%f', not only_date and not only_time),
-        ('dt', '%Y-%m-%d %H:%M:%S',    not only_date and not only_time),
-        ('dt', '%Y-%m-%d %H:%M',       not only_date and not only_time),
-        ('d',  '%Y-%m-%d',             not only_time),
-        ('d',  '%Y',                   not only_time),
-        ('t',  '%H:%M:%S',             not only_date),
-        ('t',  '%H:%M',                not only_date),
-    ]
-    for format_type, format_string, condition in tries:
-        try:
-            if not condition:
-                continue
-            result = datetime.strptime(string, format_string)
-            """ add reference date if only time is parsed """
-            if format_type == 't':
-                reference = ensa.variables['reference_time']
-                result = result.replace(year=reference.year,
-                                        month=reference.month,
-                                        day=reference.day)
-            if also_return_type:
-                result = (format_type, result)
-            return result
-        except:
-            #traceback.print_exc()
-            continue
-    """ no match """
-    log.err('Cannot parse datetime \'%s\'' % string) # TODO comment, `tlt` might use this as feature
-    if also_return_type:
-        return (None, None)
+    cache_size = ensa.config['cache.datetime'].value
+    key = (string, only_date, only_time)
+    cached = (datetime_cache.get(key)
+              if cache_size > 0 and type(string) == str else None)
+    if cached:
+        datetime_cache.move_to_end(key)
+        format_type, result = cached
     else:
-        return None
+        caller = sys._getframe(1)
+        format_type, result = parse_datetime(
+            string, only_date, only_time, (caller.f_code, caller.f_lineno))
+        if format_type and cache_size > 0 and type(string) == str:
+            datetime_cache[key] = (format_type, result)
+            while len(datetime_cache) > cache_size:
+                datetime_cache.popitem(last=False)
+    if format_type is None:
+        """ no match """
+        log.err('Cannot parse datetime \'%s\'' % string) # TODO comment, `tlt` might use this as feature
+        if also_return_type:
+            return (None, None)
+        else:
+            return None
+    """ add reference date if only time is parsed """
+    if format_type == 't':
+        reference = ensa.variables['reference_time']
+        result = result.replace(year=reference.year,
+                                month=reference.month,
+                                day=reference.day)
+    if also_return_type:
+        result = (format_type, result)
+    return result
         
 
 def datetime_to_str(dt=None, only_date=False, only_time=False):
@@ -169,11 +315,10 @@ def datetime_to_str(dt=None, only_date=False, only_time=False):
         dt = ensa.variables['reference_time']
     if type(dt) == str:
         dt = datetime_from_str(dt)
-    format_string = '%Y-%m-%d %H:%M:%S'
+    """ isoformat() pads years to 4 digits, strftime('%Y') may not """
     if only_date:
-        format_string = '%Y-%m-%d'
+        return dt.date().isoformat()
     elif only_time:
-        format_string = '%H:%M:%S'
-
-    return dt.strftime(format_string)
+        return dt.strftime('%H:%M:%S')
+    return dt.isoformat(' ', 'seconds')
 
@@ -10,53 +10,88 @@ from source.ensa import config, variables
 import traceback
 
 """
-Colors
+Colors (read as log.COLOR_* / log.MIMECOLOR_*, empty when disabled)
 """
-COLOR_NONE = '\033[00m'
-COLOR_BOLD = "\033[01m"
-
-COLOR_BLACK = '\033[30m'
-COLOR_DARK_RED = '\033[31m'
-COLOR_DARK_GREEN = '\033[32m'
-COLOR_BROWN = '\033[33m'
-COLOR_DARK_BLUE = '\033[34m'
-COLOR_DARK_PURPLE = '\033[35m'
-COLOR_DARK_CYAN = '\033[36m'
-COLOR_GREY = '\033[37m'
-
-COLOR_DARK_GREY = '\033[90m'
-COLOR_RED = '\033[91m'
-COLOR_GREEN = '\033[92m'
-COLOR_YELLOW = '\033[93m'
-COLOR_BLUE = '\033[94m'
-COLOR_PURPLE = '\033[95m'
-COLOR_CYAN = '\033[96m'
-COLOR_WHITE = '\033[97m'
+COLORS = {
+    'COLOR_NONE': '\033[00m',
+    'COLOR_BOLD': '\033[01m',
+
+    'COLOR_BLACK': '\033[30m',
+    'COLOR_DARK_RED': '\033[31m',
+    'COLOR_DARK_GREEN': '\033[32m',
+    'COLOR_BROWN': '\033[33m',
+    'COLOR_DARK_BLUE': '\033[34m',
+    'COLOR_DARK_PURPLE': '\033[35m',
+    'COLOR_DARK_CYAN': '\033[36m',
+    'COLOR_GREY': '\033[37m',
+
+    'COLOR_DARK_GREY': '\033[90m',
+    'COLOR_RED': '\033[91m',
+    'COLOR_GREEN': '\033[92m',
+    'COLOR_YELLOW': '\033[93m',
+    'COLOR_BLUE': '\033[94m',
+    'COLOR_PURPLE': '\033[95m',
+    'COLOR_CYAN': '\033[96m',
+    'COLOR_WHITE': '\033[97m',
+}
 
 """
 Colors for MIME types
 """
-MIMECOLOR_PLAINTEXT = COLOR_GREEN
-MIMECOLOR_HTML = COLOR_GREY
-MIMECOLOR_SCRIPT = COLOR_BLUE
-MIMECOLOR_CSS = COLOR_DARK_PURPLE
-MIMECOLOR_IMAGE = COLOR_PURPLE
-MIMECOLOR_MULTIMEDIA = COLOR_CYAN
-MIMECOLOR_ARCHIVE = COLOR_BROWN
-MIMECOLOR_BINARY = COLOR_DARK_GREY
-MIMECOLOR_DATATRANSFER = COLOR_YELLOW
-MIMECOLOR_DOCUMENT = COLOR_GREEN
-MIMECOLOR_MESSAGE = COLOR_DARK_BLUE
+COLORS.update({
+    'MIMECOLOR_PLAINTEXT': COLORS['COLOR_GREEN'],
+    'MIMECOLOR_HTML': COLORS['COLOR_GREY'],
+    'MIMECOLOR_SCRIPT': COLORS['COLOR_BLUE'],
+    'MIMECOLOR_CSS': COLORS['COLOR_DARK_PURPLE'],
+    'MIMECOLOR_IMAGE': COLORS['COLOR_PURPLE'],
+    'MIMECOLOR_MULTIMEDIA': COLORS['COLOR_CYAN'],
+    'MIMECOLOR_ARCHIVE': COLORS['COLOR_BROWN'],
+    'MIMECOLOR_BINARY': COLORS['COLOR_DARK_GREY'],
+    'MIMECOLOR_DATATRANSFER': COLORS['COLOR_YELLOW'],
+    'MIMECOLOR_DOCUMENT': COLORS['COLOR_GREEN'],
+    'MIMECOLOR_MESSAGE': COLORS['COLOR_DARK_BLUE'],
+})
 
 prompt = ''
+show_prompt = True
+colors = True
+
+
+def color(name):
+    """
+    Returns escape code for given color, or '' if colors are disabled.
+    """
+    return COLORS[name] if colors else ''
+
+
+def __getattr__(name):
+    """
+    log.COLOR_* and log.MIMECOLOR_* are looked up when used,
+    so they are plain text once colors are disabled.
+    """
+    if name in COLORS:
+        return color(name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def disable_colors():
+    """
+    Turns all colors off (e.g. for non-interactive use).
+    """
+    global colors
+    colors = False
+    set_prompt()
 
 
 def set_prompt():
     global prompt
-    prompt = (COLOR_PURPLE 
-              + COLOR_BOLD 
+    if not show_prompt:
+        prompt = ''
+        return
+    prompt = (color('COLOR_PURPLE')
+              + color('COLOR_BOLD')
               + get_prompt_key()
-              + COLOR_NONE)
+              + color('COLOR_NONE'))
 
 
 set_prompt()
@@ -68,12 +103,12 @@ Thread-safe print
 """
 
 
-def tprint(string='', color=COLOR_NONE, new_line=True, stdout=True):
+def tprint(string='', color=None, new_line=True, stdout=True):
     lines = []
-    if color == COLOR_NONE:
+    if not color or not colors:
         lines.append(string)
     else:
-        lines.append(color+string+COLOR_NONE)
+        lines.append(color+string+COLORS['COLOR_NONE'])
     if stdout:
         with loglock:
             for line in lines:
@@ -99,8 +134,11 @@ OK, INFO, WARN, ERR, QUESTION
 def show_marked(c, color='', string='', new_line=True, stdout=True, output=sys.stdout):
     lines = []
     #lines.append('%s%s%s%s%s%s' % (color, COLOR_BOLD, c, COLOR_NONE, str(string),('\n' if newline else '')))
-    lines.append('%s%s%s%s%s' %
-                 (color, COLOR_BOLD, c, COLOR_NONE, str(string)))
+    if colors:
+        lines.append('%s%s%s%s%s' % (color, COLORS['COLOR_BOLD'], c,
+                                     COLORS['COLOR_NONE'], str(string)))
+    else:
+        lines.append('%s%s' % (c, str(string)))
     if stdout:
         with loglock:
             for line in lines:
@@ -109,23 +147,23 @@ def show_marked(c, color='', string='', new_line=True, stdout=True, output=sys.s
 
 
 def ok(string='', new_line=True, stdout=True):
-    return show_marked('[+] ', COLOR_GREEN, string, new_line, stdout)
+    return show_marked('[+] ', color('COLOR_GREEN'), string, new_line, stdout)
 
 
 def info(string='', new_line=True, stdout=True):
-    return show_marked('[.] ', COLOR_BLUE, string, new_line, stdout)
+    return show_marked('[.] ', color('COLOR_BLUE'), string, new_line, stdout)
 
 
 def warn(string='', new_line=True, stdout=True):
-    return show_marked('[!] ', COLOR_YELLOW, string, new_line, stdout)
+    return show_marked('[!] ', color('COLOR_YELLOW'), string, new_line, stdout)
 
 
 def err(string='', new_line=True, stdout=True):
-    return show_marked('[-] ', COLOR_RED, string, new_line, stdout, output=sys.stderr)
+    return show_marked('[-] ', color('COLOR_RED'), string, new_line, stdout, output=sys.stderr)
 
 
 def question(string='', new_line=True, stdout=True):
-    return show_marked('[?] ', COLOR_CYAN, string, new_line, stdout)
+    return show_marked('[?] ', color('COLOR_CYAN'), string, new_line, stdout)
 
 
 """
@@ -135,14 +173,14 @@ Debug functions
 
 def debug_command(string=''):
     if positive(config['debug.command'].value):
-        show_marked('cmd.', COLOR_DARK_GREY,
-                    COLOR_DARK_GREY+str(string)+COLOR_NONE)
+        show_marked('cmd.', color('COLOR_DARK_GREY'),
+                    color('COLOR_DARK_GREY')+str(string)+color('COLOR_NONE'))
 
 
 def debug_config(string=''):
     if positive(config['debug.config'].value):
-        show_marked('cnf.', COLOR_DARK_GREY,
-                    COLOR_DARK_GREY+str(string)+COLOR_NONE)
+        show_marked('cnf.', color('COLOR_DARK_GREY'),
+                    color('COLOR_DARK_GREY')+str(string)+color('COLOR_NONE'))
 
 
 def debug_error(string=''):
@@ -153,8 +191,8 @@ def debug_error(string=''):
 
 def debug_query(string=''):
     if positive(config['debug.query'].value):
-        show_marked('qry.', COLOR_DARK_GREY,
-                    COLOR_DARK_GREY+str(string)+COLOR_NONE)
+        show_marked('qry.', color('COLOR_DARK_GREY'),
+                    color('COLOR_DARK_GREY')+str(string)+color('COLOR_NONE'))
 
 # def debug_flow(string=''):
 #    if positive(config['debug.flow'][0]):
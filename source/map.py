@@ -3,9 +3,16 @@
 This file is responsible for OSM map image generation.
 """
 import geotiler
-import matplotlib.pyplot as plt
+from geotiler.tile.io import fetch_tiles
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from source import log
+from source import ensa
+from source.lib import read_cache_file, write_cache_file, evict_cache_files
 import os
+import hashlib
+import sqlite3
+from io import BytesIO
 
 home_folder = os.path.expanduser('~')
 try:
@@ -16,7 +23,127 @@ with open(home_folder + '/.config/geotiler/geotiler.ini', 'w') as f:
     pass
 
 
-def get_map(points, labels, image_size=(1024, 768)):
+"""
+Map tiles are addressed by (provider, zoom, x, y), provider name gets
+a hash of map.url if a custom tile server is used. They are read from
+the local tile source (map.source - directory with <zoom>/<x>/<y>.<ext>
+files or an MBTiles file), then from the tile cache (map.cache).
+Missing tiles are downloaded (unless map.offline is set) and cached.
+"""
+mbtiles_connections = {}
+
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def read_local_tile(zoom, x, y, extension):
+    source = ensa.config['map.source'].value
+    if not source:
+        return None
+    if source.endswith('.mbtiles'):
+        """one connection per process (reports are rendered in a pool)"""
+        key = (source, os.getpid())
+        if key not in mbtiles_connections:
+            if not os.path.isfile(source):
+                log.err('MBTiles file %s does not exist.' % source)
+                return None
+            mbtiles_connections[key] = sqlite3.connect(source)
+        """MBTiles rows are numbered from the bottom (TMS)"""
+        row = mbtiles_connections[key].execute(
+            "SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, (1 << zoom) - 1 - y)).fetchone()
+        return bytes(row[0]) if row else None
+    return read_file(os.path.join(source, str(zoom), str(x),
+                                  '%d.%s' % (y, extension)))
+
+
+def get_tile_cache_path(key, extension):
+    directory = ensa.config['map.cache'].value
+    if not directory:
+        return None
+    provider, zoom, x, y = key
+    return os.path.join(directory, provider, str(zoom), str(x),
+                        '%d.%s' % (y, extension))
+
+
+async def download_tiles(tiles, num_workers, keys=None, extension='png',
+                         failed=None):
+    """
+    geotiler downloader serving tiles from local source and cache;
+    keys maps tile URL to (provider, zoom, x, y). Keys of tiles that
+    could not be obtained are appended to failed list.
+    """
+    missing = []
+    for tile in tiles:
+        key = keys[tile.url]
+        data = read_local_tile(*key[1:], extension)
+        if data is None:
+            path = get_tile_cache_path(key, extension)
+            data = read_file(path) if path else None
+        if data is None:
+            missing.append(tile)
+        else:
+            yield tile._replace(img=data, error=None)
+    if not missing:
+        return
+    if ensa.config['map.offline'].value:
+        log.warn('%d map tile(s) not available offline.' % len(missing))
+        if failed is not None:
+            failed += [keys[tile.url] for tile in missing]
+        for tile in missing:
+            yield tile._replace(
+                img=None, error=ValueError('Tile %s/%d/%d/%d is not available.'
+                                           % keys[tile.url]))
+        return
+    async for tile in fetch_tiles(missing, num_workers):
+        if tile.img:
+            path = get_tile_cache_path(keys[tile.url], extension)
+            if path:
+                write_cache_file(path, tile.img)
+        elif failed is not None:
+            failed.append(keys[tile.url])
+        yield tile
+
+
+def render_map(mm, provider=None, failed=None):
+    """
+    Renders geotiler map using local and cached tiles where possible.
+    provider is the name tiles are cached under (map.provider by default),
+    keys of unavailable tiles are appended to failed list.
+    """
+    provider = provider or ensa.config['map.provider'].value
+    server_url = ensa.config['map.url'].value
+    if server_url:
+        """tiles of a custom server do not mix with the provider's ones"""
+        mm.provider.url = server_url
+        provider = '%s-%s' % (
+            provider, hashlib.sha256(server_url.encode()).hexdigest()[:16])
+    keys = {}
+    tile_url = mm.provider.tile_url
+
+    def keyed_tile_url(coord, zoom):
+        url = tile_url(coord, zoom)
+        keys[url] = (provider, zoom, coord[0], coord[1])
+        return url
+
+    mm.provider.tile_url = keyed_tile_url
+    return geotiler.render_map(mm, downloader=download_tiles, keys=keys,
+                               extension=mm.provider.extension,
+                               failed=failed)
+
+
+def get_map(points, labels, image_size=(1024, 768), failed=None, fig=None):
+    """
+    Draws map with labeled points into fig (a new figure by default).
+    Figures use their own Agg canvas and are not registered in pyplot,
+    so nothing is kept after the caller drops them.
+    """
     if not points:
         log.err('Cannot show map without point.')
         return None
@@ -44,11 +171,13 @@ def get_map(points, labels, image_size=(1024, 768)):
         #print('Center:', center)
         #print('Zoom:', zoom)
 
-    fig = plt.figure(figsize=(20, 15), frameon=False)
-    ax = plt.subplot(111)
-    mm = geotiler.Map(center=center, size=image_size,
-                      zoom=zoom, provider='osm')
-    img = geotiler.render_map(mm)
+    if fig is None:
+        fig = Figure(figsize=(20, 15), frameon=False)
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    mm = geotiler.Map(center=center, size=image_size, zoom=zoom,
+                      provider=ensa.config['map.provider'].value)
+    img = render_map(mm, failed=failed)
     geo_points = [mm.rev_geocode(p[::-1]) for p in points]
     X, Y = zip(*geo_points)
     ax.axis('off')  # TODO remove border
@@ -60,3 +189,56 @@ def get_map(points, labels, image_size=(1024, 768)):
         ax.text(x+5, y-5, label, fontsize=30)
         # TODO change positioning if overlap is expected
     return fig
+
+
+png_figure = None
+
+
+def get_png_figure():
+    """
+    Returns the figure reused for all PNG renders in this process.
+    """
+    global png_figure
+    if png_figure is None:
+        png_figure = Figure(figsize=(20, 15), frameon=False)
+        FigureCanvasAgg(png_figure)
+    return png_figure
+
+
+def get_map_png(points, labels, image_size=(1024, 768)):
+    """
+    Returns map with given points as PNG data (or None).
+
+    Rendered maps are cached in map.image_cache, addressed by hash
+    of points, labels, image size and tile source; matplotlib is not
+    used at all for a cached map. Maps with missing tiles are not cached.
+    """
+    if not points:
+        log.err('Cannot show map without point.')
+        return None
+    directory = ensa.config['map.image_cache'].value
+    path = None
+    if directory:
+        key = repr((sorted(zip((tuple(p) for p in points), labels)),
+                    tuple(image_size),
+                    ensa.config['map.provider'].value,
+                    ensa.config['map.url'].value))
+        path = os.path.join(directory, '%s.png'
+                            % hashlib.sha256(key.encode()).hexdigest())
+        data = read_cache_file(path)
+        if data is not None:
+            return data
+    failed = []
+    fig = get_png_figure()
+    data = BytesIO()
+    try:
+        get_map(points, labels, image_size, failed=failed, fig=fig)
+        fig.savefig(data, format='png', bbox_inches='tight', pad_inches=0)
+    finally:
+        fig.clear()
+    data = data.getvalue()
+    if path and not failed:
+        write_cache_file(path, data)
+        evict_cache_files(directory,
+                          ensa.config['map.image_cache_size'].value)
+    return data
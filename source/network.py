@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+"""
+This module analyzes relationships of all subjects in a ring.
+
+Relationships are associations of two codenames with note
+'<codename>-<codename> <relationship>' (see `sar` command). They are
+loaded at once into a compact undirected graph: subjects are numbered
+0..n-1 and adjacency is kept in arrays (CSR), so degree, path and
+component queries stay fast even for rings with 100k+ relationships.
+"""
+from array import array
+from collections import deque
+from itertools import groupby
+from xml.sax.saxutils import escape, quoteattr
+from source import log
+from source import ensa
+
+
+class Network():
+    """
+    Relationship graph of a ring.
+
+    nodes:    codenames; index is the node id
+    edges:    parallel arrays source, target (node ids), relationship
+              (index into relationships), level, accuracy, valid
+    adjacency of node n: neighbors[offsets[n]:offsets[n+1]], the edge
+              used to reach the neighbor is at the same position
+              in edge_ids
+    """
+
+    def __init__(self, codenames, rows):
+        """
+        codenames: codenames of all subjects in the ring
+        rows:      (association_id, level, accuracy, valid, note,
+                    codename) - one row for each codename of association
+        """
+        self.nodes = sorted(codenames)
+        self.node_ids = {c: i for i, c in enumerate(self.nodes)}
+        self.relationships = []
+        relationship_ids = {}
+        self.association_ids = array('q')
+        self.source = array('i')
+        self.target = array('i')
+        self.relationship = array('i')
+        self.level = array('h')
+        self.accuracy = array('h')
+        self.valid = array('b')
+        """rows of each association are together, keep relationships only"""
+        for association_id, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            edge = self.parse_relationship(group[0][4],
+                                           [row[5] for row in group])
+            if not edge:
+                continue
+            a, b, relationship = edge
+            if relationship not in relationship_ids:
+                relationship_ids[relationship] = len(self.relationships)
+                self.relationships.append(relationship)
+            self.association_ids.append(association_id)
+            self.source.append(a)
+            self.target.append(b)
+            self.relationship.append(relationship_ids[relationship])
+            self.level.append(group[0][1] or 0)
+            self.accuracy.append(group[0][2] or 0)
+            self.valid.append(1 if group[0][3] else 0)
+        self.build_adjacency()
+
+    def parse_relationship(self, note, codenames):
+        """
+        Returns (node, node, relationship) if the association is
+        a relationship of two subjects, None otherwise.
+        """
+        if len(codenames) != 2 or not note:
+            return None
+        a, b = codenames
+        pair, _, relationship = note.partition(' ')
+        if not relationship:
+            return None
+        if pair.lower() == ('%s-%s' % (b, a)).lower():
+            a, b = b, a
+        elif pair.lower() != ('%s-%s' % (a, b)).lower():
+            return None
+        try:
+            return (self.node_ids[a], self.node_ids[b], relationship)
+        except KeyError:
+            return None
+
+    def build_adjacency(self):
+        """
+        Creates CSR adjacency (both directions) by counting sort.
+        """
+        node_count = len(self.nodes)
+        counts = array('l', [0]) * (node_count + 1)
+        for a, b in zip(self.source, self.target):
+            counts[a + 1] += 1
+            counts[b + 1] += 1
+        for i in range(node_count):
+            counts[i + 1] += counts[i]
+        self.offsets = counts
+        position = array('l', counts)
+        self.neighbors = array('i', [0]) * (2 * len(self.source))
+        self.edge_ids = array('i', [0]) * (2 * len(self.source))
+        for edge_id, (a, b) in enumerate(zip(self.source, self.target)):
+            for x, y in ((a, b), (b, a)):
+                self.neighbors[position[x]] = y
+                self.edge_ids[position[x]] = edge_id
+                position[x] += 1
+
+    def node(self, codename):
+        try:
+            return self.node_ids[codename]
+        except KeyError:
+            log.err('There is no subject \'%s\' in this ring.' % codename)
+            return None
+
+    def degree(self, codename):
+        """
+        Returns number of relationships of the subject.
+        """
+        n = self.node(codename)
+        if n is None:
+            return None
+        return self.offsets[n + 1] - self.offsets[n]
+
+    def get_relationships(self, codename):
+        """
+        Returns (acquaintance, relationship, edge id) for the subject.
+        """
+        n = self.node(codename)
+        if n is None:
+            return []
+        return [(self.nodes[self.neighbors[i]],
+                 self.relationships[self.relationship[self.edge_ids[i]]],
+                 self.edge_ids[i])
+                for i in range(self.offsets[n], self.offsets[n + 1])]
+
+    def shortest_path(self, start, end):
+        """
+        Returns list of (codename, relationship, codename) describing
+        the shortest connection of two subjects (breadth-first search),
+        [] for the same subject, None if they are not connected.
+        """
+        a = self.node(start)
+        b = self.node(end)
+        if a is None or b is None:
+            return None
+        if a == b:
+            return []
+        parent_edge = array('i', [-1]) * len(self.nodes)
+        visited = bytearray(len(self.nodes))
+        visited[a] = 1
+        queue = deque([a])
+        while queue:
+            n = queue.popleft()
+            for i in range(self.offsets[n], self.offsets[n + 1]):
+                m = self.neighbors[i]
+                if visited[m]:
+                    continue
+                visited[m] = 1
+                parent_edge[m] = self.edge_ids[i]
+                if m == b:
+                    queue.clear()
+                    break
+                queue.append(m)
+        if not visited[b]:
+            return None
+        path = []
+        n = b
+        while n != a:
+            edge_id = parent_edge[n]
+            source = self.source[edge_id]
+            previous = self.target[edge_id] if source == n else source
+            path.append((self.nodes[self.source[edge_id]],
+                         self.relationships[self.relationship[edge_id]],
+                         self.nodes[self.target[edge_id]]))
+            n = previous
+        return path[::-1]
+
+    def components(self):
+        """
+        Returns connected components (lists of codenames),
+        largest first.
+        """
+        component = array('i', [-1]) * len(self.nodes)
+        result = []
+        for start in range(len(self.nodes)):
+            if component[start] != -1:
+                continue
+            component[start] = len(result)
+            members = [start]
+            queue = [start]
+            while queue:
+                n = queue.pop()
+                for i in range(self.offsets[n], self.offsets[n + 1]):
+                    m = self.neighbors[i]
+                    if component[m] == -1:
+                        component[m] = len(result)
+                        members.append(m)
+                        queue.append(m)
+            result.append(members)
+        return sorted(([self.nodes[n] for n in sorted(members)]
+                       for members in result),
+                      key=lambda c: (-len(c), c[0]))
+
+    def edges(self):
+        for edge_id in range(len(self.source)):
+            yield (self.nodes[self.source[edge_id]],
+                   self.nodes[self.target[edge_id]],
+                   self.relationships[self.relationship[edge_id]],
+                   self.level[edge_id], self.accuracy[edge_id],
+                   bool(self.valid[edge_id]), self.association_ids[edge_id])
+
+    def export_graphml(self, f):
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                '  <key id="relationship" for="edge" '
+                'attr.name="relationship" attr.type="string"/>\n'
+                '  <key id="level" for="edge" attr.name="level" '
+                'attr.type="int"/>\n'
+                '  <key id="accuracy" for="edge" attr.name="accuracy" '
+                'attr.type="int"/>\n'
+                '  <key id="valid" for="edge" attr.name="valid" '
+                'attr.type="boolean"/>\n'
+                '  <key id="association" for="edge" '
+                'attr.name="association" attr.type="long"/>\n'
+                '  <graph id=%s edgedefault="undirected">\n'
+                % quoteattr(ensa.db.get_ring_name(ensa.current_ring) or ''))
+        for codename in self.nodes:
+            f.write('    <node id=%s/>\n' % quoteattr(codename))
+        for a, b, relationship, level, accuracy, valid, association_id \
+                in self.edges():
+            f.write('    <edge source=%s target=%s>'
+                    '<data key="relationship">%s</data>'
+                    '<data key="level">%d</data>'
+                    '<data key="accuracy">%d</data>'
+                    '<data key="valid">%s</data>'
+                    '<data key="association">%d</data></edge>\n'
+                    % (quoteattr(a), quoteattr(b),
+                       escape(relationship), level, accuracy,
+                       'true' if valid else 'false', association_id))
+        f.write('  </graph>\n</graphml>\n')
+
+    def export_dot(self, f):
+        def quote(x):
+            return '"%s"' % x.replace('\\', '\\\\').replace('"', '\\"')
+
+        f.write('graph %s {\n'
+                % quote(ensa.db.get_ring_name(ensa.current_ring) or ''))
+        for codename in self.nodes:
+            f.write('    %s;\n' % quote(codename))
+        for a, b, relationship, level, accuracy, valid, association_id \
+                in self.edges():
+            f.write('    %s -- %s [label=%s, level=%d, accuracy=%d%s];\n'
+                    % (quote(a), quote(b), quote(relationship), level,
+                       accuracy, '' if valid else ', style=dotted'))
+        f.write('}\n')
+
+
+network = None
+network_key = None
+
+
+def get_network():
+    """
+    Returns relationship network of the current ring. It is reused
+    until anything in the database changes (in any session).
+    """
+    global network, network_key
+    if not ensa.db.ring_ok():
+        return None
+    key = (ensa.current_ring, ensa.db.change_marker())
+    if network is None or network_key != key:
+        network = Network([s[1] for s in ensa.db.get_subjects()],
+                          ensa.db.get_relationship_rows())
+        network_key = key
+    return network
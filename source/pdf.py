@@ -4,12 +4,17 @@ This module is responsible for generating PDF reports of provided data.
 """
 from datetime import datetime
 import os
+import hashlib
 import pdb
 import tempfile
 from dateutil.relativedelta import relativedelta
 import traceback
 
+from io import BytesIO
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import PIL.Image
 from reportlab.lib import colors, utils
 from reportlab.lib.units import cm
 from reportlab.lib.pagesizes import A4
@@ -190,60 +195,278 @@ horoscope = [
 ]
 
 
-# def person_report(infos, filename):
-def person_report(codename, filename):
-    codename_id = ensa.db.select_subject(codename)
-    # pdb.set_trace()
+def get_report_informations():
+    """
+    Returns all informations in the current ring, each extended
+    with list of its keywords (index 12).
+    """
     infos = ensa.db.get_informations(
         no_composite_parts=False, force_no_current_subject=True)
-    # pdb.set_trace()
-    infos = [i + ([x[1] for x in ensa.db.get_keywords_for_informations(
-        i[0],
-        force_no_current_subject=True)],)
-             for i in infos]
+    keywords = {}
+    if infos:
+        for information_id, keyword in ensa.db.get_keywords_for_informations(
+                [i[0] for i in infos], force_no_current_subject=True):
+            keywords.setdefault(information_id, []).append(keyword)
+    return [i + (keywords.get(i[0], []),) for i in infos]
 
-    images = get_valid_by_keyword(infos, 'image')
-    own_images = get_valid_by_keyword(infos, 'image', codename_id)
-    composites = [i for i in infos if i[3] == Database.INFORMATION_COMPOSITE]
-    own_composites = [i for i in infos if i[3] ==
-                      Database.INFORMATION_COMPOSITE and i[1] == codename_id]
 
-    # for info in infos:
-    #    print(info)
+def get_job_organization(job, infos):
+    """
+    Returns organization info of an employee association or None.
+    """
+    job_info_ids = [i[0] for i in job[1]]
+    for info in infos:
+        if info[0] in job_info_ids and 'organization' in info[12]:
+            return info
+    return None
 
-    doc = SimpleDocTemplate(filename, pagesize=A4)
+
+class Dossier():
+    """
+    Everything reports need from the current ring, loaded at once and
+    indexed in memory. Report sections only look data up here, so the
+    database is not accessed during rendering. Only plain containers
+    are stored, so the dossier can be sent to worker processes.
+    """
+
+    def __init__(self):
+        self.reference = datetime_to_str()
+        self.codenames = {s[0]: s[1] for s in ensa.db.get_subjects()}
+        self.subject_ids = {v: k for k, v in self.codenames.items()}
+        """informations (with keywords) by ID and by subject"""
+        self.infos = get_report_informations()
+        self.info_by_id = {i[0]: i for i in self.infos}
+        self.subject_infos = {}
+        for info in self.infos:
+            self.subject_infos.setdefault(info[1], []).append(info)
+        """associations by ID, information, subject and location"""
+        self.associations = {a[0][0]: a
+                             for a in ensa.db.get_associations_by_ring()}
+        self.by_information = {}
+        self.by_subject = {}
+        self.by_location = {}
+        for association_id, association in self.associations.items():
+            for info in association[1]:
+                self.by_information.setdefault(
+                    info[0], set()).add(association_id)
+                self.by_subject.setdefault(info[1], set()).add(association_id)
+            for location in association[3]:
+                self.by_location.setdefault(
+                    location[0], set()).add(association_id)
+
+    def get_associations(self, index, keys):
+        """
+        Returns associations of given keys in given index,
+        sorted by ID (as Database.get_associations_by_* methods).
+        """
+        association_ids = set()
+        for key in keys:
+            association_ids.update(index.get(key, ()))
+        return [self.associations[a] for a in sorted(association_ids)]
+
+    def get_associations_by_information(self, information_ids):
+        return self.get_associations(self.by_information, information_ids)
+
+    def get_associations_by_location(self, location_ids):
+        return self.get_associations(self.by_location, location_ids)
+
+    def get_associations_by_subject(self, codenames):
+        return self.get_associations(
+            self.by_subject, [self.subject_ids.get(c) for c in codenames])
+
+    def get_timeline_by_subject(self, codename):
+        return sorted((a for a in self.get_associations_by_subject([codename])
+                       if a[2]),
+                      key=lambda a: (min(t[1] for t in a[2]), a[0][0]))
+
+
+class FlowableStream(list):
+    """
+    Flowables for doc.build(), taken from a generator only when the
+    layout needs them. Flowables (and images) of a section are created
+    after previous sections are laid out and freed once they are drawn.
+    """
+
+    def __init__(self, flowables):
+        super().__init__()
+        self.flowables = iter(flowables)
+
+    def fill(self):
+        """take next flowable if there is none or the last keeps with next"""
+        while (not list.__len__(self)
+               or list.__getitem__(self, -1).getKeepWithNext()):
+            try:
+                self.append(next(self.flowables))
+            except StopIteration:
+                break
+
+    def __len__(self):
+        self.fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self.fill()
+        return list.__getitem__(self, index)
+
+
+class ReportImages():
+    """
+    Images embedded into one report. Each image is downscaled to the
+    size it is printed at (report.image_dpi) and the thumbnail is
+    cached in report.thumbnail_cache. Once the report takes more memory
+    than report.memory_limit, further images are left out.
+    """
+
+    def __init__(self):
+        self.dpi = ensa.config['report.image_dpi'].value
+        self.limit = ensa.config['report.memory_limit'].value
+        self.directory = ensa.config['report.thumbnail_cache'].value
+        self.start_rss = get_rss()
+        self.omitted = 0
+        self.thumbnails_written = False
+
+    def get_image(self, source, width, height):
+        """
+        Returns Image flowable restricted to width x height or None
+        if the memory limit is reached. Source is a path or image data,
+        invalid images raise exceptions as Image() does.
+        """
+        if self.limit and get_rss() - self.start_rss > self.limit:
+            self.omitted += 1
+            return None
+        if self.dpi:
+            source = self.get_thumbnail(source, width, height)
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        image = Image(source, lazy=2)
+        image._restrictSize(width, height)
+        return image
+
+    def get_thumbnail(self, source, width, height):
+        """
+        Returns path (or data) of the image downscaled to fit
+        width x height at report.image_dpi; small images are kept.
+        """
+        dpi = max(self.dpi, 72)  # never print images smaller
+        pixels = (max(1, round(width * dpi / 72)),
+                  max(1, round(height * dpi / 72)))
+        if isinstance(source, bytes):
+            key = hashlib.sha256(source).hexdigest()
+        else:
+            stat = os.stat(source)
+            key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+        key = hashlib.sha256(repr((key, pixels)).encode()).hexdigest()
+        if self.directory:
+            for extension in ('jpg', 'png'):
+                path = os.path.join(self.directory, '%s.%s' % (key, extension))
+                try:
+                    os.utime(path)  # mark as recently used
+                    return path
+                except OSError:
+                    continue
+        image = PIL.Image.open(BytesIO(source) if isinstance(source, bytes)
+                               else source)
+        if image.width <= pixels[0] and image.height <= pixels[1]:
+            return source
+        extension = 'jpg' if image.format == 'JPEG' else 'png'
+        """JPEG is decoded in reduced size right away"""
+        image.draft('RGB', pixels)
+        image.thumbnail(pixels, PIL.Image.LANCZOS)
+        data = BytesIO()
+        if extension == 'jpg':
+            image.save(data, format='JPEG', quality=85)
+        else:
+            image.save(data, format='PNG')
+        data = data.getvalue()
+        if not self.directory:
+            return data
+        path = os.path.join(self.directory, '%s.%s' % (key, extension))
+        write_cache_file(path, data)
+        self.thumbnails_written = True
+        return path if os.path.isfile(path) else data
+
+    def close(self):
+        if self.thumbnails_written:
+            evict_cache_files(self.directory,
+                              ensa.config['report.thumbnail_cache_size'].value)
+        if self.omitted:
+            log.warn('%d image(s) left out of the report, '
+                     'report.memory_limit is reached.' % self.omitted)
+
+
+def person_report(codename, filename):
+    render_person_report(Dossier(), codename, filename)
+
+
+def register_fonts():
     font_file = 'source/symbola.ttf'
     symbola_font = TTFont('Symbola', font_file)
     styles['BodyText'].fontName = 'Symbola'
     styles['BodyText'].fontSize = 12
     pdfmetrics.registerFont(symbola_font)
 
-    entries = []
+
+def render_person_report(dossier, codename, filename):
+    """
+    Creates person report PDF from the dossier.
+    Database is not touched, so this can run in a worker process.
+    """
+    if codename not in dossier.subject_ids:
+        raise ValueError('There is no such subject.')
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    register_fonts()
+    report_images = ReportImages()
+    try:
+        doc.build(FlowableStream(
+            person_report_flowables(dossier, codename, report_images)))
+    finally:
+        report_images.close()
+
+
+def person_report_flowables(dossier, codename, report_images):
+    """
+    Generates flowables of the person report section by section.
+    """
+    codename_id = dossier.subject_ids.get(codename)
+    infos = dossier.infos
+    own_infos = dossier.subject_infos.get(codename_id, [])
+    codenames = dossier.codenames
+    subject_ids = dossier.subject_ids
+    subject_associations = dossier.get_associations_by_subject([codename])
+
+    images = get_valid_by_keyword(infos, 'image')
+    own_images = get_valid_by_keyword(own_infos, 'image', codename_id)
+    composites = [i for i in infos if i[3] == Database.INFORMATION_COMPOSITE]
+    own_composites = [i for i in own_infos
+                      if i[3] == Database.INFORMATION_COMPOSITE]
+
+    # for info in infos:
+    #    print(info)
 
     # infos_dict = {info[4]: info for info in infos}
     """TITLE"""
-    entries.append(Paragraph(
+    yield Paragraph(
         '<para align=center>Person Report</para>',
-        styles['Title']))
-    entries.append(par('<para align=center spaceAfter=20>reference %s, created %s</para>'
-                       % (datetime_to_str(),
-                          datetime_to_str(datetime.now()))))
+        styles['Title'])
+    yield par('<para align=center spaceAfter=20>reference %s, created %s</para>'
+              % (dossier.reference,
+                 datetime_to_str(datetime.now())))
 
     """basic info"""
-    name = ' '.join([i[11] for i in get_valid(infos, 'firstname', codename_id)]
+    name = ' '.join([i[11] for i in get_valid(own_infos, 'firstname', codename_id)]
                     + [i[11]
-                        for i in get_valid(infos, 'middlename', codename_id)]
-                    + [i[11] for i in get_valid(infos, 
+                        for i in get_valid(own_infos, 'middlename', codename_id)]
+                    + [i[11] for i in get_valid(own_infos, 
                                                 'lastname', 
                                                 codename_id)])
     try:
-        sex = get_valid(infos, 'sex', codename_id)[0][11]
+        sex = get_valid(own_infos, 'sex', codename_id)[0][11]
         sex_symbol = ('\u2642' if sex == 'male' else
                       ('\u2640' if sex == 'female' else ''))
     except:
         sex_symbol = ''
     try:
-        orientation = get_valid(infos, 'orientation', codename_id)[0][11]
+        orientation = get_valid(own_infos, 'orientation', codename_id)[0][11]
         if orientation == 'heterosexual':
             orientation_symbol = '\u26a4'
         elif orientation == 'bisexual':
@@ -278,16 +501,16 @@ def person_report(codename, filename):
     entries.append(par(''))
     # '''
     try:
-        religion = get_valid_by_level(infos, 'religion', codename_id)[0][11]
+        religion = get_valid_by_level(own_infos, 'religion', codename_id)[0][11]
     except:
         religion = ''
 
     try:
-        politics = get_valid_by_level(infos, 'politics', codename_id)[0][11]
+        politics = get_valid_by_level(own_infos, 'politics', codename_id)[0][11]
     except:
         politics = ''
 
-    codename_tuple = get_valid(infos, 'codename', codename_id)[0]
+    codename_tuple = get_valid(own_infos, 'codename', codename_id)[0]
     info_codename_id = codename_tuple[0]
     # codename = codename_tuple[10]
 
@@ -298,7 +521,7 @@ def person_report(codename, filename):
         event_str = ''
         event_value = None
         description = '%s\'s %s' % (codename.title(), event)
-        time_assocs = [a for a in ensa.db.get_associations_by_subject(codename)
+        time_assocs = [a for a in subject_associations
                        if a[0][6] == description]
         # find association with time entry
         for time_assoc in time_assocs:
@@ -311,18 +534,18 @@ def person_report(codename, filename):
         # get partial info from Information
         if not event_value:
             try:
-                year = get_valid(infos, '%s_year' % event, codename_id)[0][11]
+                year = get_valid(own_infos, '%s_year' % event, codename_id)[0][11]
             except:
                 year = None
             try:
-                month = get_valid(infos, '%s_month' %
+                month = get_valid(own_infos, '%s_month' %
                                   event, codename_id)[0][11]
                 real_month = month
             except:
                 month = '01'
                 real_month = '??'
             try:
-                day = get_valid(infos, '%s_day' % event, codename_id)[0][11]
+                day = get_valid(own_infos, '%s_day' % event, codename_id)[0][11]
                 real_day = day
             except:
                 day = '01'
@@ -378,11 +601,11 @@ def person_report(codename, filename):
         ('Codename', codename),
         ('Name', name),
         ('Identifier', list(par(i[11])
-                            for i in get_valid(infos, 'identifier', codename_id))),
+                            for i in get_valid(own_infos, 'identifier', codename_id))),
         ('Birth', time_events.get('birth')),
         ('Death', time_events.get('death')),
         ('Known as', list(par(i[11])
-                          for i in get_valid(infos, 'nickname', codename_id))),
+                          for i in get_valid(own_infos, 'nickname', codename_id))),
         ('Characteristics', ' '.join((sex_symbol,
                                       orientation_symbol,
                                       religion_symbols.get(
@@ -390,27 +613,27 @@ def person_report(codename, filename):
                                       politics_symbols.get(politics) or politics)
                                      ).strip()),
         ('Phone', list(par(i[11])
-                       for i in get_valid(infos, 'phone', codename_id))),
+                       for i in get_valid(own_infos, 'phone', codename_id))),
         ('Email', list(par(i[11])
-                       for i in get_valid(infos, 'email', codename_id))),
+                       for i in get_valid(own_infos, 'email', codename_id))),
         ('Website', list(par('<link href="%s">%s</link>' % (i[11], i[11]))
-                         for i in get_valid(infos, 'website', codename_id))),
+                         for i in get_valid(own_infos, 'website', codename_id))),
     ])
     portrait_path = 'files/binary/%d' % info_codename_id
+    portrait = None
     if os.path.isfile(portrait_path):
-        portrait = Image(portrait_path)
+        portrait = report_images.get_image(portrait_path, 7*cm, 10*cm)
     else:
         log.warn('No portrait available.')
-        import PIL.Image
-        from io import BytesIO
+    if not portrait:
         white = PIL.Image.new('RGB', (150, 200), (255, 255, 255))
         portrait_str = BytesIO()
         white.save(portrait_str, format='PNG')
         portrait = Image(portrait_str)
-    portrait._restrictSize(7*cm, 10*cm)
+        portrait._restrictSize(7*cm, 10*cm)
 
     """Add basic info and portrait to the report"""
-    entries.append(Table(
+    yield Table(
         [[Table(
             [[Paragraph('Basic information', styles['Heading2'])],
              [Table(
@@ -430,14 +653,14 @@ def person_report(codename, filename):
                           # ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
                           ]),
         hAlign='CENTER',
-        vAlign='TOP'))
+        vAlign='TOP')
 
     """Address"""
     description = '%s\'s home' % codename.title()
     """find address that is not part of a composite (e.g. work address)"""
     try:
         # pdb.set_trace()
-        address = [a for a in infos
+        address = [a for a in own_infos
                    if a[0] not in [x for i in own_composites for x in i[11]]
                    and a[1] == codename_id
                    and a[3] == Database.INFORMATION_COMPOSITE
@@ -445,11 +668,11 @@ def person_report(codename, filename):
         if address:
             address_id = address[0][0]
             address_lines = format_address(
-                get_valid_by_ids(infos, address[0][11], codename_id))
+                get_valid_by_ids(own_infos, address[0][11], codename_id))
             """get map"""
             # get associations with address
             address_map = None
-            address_assocs = [a for a in ensa.db.get_associations_by_information(address_id)
+            address_assocs = [a for a in dossier.get_associations_by_information([address_id])
                               if a[0][6] == description]
             # find association with location entry
             for address_assoc in address_assocs:
@@ -465,22 +688,18 @@ def person_report(codename, filename):
                             abs(lon), 'E' if lon > 0 else 'W')
                         address_lines.append('%s %s' % (lat_str, lon_str))
                         # create map, load as image
-                        with tempfile.NamedTemporaryFile() as f:
-                            address_map = get_map([(lat, lon)],
-                                                  [description])
-                            address_map.savefig(
-                                f.name + '.png', bbox_inches='tight', pad_inches=0)
-                            address_map = Image(f.name + '.png')
-                            address_map._restrictSize(12*cm, 12*cm)
+                        address_map = report_images.get_image(
+                            get_map_png([(lat, lon)], [description]),
+                            12*cm, 12*cm)
             if address_lines:
-                entries.append(Table([[[Paragraph('Address', styles['Heading2'])]
-                                       + [par(line) for line in address_lines],
-                                       address_map]],
-                                     style=TableStyle([
-                                         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                                     ]),
-                                     colWidths=[5.5*cm, 12*cm],
-                                     ))
+                yield Table([[[Paragraph('Address', styles['Heading2'])]
+                              + [par(line) for line in address_lines],
+                              address_map]],
+                            style=TableStyle([
+                                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                            ]),
+                            colWidths=[5.5*cm, 12*cm],
+                            )
     except:
         traceback.print_exc()
         address = ['']
@@ -494,7 +713,7 @@ def person_report(codename, filename):
         ('asset', 'Assets'),
         ('medical', 'Medical conditions'),
     ):
-        valids = get_valid(infos, category, codename_id)
+        valids = get_valid(own_infos, category, codename_id)
         if valids:
             valids_levels = [(k, [x[11] for x in v])
                              for k, v in get_level_sort(valids)]
@@ -504,26 +723,26 @@ def person_report(codename, filename):
                       colWidths=[cm, 15*cm],
                       # style=test_style(3),
                       )
-            entries.append(KeepTogether([
+            yield KeepTogether([
                 Paragraph(category_name, styles['Heading2']),
-                t]))
+                t])
 
     """ Quotations """
-    valids = get_valid(infos, 'quotation', codename_id)
+    valids = get_valid(own_infos, 'quotation', codename_id)
     if valids:
-        entries.append(Paragraph('Quotations', styles['Heading2']))
+        yield Paragraph('Quotations', styles['Heading2'])
         for valid in valids:
-            entries.append(Paragraph('<i>%s</i>' %
-                                     valid[11], 
-                                     getSampleStyleSheet()['BodyText']))
+            yield Paragraph('<i>%s</i>' %
+                            valid[11], 
+                            getSampleStyleSheet()['BodyText'])
 
     """Credentials"""
     # get valid credentials for systems
     credentials = []
-    credential_tuples = get_valid_by_keyword(infos, 'credentials', codename_id)
+    credential_tuples = get_valid_by_keyword(own_infos, 'credentials', codename_id)
     for c in credential_tuples:
         system = c[4]
-        creds = get_valid_by_ids(infos, c[11], codename_id)
+        creds = get_valid_by_ids(own_infos, c[11], codename_id)
         try:
             username = [c[11] for c in creds if c[4] == 'username'][0]
             password = [c[11] for c in creds if c[4] == 'password'][0]
@@ -532,7 +751,7 @@ def person_report(codename, filename):
         credentials.append((system, '%s:%s' % (username, password)))
 
     if credentials:
-        entries.append(KeepTogether([
+        yield KeepTogether([
             Paragraph('Credentials', styles['Heading2']),
             Table(credentials,
                   colWidths=[4*cm, 12*cm],
@@ -540,28 +759,28 @@ def person_report(codename, filename):
                       ('GRID', (0, 0), (-1, -1), 0.5, 'black'),
                   ])
                   )
-        ]))
+        ])
     # get all usernames, passwords (even invalid)
     usernames = [i[11]
-                 for i in infos if i[1] == codename_id and i[4] == 'username']
+                 for i in own_infos if i[4] == 'username']
     if usernames:
-        entries.append(KeepTogether([
+        yield KeepTogether([
             Paragraph('Usernames', styles['Heading3']),
-            Table([[u] for u in usernames], colWidths=[16*cm])]))
+            Table([[u] for u in usernames], colWidths=[16*cm])])
 
     passwords = [i[11]
-                 for i in infos if i[1] == codename_id and i[4] == 'password']
+                 for i in own_infos if i[4] == 'password']
     if passwords:
-        entries.append(KeepTogether([
+        yield KeepTogether([
             Paragraph('Passwords', styles['Heading3']),
-            Table([[u] for u in passwords], colWidths=[16*cm])]))
+            Table([[u] for u in passwords], colWidths=[16*cm])])
 
     # TODO suggest possible (by family etc.)
     """Job"""
     organization_list = []  # for later map drawing
     # pdb.set_trace()
-    jobs = [a for a in ensa.db.get_associations_by_subject(
-        codename) if a[0][6].endswith('employee')]
+    jobs = [a for a in subject_associations
+            if a[0][6].endswith('employee')]
     # TODO sort by start time desc
     job_tables = []
     # for j in jobs:
@@ -585,14 +804,12 @@ def person_report(codename, filename):
             end_date = None
 
         # find the organization
-        try:
-            info_organization = [i for i in infos if i[0] in [
-                i2[0] for i2 in job[1]] if 'organization' in i[12]][0]
+        info_organization = get_job_organization(job, infos)
+        if info_organization:
             organization_list.append(info_organization[11])
-            organization_id = ensa.db.select_subject(info_organization[11])
+            organization_id = subject_ids.get(info_organization[11])
             info_organization_id = info_organization[0]
-        except:
-            traceback.print_exc()
+        else:
             log.warn(
                 'Found employee association without organization (#%d).' % job_id)
             continue
@@ -603,7 +820,8 @@ def person_report(codename, filename):
         # print(positions, organization)
         # pdb.set_trace()
         try:
-            organization_name = get_valid(infos, 'name', organization_id)[0]
+            organization_name = get_valid(
+                dossier.subject_infos.get(organization_id, []), 'name')[0]
             # organization_websites = get_valid(
             #    infos, 'website', organization_id)
             # organization_identifiers = get_valid(
@@ -617,8 +835,7 @@ def person_report(codename, filename):
 
         try:
             logo_path = 'files/binary/%d' % info_organization_id
-            logo = Image(logo_path)
-            logo._restrictSize(3*cm, 2*cm)
+            logo = report_images.get_image(logo_path, 3*cm, 2*cm)
         except:
             # traceback.print_exc()
             logo = None
@@ -656,7 +873,7 @@ def person_report(codename, filename):
                 )
             )
     if job_tables:
-        entries.append(KeepTogether([
+        yield KeepTogether([
             Paragraph('Job', styles['Heading2']),
             Table([[jt] for jt in job_tables],
                   colWidths=[16*cm],
@@ -665,7 +882,7 @@ def person_report(codename, filename):
                       ('LINEBELOW', (0, 0), (-1, -1), 0.5, 'gray'),
                   ])
                   ),
-        ]))
+        ])
 
     """Social Network"""
     emblem_categories = [('person', '\U0001f464'),
@@ -676,14 +893,14 @@ def person_report(codename, filename):
     # pdb.set_trace()
     relationships = [
         # r for r in ensa.db.get_associations_by_information(info_codename_id)
-        r for r in ensa.db.get_associations_by_subject(codename)
+        r for r in subject_associations
         if len([info for info in r[1] if info[4] in ('codename', 'position')]) == 2
         and (r[0][6].lower().startswith('%s-%s '
-                                        % (ensa.db.get_subject_codename(r[1][0][1]), 
-                                           ensa.db.get_subject_codename(r[1][1][1])))
+                                        % (codenames.get(r[1][0][1]), 
+                                           codenames.get(r[1][1][1])))
              or r[0][6].lower().startswith('%s-%s '
-                                           % (ensa.db.get_subject_codename(r[1][1][1]), 
-                                              ensa.db.get_subject_codename(r[1][0][1])))
+                                           % (codenames.get(r[1][1][1]), 
+                                              codenames.get(r[1][0][1])))
              )
     ]
     #print('relationships:', relationships)
@@ -693,8 +910,8 @@ def person_report(codename, filename):
         print(r[0][6])
     '''
     # prepare dict as (codename, codename): (relationship, level, accuracy, validity)
-    relationships = [((ensa.db.get_subject_codename(r[1][0][1]),
-                       ensa.db.get_subject_codename(r[1][1][1])),
+    relationships = [((codenames.get(r[1][0][1]),
+                       codenames.get(r[1][1][1])),
                       (r[0][6].partition(' ')[2],
                        r[0][2],
                        r[0][3],
@@ -702,10 +919,10 @@ def person_report(codename, filename):
                      for r in relationships]
 
     # pick all colleagues, add relationships
-    jobs = [a for a in ensa.db.get_associations_by_subject(
-        codename) if a[0][6].endswith('employee')]
+    jobs = [a for a in subject_associations
+            if a[0][6].endswith('employee')]
     companies = [info[0] for job in jobs for info in job[1]]
-    colleagues = [i for a in ensa.db.get_associations_by_information(companies)
+    colleagues = [i for a in dossier.get_associations_by_information(companies)
                   if a[0][6].endswith('employee') for i in a[1]]
     #print('companies:', companies)
     #print('col:', colleagues)
@@ -716,14 +933,15 @@ def person_report(codename, filename):
         [i[0] for i in job_infos]) for i in a[1]]
     '''
     # get original infos with keywords etc.
-    colleagues = [i for i in infos if i[0] in [c[0] for c in colleagues]]
+    colleague_ids = set(c[0] for c in colleagues)
+    colleagues = [i for i in infos if i[0] in colleague_ids]
     colleagues_used = []
     for colleague in colleagues:
         if colleague[1] == codename_id:
             continue
         if 'organization' in colleague[12]:
             continue
-        colleague_codename = ensa.db.get_subject_codename(colleague[1])
+        colleague_codename = codenames.get(colleague[1])
         # TODO average with own?
         level = colleague[5]
         accuracy = colleague[6]
@@ -752,14 +970,15 @@ def person_report(codename, filename):
         network_str = get_relationship_graph(
             codename, acquaintances, relationships)
         # codename, acquaintances, relationships, emblems)
-        network = Image(network_str)
-        network._restrictSize(17*cm, 35*cm)
-        entries.append(KeepTogether([
-            Paragraph('Social Network',
-                      styles['Heading2']), network, PageBreak()]))
+        network = report_images.get_image(network_str.getvalue(),
+                                          17*cm, 35*cm)
+        if network:
+            yield KeepTogether([
+                Paragraph('Social Network',
+                          styles['Heading2']), network, PageBreak()])
 
     """ Timeline """
-    timeline = ensa.db.get_timeline_by_subject(codename)
+    timeline = dossier.get_timeline_by_subject(codename)
     event_tables = []
 
     for event in timeline:
@@ -786,11 +1005,10 @@ def person_report(codename, filename):
         information_rows = []
         for info in event[1]:
             # get info from infos (components, keywords, etc. present)...
-            info = [i for i in infos if i[0] == info[0]][0]
+            info = dossier.info_by_id[info[0]]
             try:
                 photo_path = 'files/binary/%d' % info[0]
-                photo = Image(photo_path)
-                photo._restrictSize(2*cm, 3*cm)
+                photo = report_images.get_image(photo_path, 2*cm, 3*cm)
             except:
                 photo = None
                 # TODO codename image if not info image...
@@ -803,7 +1021,7 @@ def person_report(codename, filename):
                 rows = codename_rows
             else:
                 symbol = '\U0001f4dd &lt;%s&gt; %s:' % (
-                    ensa.db.get_subject_codename(info[1]), info[4])
+                    codenames.get(info[1]), info[4])
                 rows = information_rows
             #  get data if composite
             if info[3] == Database.INFORMATION_COMPOSITE:
@@ -837,17 +1055,16 @@ def person_report(codename, filename):
             lon = location[3]
             location_strings.append(par('\U0001f30d %s' % location_name))
 
-            l_assocs = ensa.db.get_associations_by_location(location_id)
+            l_assocs = dossier.get_associations_by_location([location_id])
             address_found = False
             for l_assoc in l_assocs:
                 for info in l_assoc[1]:
                     if info[4] == 'address':
                         # get_associations_by_location does not give components
                         # -> we must manually find the values
-                        components = [
-                            i for i in infos if i[0] == info[0]][0][11]
+                        components = dossier.info_by_id[info[0]][11]
                         location_strings += format_address(
-                            get_valid_by_ids(infos, components, codename_id))
+                            get_valid_by_ids(own_infos, components, codename_id))
                         address_found = True
                         break
                 if address_found:
@@ -862,14 +1079,9 @@ def person_report(codename, filename):
         # create map, load as image
         location_map = None
         if coords:
-            with tempfile.NamedTemporaryFile() as f:
-                location_map = get_map([c[:2] for c in coords],
-                                       [c[2] for c in coords])
-                location_map.savefig(
-                    f.name + '.png', bbox_inches='tight', pad_inches=0)
-                location_map = Image(f.name + '.png')
-                # location_map._restrictSize(10*cm, 10*cm)
-                location_map._restrictSize(7*cm, 7*cm)
+            location_map = report_images.get_image(
+                get_map_png([c[:2] for c in coords], [c[2] for c in coords]),
+                7*cm, 7*cm)
         if location_strings:
             location_row = [
                 Table([[Table([[ls] for ls in location_strings]), location_map]], 
@@ -901,21 +1113,19 @@ def person_report(codename, filename):
         )
 
     if event_tables:
-        entries.append(Paragraph('Timeline', styles['Heading2']))
-        entries.append(
-            Table([[et] for et in event_tables],
-                  colWidths=[16*cm],
-                  style=TableStyle([
-                      # ('GRID', (0, 0), (-1, -1), 0.5, 'gray'),
-                      ('LINEBELOW', (0, 0), (-1, -1), 0.5, 'gray'),
-                  ])
-                  ),
-        )
+        yield Paragraph('Timeline', styles['Heading2'])
+        yield Table([[et] for et in event_tables],
+                    colWidths=[16*cm],
+                    style=TableStyle([
+                        # ('GRID', (0, 0), (-1, -1), 0.5, 'gray'),
+                        ('LINEBELOW', (0, 0), (-1, -1), 0.5, 'gray'),
+                    ])
+                    )
 
     """ big map of all associated locations """
     # TODO (also with comments?)
     coords = []
-    location_associations = ensa.db.get_associations_by_subject(
+    location_associations = dossier.get_associations_by_subject(
         organization_list + [codename])
     for association in location_associations:
         for location in association[3]:
@@ -925,21 +1135,18 @@ def person_report(codename, filename):
             if lat is not None and lon is not None:
                 coords.append((lat, lon, location_name))
     if coords:
-        with tempfile.NamedTemporaryFile() as f:
-            location_map = get_map([c[:2] for c in coords],
-                                   [c[2] for c in coords])
-            location_map.savefig(
-                f.name + '.png', bbox_inches='tight', pad_inches=0)
-            location_map = Image(f.name + '.png')
-            location_map._restrictSize(16*cm, 16*cm)
-        entries.append(KeepTogether([
-            Paragraph('Action map', styles['Heading2']),
-            location_map
-        ]))
+        location_map = report_images.get_image(
+            get_map_png([c[:2] for c in coords], [c[2] for c in coords]),
+            16*cm, 16*cm)
+        if location_map:
+            yield KeepTogether([
+                Paragraph('Action map', styles['Heading2']),
+                location_map
+            ])
 
     """ gallery """
     if own_images:
-        entries.append(Paragraph('Gallery', styles['Heading2']))
+        yield Paragraph('Gallery', styles['Heading2'])
         images_dict = {}
         for image in own_images:
             key = '%s:%s' % (image[4], image[11])
@@ -951,10 +1158,10 @@ def person_report(codename, filename):
             imgs_in_category = []
             for img in imgs:
                 try:
-                    image = Image('files/binary/%d' % img[0])
-                    image._restrictSize(3.5*cm, 5*cm)
-                    # entries.append(image)
-                    imgs_in_category.append(image)
+                    image = report_images.get_image(
+                        'files/binary/%d' % img[0], 3.5*cm, 5*cm)
+                    if image:
+                        imgs_in_category.append(image)
                 except:
                     traceback.print_exc()
                     continue
@@ -969,11 +1176,88 @@ def person_report(codename, filename):
                            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
                            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
                        ])))
-            entries.append(KeepTogether([heading, t]))
+            yield KeepTogether([heading, t])
     """ all (unused) informations with comments and keywords for codename_id"""
     # TODO
 
-    """ build PDF from individual entries"""
-    doc.build(entries)
+
+worker_dossier = None
+
+
+def set_worker_dossier(dossier):
+    """
+    Pool initializer, so the dossier is sent to each worker just once.
+    Workers are forked, so they also inherit config, variables and
+    the current ring (spawned ones would rerun ensa.py instead).
+    The inherited database connection is left alone, workers get
+    their own (unconnected) Database; reports only need the dossier.
+    """
+    global worker_dossier
+    ensa.db = Database()
+    worker_dossier = dossier
+
+
+def render_worker_report(codename, filename):
+    render_person_report(worker_dossier, codename, filename)
+
+
+def person_reports(codenames=None, directory='files/tmp', workers=None):
+    """
+    Generates person reports for multiple subjects of the current ring
+    (all persons if codenames are not given). Data are loaded into
+    a dossier in this process, PDFs are rendered by a pool of worker
+    processes.
+
+    Returns OrderedDict of codename: (filename, error); error is None
+    for successfully created reports.
+    """
+    workers = (workers or ensa.config['report.workers'].value
+               or os.cpu_count() or 1)
+    ring_name = ensa.db.get_ring_name(ensa.current_ring)
+    dossier = Dossier()
+    if codenames is None:
+        codenames = sorted(i[2] for i in dossier.infos
+                           if i[4] == 'codename' and 'person' in i[12])
+    results = OrderedDict((codename, (None, None)) for codename in codenames)
+    total = len(results)
+    done = 0
+
+    def finish(codename, filename, error):
+        nonlocal done
+        done += 1
+        results[codename] = (filename, error)
+        if error:
+            log.err('[%d/%d] %s: %s' % (done, total, codename, error))
+        else:
+            log.info('[%d/%d] %s: report is saved as %s.'
+                     % (done, total, codename, filename))
+
+    for codename in codenames:
+        if codename not in dossier.subject_ids:
+            finish(codename, None, 'There is no such subject.')
+    if done == total:
+        return results
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('fork'),
+                             initializer=set_worker_dossier,
+                             initargs=(dossier,)) as executor:
+        futures = {}
+        for codename in results.keys():
+            if codename not in dossier.subject_ids:
+                continue
+            filename = os.path.join(directory, '%s_%s.pdf'
+                                    % (ring_name, codename))
+            futures[executor.submit(
+                render_worker_report, codename, filename)] = (codename,
+                                                              filename)
+        for future in as_completed(futures):
+            codename, filename = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                finish(codename, None, str(e) or type(e).__name__)
+            else:
+                finish(codename, filename, None)
+    return results
 
 #####
@@ -4,8 +4,13 @@ This file contains unit tests.
 Ensa is run as external command, state is assessed with lambda.
 """
 import subprocess
+import contextlib
+import os
 import re
 import sys
+import math
+import tempfile
+import traceback
 
 class Test:
     @staticmethod
@@ -25,10 +30,13 @@ class Test:
         self.validator = validator
         self.arguments = arguments
         
+    def execute(self):
+        return Test.run_command('./ensa', self.payload)
+
     def run(self):
         print('\033[34m%50s\033[0m: ' % self.name, end='')
         sys.stdout.flush()
-        r, o, e = Test.run_command('./ensa', self.payload)
+        r, o, e = self.execute()
         o = o.decode()
         e = e.decode()
         #print(o.splitlines())
@@ -43,6 +51,42 @@ class Test:
             for line in e.splitlines():
                 print('   ', line)
 
+
+class ImportTest(Test):
+    """
+    Runs commands as a script with `./ensa --import`.
+    """
+    def execute(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write(self.payload + '\n')
+            f.flush()
+            return Test.run_command('./ensa --import %s' % f.name)
+
+
+class FunctionTest(Test):
+    """
+    Runs a function in this process instead of Ensa; the function
+    returns True on success.
+    """
+    def __init__(self, name, function, error_message=''):
+        self.name = name
+        self.function = function
+        self.error_message = ('(%s)' % error_message) if error_message else ''
+
+    def run(self):
+        print('\033[34m%50s\033[0m: ' % self.name, end='')
+        sys.stdout.flush()
+        try:
+            result = self.function()
+        except Exception:
+            traceback.print_exc()
+            result = False
+        if result:
+            print('\033[32;1mOK\033[0m')
+        else:
+            print('\033[31;1mFAIL\033[0m %s' % self.error_message)
+
+
 """ ring manipulation """ 
 ring_tests = [
     Test('create ring',
@@ -161,6 +205,319 @@ info_tests = [
 
 ]
 
+def plain(output):
+    """output without prompts and color codes"""
+    output = re.sub('\x1b\\[95m\x1b\\[01m[^\x1b]*\x1b\\[00m', '', output)
+    return re.sub('\x1b\\[[0-9;]*m', '', output)
+
+
+def has_lines(output, *patterns):
+    """every pattern matches some line of the output"""
+    lines = plain(output).splitlines()
+    return all(any(re.search(pattern, l) for l in lines)
+               for pattern in patterns)
+
+
+""" commands (network, keyword expression, search, cleanup, reports) """
+network_file = os.path.join(tempfile.gettempdir(), 'ensa_test.graphml')
+command_tests = [
+    Test('create ring with relationships',
+         ['ra', 'CMDTEST', 'command tests', 'now', 'creation reference', 'y',
+          'sa alice', 'iat firstname Alice', 'iak $last person',
+          'sa bob', 'sar alice sister',
+          'sa carol', 'sar bob friend',
+          'sa dave', 'iat firstname Dave', 'iak $last person secret',
+          'r'],
+         '',
+         lambda r,o,e,args: has_lines(o, r'^ *CMDTEST '),
+         {}),
+    Test('network summary',
+         ['rs CMDTEST', 'n'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'Subjects: +4$', r'Relationships: +2$',
+                   r'Components: +2 \(largest has 3 subjects\)$',
+                   r'^ +bob +2$'),
+         {}),
+    Test('network components',
+         ['rs CMDTEST', 'nc'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r' 3: alice, bob, carol$', r'^ +1: dave$'),
+         {}),
+    Test('relationships of a subject',
+         ['rs CMDTEST', 'nd bob'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'bob has 2 relationship\(s\):$',
+                   r'^ +alice +sister \(#[0-9]+\)$',
+                   r'^ +carol +friend \(#[0-9]+\)$'),
+         {}),
+    Test('path between subjects',
+         ['rs CMDTEST', 'np alice carol'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'alice-bob sister$', r'^bob-carol friend$'),
+         {}),
+    Test('export network',
+         ['rs CMDTEST', 'ne %s' % network_file],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'4 subjects and 2 relationships exported')
+         and open(args['file']).read().count('<node ') == 4,
+         {'file': network_file}),
+    Test('get information by keyword expression',
+         ['rs CMDTEST', 'igbke person and not secret'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'<alice> +firstname: Alice ')
+         and not has_lines(o, r'<dave>'),
+         {}),
+    Test('get information by nested keyword expression',
+         ['rs CMDTEST', 'igbke person & (secret | nothing)'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'<dave> +firstname: Dave ')
+         and not has_lines(o, r'<alice>'),
+         {}),
+    Test('reject invalid keyword expression',
+         ['rs CMDTEST', 'igbke person and'],
+         '',
+         lambda r,o,e,args:
+         has_lines(e, r'Invalid keyword expression'),
+         {}),
+    Test('full-text search',
+         ['rs CMDTEST', 'find dave'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'#S[0-9]+ +<dave> \(codename\) +dave$',
+                   r'^#I[0-9]+ +<dave> firstname \(value\) +Dave$'),
+         {}),
+    Test('full-text search in association notes',
+         ['rs CMDTEST', 'find sister'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'#A[0-9]+ +#A[0-9]+ \(note\) +alice-bob sister$'),
+         {}),
+    Test('delete unused keywords',
+         ['rs CMDTEST', 'sa orphan', 'ss orphan', 'iat note temporary',
+          'iak $last orphankeyword', 'sd orphan', 'rmc', 'rmc'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'[0-9]+ empty composite\(s\) and [1-9][0-9]* '
+                      r'unused keyword\(s\) deleted',
+                   r'0 empty composite\(s\) and 0 unused keyword\(s\) '
+                   r'deleted'),
+         {}),
+    Test('person report of unknown subject',
+         ['rs CMDTEST', 'srb nobody'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'0 of 1 report\(s\) created')
+         and has_lines(e, r'nobody: There is no such subject\.',
+                       r'Failed: nobody$'),
+         {}),
+    Test('person reports',
+         ['rs CMDTEST', 'ss bob', 'ig', 'iak $last person', 'srb'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'1 of 1 report\(s\) created')
+         and os.path.isfile('files/tmp/CMDTEST_bob.pdf'),
+         {}),
+    Test('delete ring with relationships',
+         ['rd CMDTEST', 'r'],
+         '',
+         lambda r,o,e,args: not has_lines(o, r'^ *CMDTEST '),
+         {}),
+]
+
+""" non-interactive import """
+import_tests = [
+    ImportTest('import commands',
+               ['ra', 'IMPORTTEST', 'import test', 'now',
+                'creation reference', 'y',
+                'sa alice', 'iat firstname Alice', 'sa bob'],
+               '',
+               lambda r,o,e,args:
+               r == 0
+               and re.search(r'^\[\.\] Imported 4 commands in ', o, re.M),
+               {}),
+    Test('imported data are stored',
+         ['rs IMPORTTEST', 's'],
+         '',
+         lambda r,o,e,args:
+         has_lines(o, r'^ *alice \(#', r'^ *bob \(#'),
+         {}),
+    Test('delete imported ring',
+         ['rd IMPORTTEST', 'r'],
+         '',
+         lambda r,o,e,args: not has_lines(o, r'^ *IMPORTTEST '),
+         {}),
+    ImportTest('stop import at failed command',
+               ['ra', 'IMPORTFAIL', 'import test', 'now',
+                'creation reference', 'y',
+                'sa alice', 'nosuchcommand', 'sa bob'],
+               '',
+               lambda r,o,e,args:
+               r != 0
+               and has_lines(e, r"Command 3 \('nosuchcommand'\) failed, "
+                                r"nothing is imported\.")
+               and not has_lines(o, r'bob'),
+               {}),
+    Test('failed import stores nothing',
+         ['r'],
+         '',
+         lambda r,o,e,args: not has_lines(o, r'^ *IMPORTFAIL '),
+         {}),
+]
+
+""" database schema and transactions """
+@contextlib.contextmanager
+def temporary_database():
+    """Database connected to a new file, config is restored afterwards"""
+    from source import log
+    from source import ensa
+    from source.db import Database
+    db_file = ensa.config['db.file'].value
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            ensa.config['db.file'].value = os.path.join(directory, 'test.db')
+            db = Database()
+            if not db.connect(''):
+                raise RuntimeError('cannot create database')
+            yield db
+        finally:
+            ensa.config['db.file'].value = db_file
+
+
+def migration_rollback_test():
+    from source.db import Database
+    migrations = list(Database.MIGRATIONS)
+    with temporary_database() as db:
+        try:
+            version = db.get_version()
+            schema = db.query("SELECT type, name, sql FROM sqlite_master")
+            """the last statement fails, nothing before it may stay"""
+            Database.MIGRATIONS.append([
+                "CREATE TABLE Broken(value)",
+                "CREATE INDEX Broken_value ON Broken(value)",
+                "ALTER TABLE Subject ADD COLUMN broken",
+                "INSERT INTO Missing VALUES(1)",
+            ])
+            if db.connect(''):
+                return False
+            return (db.get_version() == version
+                    and db.query("SELECT type, name, sql "
+                                 "FROM sqlite_master") == schema)
+        finally:
+            Database.MIGRATIONS[:] = migrations
+
+
+def migration_repeat_test():
+    with temporary_database() as db:
+        version = db.get_version()
+        """every migration runs again over the migrated schema"""
+        db.query("PRAGMA user_version = 0")
+        return db.connect('') and db.get_version() == version
+
+
+def failed_statement_test():
+    from source.db import sqlite
+    with temporary_database() as db:
+        try:
+            with db.transaction():
+                db.query("INSERT INTO Keyword(keyword) VALUES('kept?')")
+                db.query("INSERT INTO Missing VALUES(1)")
+        except sqlite.DatabaseError:
+            return not db.query("SELECT keyword FROM Keyword")
+        return False
+
+
+database_tests = [
+    FunctionTest('failed migration leaves schema unchanged',
+                 migration_rollback_test),
+    FunctionTest('migrations can run repeatedly', migration_repeat_test),
+    FunctionTest('failed statement rolls transaction back',
+                 failed_statement_test),
+]
+
+""" map tiles (served by a stand-in tile server from a local directory) """
+def tile_cache_test():
+    import geotiler
+    from PIL import Image
+    from source import log
+    from source import ensa
+    from source import map as ensa_map
+    options = {key: ensa.config[key].value
+               for key in ensa.config.keys() if key.startswith('map.')}
+    network_fetch_tiles = ensa_map.fetch_tiles
+    fetched = []
+
+    async def stand_in_fetch_tiles(tiles, num_workers):
+        for tile in tiles:
+            fetched.append(tile.url)
+            path = os.path.join(server, *tile.url.split('/')[-3:])
+            try:
+                with open(path, 'rb') as f:
+                    yield tile._replace(img=f.read(), error=None)
+            except OSError as e:
+                yield tile._replace(img=None, error=e)
+
+    def render(failed=None):
+        fetched.clear()
+        mm = geotiler.Map(center=(14.42, 50.08), size=(512, 512), zoom=15,
+                          provider='osm')
+        return ensa_map.render_map(mm, failed=failed).tobytes()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = os.path.join(directory, 'server')
+        """tiles around the map center, each of different color"""
+        center_x = int((14.42 + 180) / 360 * 2 ** 15)
+        center_y = int((1 - math.asinh(math.tan(math.radians(50.08)))
+                        / math.pi) / 2 * 2 ** 15)
+        for x in range(center_x - 3, center_x + 4):
+            os.makedirs(os.path.join(server, '15', str(x)))
+            for y in range(center_y - 3, center_y + 4):
+                Image.new('RGB', (256, 256),
+                          (x % 256, y % 256, 128)).save(
+                    os.path.join(server, '15', str(x), '%d.png' % y))
+        try:
+            ensa_map.fetch_tiles = stand_in_fetch_tiles
+            ensa.config['map.url'].value = 'http://stand-in/{z}/{x}/{y}.png'
+            ensa.config['map.source'].value = ''
+            ensa.config['map.offline'].value = False
+            ensa.config['map.cache'].value = os.path.join(directory, 'cache')
+            reference = render()
+            downloaded = list(fetched)
+            if not downloaded or render() != reference or fetched:
+                return False
+            """a tile the server fails to provide must not be cached"""
+            broken = os.path.join(server, *downloaded[0].split('/')[-3:])
+            os.remove(broken)
+            ensa.config['map.cache'].value = os.path.join(directory, 'new')
+            failed = []
+            render(failed)
+            if len(failed) != 1:
+                return False
+            cached = sum(len(names) for _, _, names in os.walk(
+                ensa.config['map.cache'].value))
+            if (cached != len(downloaded) - 1 or os.path.exists(
+                    ensa_map.get_tile_cache_path(failed[0], 'png'))):
+                return False
+            """...so it is requested again next time"""
+            render()
+            return fetched == downloaded[:1]
+        finally:
+            ensa_map.fetch_tiles = network_fetch_tiles
+            for key, value in options.items():
+                ensa.config[key].value = value
+
+
+map_tests = [
+    FunctionTest('tile cache with local stand-in tile server',
+                 tile_cache_test),
+]
+
 """ test cleanup (delete ring, validate on delete cascade etc.) """ 
 cleanup = [
     Test('delete subject',
@@ -182,6 +539,10 @@ enabled_tests = [
     ring_tests,
     subject_tests,
     info_tests,
+    command_tests,
+    import_tests,
+    database_tests,
+    map_tests,
     cleanup,
 ]
 